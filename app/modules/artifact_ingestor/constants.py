@@ -13,6 +13,7 @@ class DotAccessDict(dict):
 
 class Constants(DotAccessDict):
     blob_storage_base_url = "https://azure.core.blob.storage.azure.com"
+    max_file_upload_limit = 1073741824
     keyword_analysis_blob = {
         "container": "keyword_analysis",
         "base_path": "keyword_analysis_results/documents",
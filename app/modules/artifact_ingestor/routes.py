@@ -31,9 +31,7 @@ class StoreKeywordsSchema(Schema):
 class MainRoutes:
     def __init__(self, logger, app):
         self.blueprint = Blueprint("artifact_ingestor_routes", __name__)
-        self.artifact_ingestor_service = ArtifactIngestorService(
-            logger=logger, asyncio_event_loop=None
-        )
+        self.artifact_ingestor_service = ArtifactIngestorService(logger=logger)
         self.constants = Constants
         self.global_constants = GlobalConstants
         self.logger = logger
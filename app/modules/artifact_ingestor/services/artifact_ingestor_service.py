@@ -1,8 +1,9 @@
 import json
 import fitz
 import uuid
+import hashlib
 from logging import Logger
-from typing import List, Any
+from typing import List, Any, Iterable
 from collections import Counter
 from global_constants import GlobalConstants
 from app.modules.artifact_ingestor.constants import Constants
@@ -89,7 +90,6 @@ from app.modules.artifact_ingestor.enums.artifact_run_state_detail_stage_statuse
     ArtifactRunStateDetailStageStatus,
 )
 from utils.threading_tools import ThreadingTool
-from utils.task_visiblity_controller import TaskVisibilityController
 
 global_constants = GlobalConstants
 constants = Constants
@@ -99,10 +99,8 @@ class ArtifactIngestorService:
     def __init__(
         self,
         logger: Logger,
-        asyncio_event_loop,
     ):
         self.logger = logger
-        self.asyncio_event_loop = asyncio_event_loop
         self.azure_queue_util = AzureQueue()
         kv_client = AzureKeyVaultConnector()
         self.encoder = Encoding()
@@ -246,9 +244,6 @@ class ArtifactIngestorService:
                 mysql_run_state_detail_util,
             )
 
-            # If the execution time reaches visibility time then extend the visibility time
-            TaskVisibilityController.check_and_extend_visibility_timeout()
-
             if artifact_input_data.type == "MSDS":
                 self.update_artifact_run_state_stage(
                     artifact_run_state_id,
@@ -258,10 +253,7 @@ class ArtifactIngestorService:
                 )
 
                 # Analyze MSDS data
-                msds_analysis = self.analyze_msds(
-                    file=artifact_ingestor_input_data.artifact_file_url,
-                    artifact=artifact,
-                )
+                msds_analysis = self.analyze_msds(artifact=artifact)
 
                 self.logger.info(
                     f"Artifact-Upload : {thread_id} :: {artifact_run_state_id} : MSDS Anlyzed"
@@ -274,9 +266,6 @@ class ArtifactIngestorService:
                     mysql_run_state_detail_util,
                 )
 
-                # If the execution time reaches visibility time then extend the visibility time
-                TaskVisibilityController.check_and_extend_visibility_timeout()
-
                 self.update_artifact_run_state_stage(
                     artifact_run_state_id,
                     ArtifactRunStateDetailStageName.SAVING,
@@ -322,8 +311,7 @@ class ArtifactIngestorService:
                         mysql_run_state_detail_util,
                     )
 
-            # If the execution time reaches visibility time then extend the visibility time
-            TaskVisibilityController.check_and_extend_visibility_timeout()
+            return True
 
         except CommonException as e:
             self.logger.exception(
@@ -340,6 +328,7 @@ class ArtifactIngestorService:
                     artifact_run_state_id,
                     folder_upload_table_record_data,
                 )
+            return False
 
         except Exception as e:
             self.logger.error(
@@ -356,6 +345,7 @@ class ArtifactIngestorService:
                     artifact_run_state_id,
                     folder_upload_table_record_data,
                 )
+            return False
 
         finally:
             if mysql_session:
@@ -381,35 +371,71 @@ class ArtifactIngestorService:
         else:
             raise CommonException(501, f"{blob_storage_type} not found")
 
+    def get_blob_storage_file_path(self, id: str, blob_storage_type: BlobStorageTypes):
+        if blob_storage_type not in (
+            BlobStorageTypes.CUSTOMER,
+            BlobStorageTypes.GLOBAL,
+            BlobStorageTypes.KEYWORD_ANALYSIS,
+        ):
+            raise CommonException(
+                f"Invalid Blob storage type : {str(blob_storage_type)}"
+            )
+        return f"{self.get_blob_file_path(id, blob_storage_type)}/{id}"
+
     def validate_file(self, file_size, content_type):
-        max_file_upload_limit = 1073741824
         if file_size == 0:
             raise CommonException("Empty file")
         if content_type is None:
             raise CommonException("Unsupported file type")
-        if file_size > max_file_upload_limit:
+        if file_size > constants.max_file_upload_limit:
             raise CommonException("File size exceeds limit")
 
     def store_file_in_blob_storage(
-        self, id: str, file_byte_stream: Any, blob_storage_type: BlobStorageTypes
+        self,
+        id: str,
+        file_chunks: Iterable[bytes],
+        blob_storage_types: List[BlobStorageTypes],
+        content_type=None,
     ):
-        if blob_storage_type == BlobStorageTypes.CUSTOMER:
-            file_path = self.get_blob_file_path(id, BlobStorageTypes.CUSTOMER)
-        elif blob_storage_type == BlobStorageTypes.GLOBAL:
-            file_path = self.get_blob_file_path(id, BlobStorageTypes.GLOBAL)
-        elif blob_storage_type == BlobStorageTypes.KEYWORD_ANALYSIS:
-            file_path = self.get_blob_file_path(id, BlobStorageTypes.KEYWORD_ANALYSIS)
+        """
+        Stream the chunks of a file to its blob in every storage of
+        `blob_storage_types`, hashing them on the way. Returns the blob url by storage
+        type and the sha256 of the file, which is also stored in the blob metadata.
+        """
+        file_paths = {
+            blob_storage_type: self.get_blob_storage_file_path(id, blob_storage_type)
+            for blob_storage_type in blob_storage_types
+        }
+        file_hash = hashlib.sha256()
+        file_size = 0
+
+        def hash_file_chunks():
+            nonlocal file_size
+            for chunk in file_chunks:
+                # The declared size is checked upfront, this bounds what is streamed
+                file_size += len(chunk)
+                if file_size > constants.max_file_upload_limit:
+                    raise CommonException("File size exceeds limit")
+                file_hash.update(chunk)
+                yield chunk
 
-        else:
-            raise CommonException(
-                f"Invalid Blob storage type : {str(blob_storage_type)}"
+        try:
+            blob_urls = self.customer_blob_storage_util.upload_chunks_to_blob_storage(
+                file_paths=list(file_paths.values()),
+                chunks=hash_file_chunks(),
+                content_type=content_type,
+                metadata_provider=lambda: {"sha256": file_hash.hexdigest()},
             )
+        finally:
+            # Ends the download right away if the upload failed midway
+            close_file_chunks = getattr(file_chunks, "close", None)
+            if close_file_chunks is not None:
+                close_file_chunks()
 
-        return self.customer_blob_storage_util.upload_file_to_blob_storage(
-            type=global_constants.file_extensions.pdf,
-            file_data=file_byte_stream,
-            file_path=f"{file_path}/{id}",
-        )
+        return {
+            blob_storage_type: blob_urls[file_path]
+            for blob_storage_type, file_path in file_paths.items()
+        }, file_hash.hexdigest()
 
     def read_pdf_from_byte_stream(self, byte_stream):
         pdf_doc = fitz.open(global_constants.file_types.pdf, byte_stream)
@@ -612,21 +638,30 @@ class ArtifactIngestorService:
             raise e
 
     def get_artifact_file_properties(self, file_upload_type, file):
-        file_name, file_type, file_size, file_byte_stream = None, None, None, None
+        """
+        Properties of the file and a lazy iterator over its content in chunks, nothing
+        is downloaded before the chunks are iterated.
+        """
+        file_name, file_type, file_size, file_chunks = None, None, None, None
 
         match file_upload_type:
             case "LOCAL":
                 file_name = file.name
                 file_size = file.size
                 file_type = file.content_type
-                file_byte_stream = file.content
+                file_chunks = (
+                    file.content[index : index + global_constants.blob_upload_block_size]
+                    for index in range(
+                        0, len(file.content), global_constants.blob_upload_block_size
+                    )
+                )
 
             case "BLOB_STORAGE":
                 file_properties = self.internal_blob_storage_util.get_file_properties(
                     file
                 )
-                file_byte_stream = (
-                    self.internal_blob_storage_util.get_file_as_bytes_from_blob_storage(
+                file_chunks = (
+                    self.internal_blob_storage_util.get_file_chunks_from_blob_storage(
                         file
                     )
                 )
@@ -635,11 +670,12 @@ class ArtifactIngestorService:
                 file_type = file_properties.content_settings.content_type
 
             case "SHAREPOINT":
-                file_properties = self.asyncio_event_loop.run_until_complete(
+                file_properties = ThreadingTool.run_coroutine(
                     self.sharepoint_util.get_file_properties(file)
                 )
-                file_byte_stream = self.asyncio_event_loop.run_until_complete(
-                    self.sharepoint_util.read_file_from_share_point(file)
+                # Downloaded on the event loop, one chunk at a time as it is staged
+                file_chunks = ThreadingTool.iterate_async(
+                    self.sharepoint_util.stream_file_from_share_point(file_properties)
                 )
 
                 file_name = file_properties.name
@@ -653,23 +689,14 @@ class ArtifactIngestorService:
                     f"Unsupported file upload type : {str(file_upload_type)}"
                 )
 
-        return file_name, file_type, file_size, file_byte_stream
+        return file_name, file_type, file_size, file_chunks
 
-    def analyze_msds(self, file, artifact: Artifacts) -> MSDSAnalysis:
-        file_name, file_type, file_size, file_byte_stream = (
-            self.get_artifact_file_properties(artifact.file_upload_type, file)
-        )
-
-        # Upload msds pdf file to global system blob storage
-        self.store_file_in_blob_storage(
-            artifact.id, file_byte_stream, BlobStorageTypes.GLOBAL
-        )
-
-        # Upload msds pdf file to keyword-anlaysis blob storage
-        ka_file_uri = self.store_file_in_blob_storage(
-            artifact.id,
-            file_byte_stream,
-            BlobStorageTypes.KEYWORD_ANALYSIS,
+    def analyze_msds(self, artifact: Artifacts) -> MSDSAnalysis:
+        # The msds pdf file was uploaded to the keyword-anlaysis blob storage by add_artifact
+        ka_file_uri = self.customer_blob_storage_util.get_uri_from_path(
+            self.get_blob_storage_file_path(
+                artifact.id, BlobStorageTypes.KEYWORD_ANALYSIS
+            )
         )
 
         # TODO : Call entity-extracter service, instead of usign openai for analysis
@@ -679,7 +706,7 @@ class ArtifactIngestorService:
         self,
         artifact_input_data: ArtifactInputDTO,
     ) -> Artifacts:
-        file_name, file_type, file_size, file_byte_stream = (
+        file_name, file_type, file_size, file_chunks = (
             self.get_artifact_file_properties(
                 artifact_input_data.file_upload_type, artifact_input_data.file_url
             )
@@ -690,9 +717,19 @@ class ArtifactIngestorService:
         # Initialize artifact and save in database
         artifact = self.save_artifact_data_in_database(artifact_input_data)
 
-        # Upload msds pdf file to customer blob storage
-        self.store_file_in_blob_storage(
-            artifact.id, file_byte_stream, BlobStorageTypes.CUSTOMER
+        # Upload the file to customer blob storage, and an msds file to global and
+        # keyword-anlaysis blob storages too, downloading it only once
+        blob_storage_types = [BlobStorageTypes.CUSTOMER]
+        if artifact_input_data.type == "MSDS":
+            blob_storage_types += [
+                BlobStorageTypes.GLOBAL,
+                BlobStorageTypes.KEYWORD_ANALYSIS,
+            ]
+        blob_urls, file_hash = self.store_file_in_blob_storage(
+            artifact.id, file_chunks, blob_storage_types, file_type
+        )
+        self.logger.info(
+            f"Artifact-Upload : {ThreadingTool.get_thread_id()} :: {artifact.id} : Stored {file_name} in {len(blob_urls)} blob storages, sha256 {file_hash}"
         )
 
         return artifact
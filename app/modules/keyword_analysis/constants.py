@@ -23,7 +23,36 @@ class KeywordAnalysisConstants:
     max_pix_height = 10000
     min_pix_width = 50
     min_pix_height = 50
-
+    page_processing_threads = int(os.getenv("PageProcessingThreads", 4))
+    page_pipeline_max_pages_in_flight = int(
+        os.getenv("PagePipelineMaxPagesInFlight", 8)
+    )
+    page_pipeline_queue_size = int(os.getenv("PagePipelineQueueSize", 2))
+    page_render_backend = os.getenv("PageRenderBackend", "thread")
+    page_render_processes = int(os.getenv("PageRenderProcesses", os.cpu_count() or 1))
+    text_extraction_mode = os.getenv("TextExtractionMode", "hybrid")
+    ocr_cache_folder_name = "keyword_analysis_results/ocr_cache"
+    ocr_cache_backends = [
+        backend.strip()
+        for backend in os.getenv("OcrCacheBackends", "disk,blob").split(",")
+        if backend.strip()
+    ]
+    ocr_cache_directory = os.getenv(
+        "OcrCacheDirectory", "/tmp/keyword_analysis_ocr_cache"
+    )
+    ocr_cache_max_entries = int(os.getenv("OcrCacheMaxEntries", 10000))
+    # Keys missed in the blob OCR cache which are not looked up again
+    ocr_cache_blob_miss_max_entries = int(
+        os.getenv("OcrCacheBlobMissMaxEntries", 10000)
+    )
+    text_layer_min_characters = int(os.getenv("TextLayerMinCharacters", 50))
+    text_layer_max_unrecognised_ratio = float(
+        os.getenv("TextLayerMaxUnrecognisedRatio", 0.1)
+    )
+    keyword_set_cache_ttl_seconds = int(os.getenv("KeywordSetCacheTtlSeconds", 30))
+    keyword_phrase_match_across_lines = (
+        os.getenv("KeywordPhraseMatchAcrossLines", "false").lower() == "true"
+    )
 
 
     page_folder_prefix = "page_"
@@ -99,9 +128,18 @@ class KeywordAnalysisConstants:
         "source": "source",
         "total_pages": "total_pages",
         "file_status_if_previously_processed": "file_status_if_previously_processed",
+        "lane": "lane",
+        "max_messages": "max_messages",
     }
     api_parameters = DotAccessDict(api_parameters)
 
+    # Set by enqueue_api_request on the queued message of a request
+    queue_message_parameters = {
+        "idempotency_key": "idempotency_key",
+        "run_id": "run_id",
+    }
+    queue_message_parameters = DotAccessDict(queue_message_parameters)
+
     file_types = {
         "txt": "txt",
         "pdf": "pdf",
@@ -128,6 +166,8 @@ class KeywordAnalysisConstants:
         "file_analysis_json": "file_analysis.json",
         "page_image": "image.png",
         "page_text_json": "text.json",
+        "status_manifest": "status.json",
+        "checkpoint_log": "checkpoint.log",
     }
     file_names = DotAccessDict(file_names)
 
@@ -153,3 +193,38 @@ class KeywordAnalysisConstants:
     }
 
     blob_types = DotAccessDict(blob_types)
+
+    page_pipeline_stages = {
+        "render": "render",
+        "encode": "encode",
+        "ocr": "ocr",
+        "persist": "persist",
+    }
+    page_pipeline_stages = DotAccessDict(page_pipeline_stages)
+
+    page_pipeline_stage_workers = {
+        "encode": int(os.getenv("PagePipelineEncodeWorkers", 2)),
+        "ocr": page_processing_threads,
+        "persist": int(os.getenv("PagePipelinePersistWorkers", 2)),
+    }
+    page_pipeline_stage_workers = DotAccessDict(page_pipeline_stage_workers)
+
+    page_render_backends = {
+        "thread": "thread",
+        "process": "process",
+    }
+    page_render_backends = DotAccessDict(page_render_backends)
+
+    text_extraction_modes = {
+        # Every page is sent to azure vision
+        "ocr": "ocr",
+        # Pages with a usable embedded text layer skip azure vision
+        "hybrid": "hybrid",
+    }
+    text_extraction_modes = DotAccessDict(text_extraction_modes)
+
+    ocr_cache_backend_types = {
+        "disk": "disk",
+        "blob": "blob",
+    }
+    ocr_cache_backend_types = DotAccessDict(ocr_cache_backend_types)
@@ -5,6 +5,7 @@ from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
 from app.modules.keyword_analysis.services.file_analysis_service import (
     FileAnalysisService,
 )
+from common.poison_queue_service import PoisonQueueService
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
@@ -26,11 +27,17 @@ class StoreKeywordsSchema(Schema):
     keywords = fields.List(fields.Str(), required=True)
 
 
+class ReplayPoisonQueueSchema(Schema):
+    lane = fields.Str(required=False)
+    max_messages = fields.Int(required=False)
+
+
 class MainRoutes:
     def __init__(self, logger, app):
         self.blueprint = Blueprint("main_routes", __name__)
         self.file_analysis_service = FileAnalysisService(logger=logger)
         self.keywords_service = KeywordsService(logger=logger)
+        self.poison_queue_service = PoisonQueueService(logger=logger)
         self.constants = KeywordAnalysisConstants
         self.global_constants = GlobalConstants
         self.logger = logger
@@ -56,6 +63,11 @@ class MainRoutes:
             view_func=self.get_status_of_file_analysis,
             methods=[self.global_constants.rest_api_methods.get_api],
         )
+        self.blueprint.add_url_rule(
+            "/queue/poison/replay",
+            view_func=self.replay_poison_queue,
+            methods=[self.global_constants.rest_api_methods.post],
+        )
         self.blueprint.add_url_rule("/health", view_func=self.health_check)
 
         self.blueprint.add_url_rule(
@@ -78,6 +90,7 @@ class MainRoutes:
                 self.store_keywords,
                 self.get_keywords,
                 self.get_status_of_file_analysis,
+                self.replay_poison_queue,
                 self.health_check,
             ]:
                 spec.path(view=view)
@@ -345,6 +358,62 @@ class MainRoutes:
                 str(e),
             )
 
+    @basic_auth.required
+    def replay_poison_queue(self):
+        """
+        ---
+        post:
+          summary: Move quarantined queue messages back to their queue
+          requestBody:
+            required: false
+            content:
+              application/json:
+                schema: ReplayPoisonQueueSchema
+          responses:
+            200:
+              description: Number of messages replayed per lane
+            400:
+              description: Bad request
+            500:
+              description: Internal server error
+        """
+        try:
+            request_data = request.get_json(silent=True) or {}
+            lane = request_data.get(self.constants.api_parameters.lane)
+            max_messages = request_data.get(self.constants.api_parameters.max_messages)
+
+            if (
+                lane is not None
+                and lane not in self.global_constants.queue_lanes.values()
+            ):
+                return self.return_api_response(
+                    self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.invalid_request_data,
+                    f"Unknown lane : {lane}",
+                )
+            if max_messages is not None and (
+                not isinstance(max_messages, int) or max_messages < 1
+            ):
+                return self.return_api_response(
+                    self.global_constants.api_status_codes.bad_request,
+                    self.global_constants.api_response_messages.invalid_request_data,
+                    f"Invalid max_messages : {max_messages}",
+                )
+
+            replayed_counts = self.poison_queue_service.replay(lane, max_messages)
+
+            return self.return_api_response(
+                self.global_constants.api_status_codes.ok,
+                self.global_constants.api_response_messages.success,
+                replayed_counts,
+            )
+        except Exception as e:
+            self.logger.exception(f"POST API /queue/poison/replay :: Error : {str(e)}")
+            return self.return_api_response(
+                self.global_constants.api_status_codes.internal_server_error,
+                str(e),
+            )
+
     def health_check(self):
         """
         ---
@@ -1,24 +1,49 @@
-import re
 import os
 import time
 import json
-import asyncio
 import urllib.parse
+import threading
+import uuid
 from azure.core.exceptions import ResourceNotFoundError
 from azure.ai.vision.imageanalysis.models import VisualFeatures
 from connectors.azure_vision_connector import AzureVisionConnector
 from connectors.blob_storage_connector import AzureBlobStorageConnector
 from connectors.sharepoint_connector import SharePointConnector
 from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+from app.modules.keyword_analysis.services.page_pipeline import (
+    PagePipeline,
+    PageTask,
+    PipelineStage,
+    StageCounter,
+)
+from app.modules.keyword_analysis.services.page_renderer import (
+    ProcessPageRenderer,
+    encode_image,
+    render_dpi,
+    render_page_to_image,
+)
+from app.modules.keyword_analysis.services.page_text_layer import extract_text_layer
+from app.modules.keyword_analysis.services.ocr_cache import (
+    BlobOcrCacheBackend,
+    DiskOcrCacheBackend,
+    OcrResultCache,
+)
+from app.modules.keyword_analysis.services.keyword_matcher import KeywordMatcher
+from app.modules.keyword_analysis.services.keyword_set_cache import KeywordSetCache
+from app.modules.keyword_analysis.services.status_manifest import StatusManifestStore
+from app.modules.keyword_analysis.services.page_checkpoint_log import PageCheckpointLog
 from connectors.key_vault_connector import AzureKeyVaultConnector
 from utils.azure_blob_storage import BlobStorage
 from utils.sharepoint import SharePoint
+from utils.idempotency_marker import IdempotencyMarkerStore
 from global_constants import GlobalConstants
 from utils.azure_queue import AzureQueue
 from utils.exceptions import MaxProcessingTimeExceededException
 from utils.exceptions import FileNotSupportedException
 from utils.exceptions import Doc2PDFConversionError
+from utils.exceptions import StatusManifestConflictError
 from utils.encoding import Encoding
+from utils.threading_tools import ThreadingTool
 from azure.core.exceptions import HttpResponseError
 import random
 import fitz
@@ -48,8 +73,6 @@ class FileAnalysisService:
         self.blob_storage_util = BlobStorage(self.blob_storage_container_client, logger)
         self.sharepoint_util = SharePoint(self.sharepoint_client)
 
-        self.asyncio_event_loop = asyncio.new_event_loop()
-
         self.kv_client = AzureKeyVaultConnector()
 
         self.container_name = self.kv_client.get_secret(
@@ -60,58 +83,94 @@ class FileAnalysisService:
             global_constants.keys_of_key_vault_secrets.blob_storage_base_uri
         )
 
-        self.azure_queue_util = AzureQueue()
+        self.azure_queue_util = AzureQueue.for_message_type(
+            global_constants.queue_message_types.keyword_analysis
+        )
 
         self.encoder = Encoding()
         self.logger = logger
 
+        # Optional process pool backend for pdf rasterisation
+        self.page_renderer = (
+            ProcessPageRenderer(constants.page_render_processes)
+            if constants.page_render_backend == constants.page_render_backends.process
+            else None
+        )
+
+        self.page_pipeline_counters = {
+            stage: StageCounter(stage) for stage in constants.page_pipeline_stages.values()
+        }
+
+        self.ocr_cache = self.build_ocr_cache()
+
+        self.keyword_set_cache = KeywordSetCache(
+            self.blob_storage_container_client, self.logger
+        )
+
+        self.status_manifest_store = StatusManifestStore(
+            self.blob_storage_container_client, self.logger
+        )
+
+        self.page_checkpoint_log = PageCheckpointLog(
+            self.blob_storage_container_client, self.logger
+        )
+
+        self.idempotency_marker_store = IdempotencyMarkerStore(
+            self.blob_storage_container_client, self.logger
+        )
+
+    def build_ocr_cache(self):
+        backends = []
+        # The disk tier is always checked before the blob tier, whose misses cost a GET
+        backend_types = sorted(
+            constants.ocr_cache_backends,
+            key=lambda backend_type: backend_type != constants.ocr_cache_backend_types.disk,
+        )
+        for backend_type in backend_types:
+            if backend_type == constants.ocr_cache_backend_types.disk:
+                backends.append(
+                    DiskOcrCacheBackend.get_instance(
+                        constants.ocr_cache_directory, constants.ocr_cache_max_entries
+                    )
+                )
+            elif backend_type == constants.ocr_cache_backend_types.blob:
+                backends.append(BlobOcrCacheBackend(self.blob_storage_util))
+            else:
+                self.logger.warning(f"Unknown OCR cache backend : {backend_type}")
+        return OcrResultCache(backends, self.logger)
+
+    @staticmethod
     def search_keywords_in_extracted_text(
-        self,
         page_no,
-        keywords,
+        keyword_matcher: KeywordMatcher,
         extracted_text_data,
         page_analysis,
     ):
         keywords_matched_on_page = set()
         words_matched_on_page = []
-        for search_key in keywords:
-            for block in extracted_text_data[
-                constants.vision_ai_api_response_parameters.blocks
-            ]:
-                for line in block[constants.vision_ai_api_response_parameters.lines]:
-                    for word in line[constants.vision_ai_api_response_parameters.words]:
-                        # Search for pattern
-                        search_key_pattern = r"\b{}\b".format(re.escape(search_key))
-                        if (
-                            re.search(search_key_pattern.lower(), word["text"].lower())
-                        ) or (search_key.lower() in word["text"].lower()):
-
-                            # collect matched words in set
-                            words_matched_on_page.append(word["text"])
-                            # collect matched keywords in set
-                            keywords_matched_on_page.add(search_key)
-
-                            confidence = round(word["confidence"] * 100, 2)
-
-                            # This is to handle error which was getting while inserting word.bounding_polygon into json file
-                            bounding_polygon_json = [
-                                coord
-                                for point in word["boundingPolygon"]
-                                for coord in [point["x"], point["y"]]
-                            ]
-
-                            page_analysis[
-                                constants.page_analysis_parameters.matched_keywords
-                            ].append(
-                                {
-                                    constants.page_analysis_parameters.keyword: search_key,
-                                    constants.page_analysis_parameters.word: word[
-                                        "text"
-                                    ],
-                                    constants.page_analysis_parameters.confidence: confidence,
-                                    constants.page_analysis_parameters.coordinates: bounding_polygon_json,
-                                }
-                            )
+        for search_key, word in keyword_matcher.match_words(extracted_text_data):
+            # collect matched words in set
+            words_matched_on_page.append(word["text"])
+            # collect matched keywords in set
+            keywords_matched_on_page.add(search_key)
+
+            confidence = round(word["confidence"] * 100, 2)
+
+            # This is to handle error which was getting while inserting word.bounding_polygon into json file
+            bounding_polygon_json = [
+                coord
+                for point in word["boundingPolygon"]
+                for coord in [point["x"], point["y"]]
+            ]
+
+            page_analysis[constants.page_analysis_parameters.matched_keywords].append(
+                {
+                    constants.page_analysis_parameters.keyword: search_key,
+                    constants.page_analysis_parameters.word: word["text"],
+                    constants.page_analysis_parameters.confidence: confidence,
+                    constants.page_analysis_parameters.coordinates: bounding_polygon_json,
+                }
+            )
 
         page_analysis[
             constants.page_analysis_parameters.unique_matched_keywords_count
@@ -159,57 +218,170 @@ class FileAnalysisService:
         return result
 
     def convert_image_to_byte_array(self, image, page_no, file_name, thread_id):
-        image_byte_array = io.BytesIO()
-        image.save(image_byte_array, format="PNG")
-        image_data = image_byte_array.getvalue()
+        image_data = encode_image(image)
+        self.log_image_size(image_data, page_no, file_name, thread_id)
+        self.logger.info(
+            f"Thread : {thread_id} :: {file_name} : Page No - {page_no} : byte array converted to image"
+        )
+        return image_data
+
+    def log_image_size(self, image_data, page_no, file_name, thread_id):
         image_size_bytes = len(image_data)
         image_size_mb = image_size_bytes / (1024 * 1024)
         image_size_mb_rounded = round(image_size_mb, 2)
         self.logger.info(
             f"Thread : {thread_id} :: {file_name} : Page No - {page_no} : size is {image_size_mb_rounded} MB"
         )
-        self.logger.info(
-            f"Thread : {thread_id} :: {file_name} : Page No - {page_no} : byte array converted to image"
+
+    def get_global_keyword_set(self):
+        return self.keyword_set_cache.get(
+            f"{constants.keyword_analysis_results_folder}/{constants.file_names.global_keywords}"
         )
-        return image_data
 
-    def get_keywords_from_global_keywords(self, thread_id):
+    def update_progress_status(
+        self, status, file_path, content="", thread_id=-1, status_manifest=None
+    ):
+        """
+        Write the new status of a file in its status manifest with a single PUT.
+
+        `status_manifest` is the manifest last read or written by the caller, it is
+        returned updated so the next transition of the same file needs no read.
+        """
+        page_count = int(content) if status == constants.statuses.finished else None
+        error = content if status == constants.statuses.failed else None
+        try:
+            return self.status_manifest_store.transition(
+                file_path, status, page_count, error, status_manifest
+            )
+        except StatusManifestConflictError as e:
+            self.logger.exception(
+                f"Thread : {thread_id} :: update_progress_status : {file_path} StatusManifestConflictError -  :: {str(e)}"
+            )
+            raise
+
+    def mark_file_as_failed(
+        self, file_path, content="", thread_id=-1, status_manifest=None
+    ):
+        """
+        Move a file to failed from an error handler. A conflicting transition is only
+        logged so the error being handled is not replaced by it.
+        """
         try:
-            blob_client = self.blob_storage_container_client.get_blob_client(
-                f"{constants.keyword_analysis_results_folder}/{constants.file_names.global_keywords}"
+            return self.update_progress_status(
+                status=constants.statuses.failed,
+                file_path=file_path,
+                content=content,
+                thread_id=thread_id,
+                status_manifest=status_manifest,
             )
-            blob_data = blob_client.download_blob()
-            blob_data_in_bytes = blob_data.readall()
-            keywords_json = json.loads(blob_data_in_bytes)
-            id, keywords_arr = keywords_json.popitem()
-            return keywords_arr
+        except StatusManifestConflictError:
+            return None
 
-        except ResourceNotFoundError:
-            return []
+    def mark_quarantined_file_as_failed(
+        self, file_uri, reason, thread_id=-1, idempotency_key=None, run_id=None
+    ):
+        """
+        Move a file whose message was quarantined to failed with the reason, instead of
+        leaving it queued or processing with no message left to process it. The status
+        of a file whose run was superseded by a forced request is left to that request.
+        """
+        if idempotency_key is not None:
+            marker = self.idempotency_marker_store.read(
+                global_constants.queue_message_types.keyword_analysis, idempotency_key
+            )
+            if marker is not None and marker.owner != run_id:
+                return None
+            self.finish_run(idempotency_key, run_id, succeeded=False)
 
-    def update_progress_status(self, status, file_path, content="", thread_id=-1):
-        # Delete previous status files
-        for file_name in constants.status_files.values():
-            try:
-                self.blob_storage_util.delete_file_from_blob_storage(
-                    file_path=f"{file_path}/{file_name}", thread_id=thread_id
+        base64_encoded_file_uri = self.encoder.encode_data(file_uri)
+        blob_storage_output_folder_path_file_level = (
+            f"{constants.output_folder_name}/{base64_encoded_file_uri}"
+        )
+        file_status, status_manifest = self.get_status_manifest_of_file(
+            blob_storage_output_folder_path_file_level
+        )
+        if file_status not in (constants.statuses.queued, constants.statuses.processing):
+            return None
+        return self.mark_file_as_failed(
+            file_path=blob_storage_output_folder_path_file_level,
+            content=reason,
+            thread_id=thread_id,
+            status_manifest=status_manifest,
+        )
+
+    def get_file_version(self, file_uri, input_file_source):
+        """Etag of the content of a file, None if it can not be read"""
+        try:
+            if input_file_source == constants.input_file_sources.sharepoint:
+                drive_item = ThreadingTool.run_coroutine(
+                    self.sharepoint_util.get_file_properties(file_uri)
                 )
-            except ResourceNotFoundError as e:
-                self.logger.exception(
-                    f"Thread : {thread_id} :: update_progress_status : {file_path} ResourceNotFoundError -  :: {str(e)}"
+                return drive_item.e_tag
+            if input_file_source == constants.input_file_sources.blob:
+                file_path = self.get_file_path_from_blob_uri(
+                    urllib.parse.urlsplit(file_uri)
                 )
+                return self.blob_storage_util.get_file_properties(file_path).etag
+        except Exception as e:
+            # Reported by the worker, which fails on the same read
+            self.logger.warning(f"Version of {file_uri} unavailable :: {str(e)}")
+        return None
 
-        # Store new status file
-        self.blob_storage_util.upload_file_to_blob_storage(
-            type=constants.file_types.lock,
-            file_data=content,
-            file_path=f"{file_path}/{constants.status_files[status]}",
+    def get_idempotency_key(
+        self, file_uri, input_file_source, search_scope, local_keywords
+    ):
+        """
+        Key of a request : the same file content searched for the same keywords gets
+        the same key, a new file version or keyword set gets a new one. None if the
+        version of the file can not be read.
+        """
+        file_version = self.get_file_version(file_uri, input_file_source)
+        if not file_version:
+            return None
+        version_parts = [file_version, str(search_scope)]
+        if search_scope in (
+            constants.search_scopes.global_scope,
+            constants.search_scopes.both,
+        ):
+            keyword_set = self.keyword_set_cache.get(
+                f"{constants.keyword_analysis_results_folder}/{constants.file_names.global_keywords}"
+            )
+            version_parts.append(keyword_set.etag or "")
+        if search_scope in (
+            constants.search_scopes.local_scope,
+            constants.search_scopes.both,
+        ):
+            version_parts.append(json.dumps(sorted(local_keywords or [])))
+        return IdempotencyMarkerStore.get_key(file_uri, "\n".join(version_parts))
+
+    def finish_run(self, idempotency_key, run_id, succeeded=True):
+        # Messages enqueued before idempotency keys have none
+        if idempotency_key is None:
+            return
+        self.idempotency_marker_store.finish(
+            global_constants.queue_message_types.keyword_analysis,
+            idempotency_key,
+            run_id,
+            succeeded=succeeded,
         )
 
     def document_to_pdf(self, doc_path, output_folder):
             subprocess.run(['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', output_folder, doc_path], check=True, timeout=constants.conversion_timeout)
 
+    def get_status_manifest_of_file(self, directory_path):
+        """
+        Return (status, status manifest) of a file with one read of its status manifest.
+
+        Files analysed before the status manifest existed only have lock files, their
+        status is still probed from the lock files and their manifest is None.
+        """
+        status_manifest = self.status_manifest_store.read(directory_path)
+        if status_manifest is not None:
+            return status_manifest.status, status_manifest
+        return self.get_status_of_file_if_already_processed(directory_path), None
+
     def get_status_of_file_if_already_processed(self, directory_path):
+        # Legacy lock files status, see get_status_manifest_of_file
         status_files = {
             constants.statuses.processing: f"{directory_path}/{constants.file_names.processing_lock}",
             constants.statuses.finished: f"{directory_path}/{constants.file_names.finished_lock}",
@@ -245,7 +417,11 @@ class FileAnalysisService:
         blob_list = self.blob_storage_container_client.list_blobs(
             name_starts_with=file_path
         )
+        # The status manifest is kept, its etag is held by the run forcing the reprocessing
+        status_manifest_path = self.status_manifest_store.get_path(file_path)
         for blob in blob_list:
+            if blob.name == status_manifest_path:
+                continue
             try:
                 self.blob_storage_container_client.delete_blob(blob.name)
             except ResourceNotFoundError:
@@ -270,7 +446,7 @@ class FileAnalysisService:
 
         # Read file from SharePoint
         if source == constants.input_file_sources.sharepoint:
-            file_byte_stream = self.asyncio_event_loop.run_until_complete(
+            file_byte_stream = ThreadingTool.run_coroutine(
                 self.sharepoint_util.read_file_from_share_point(file_uri)
             )
             self.logger.info(
@@ -358,53 +534,76 @@ class FileAnalysisService:
         return pdf_document, pdf_document.page_count
 
 
-    def extract_page_text_dict_from_image_and_upload_image_to_blob(
-        self, image, page_image_blob_path, page_no, file_name, thread_id
-    ):
-        image_byte_array = self.convert_image_to_byte_array(
-            image, page_no, file_name, thread_id
-        )
+    def get_page_checkpoints_for_zombie_file(self, file_path, pages_count):
+        """
+        Rebuild the checkpoints of a file interrupted before the page checkpoint log
+        existed, from its page analysis files. Stops at the first page without one.
+        """
+        checkpoints = []
+        for page_no in range(1, pages_count + 1):
+            try:
+                page_analysis_json = self.blob_storage_util.get_file_content_from_blob_storage(
+                    file_path=f"{self.get_page_folder_path(file_path, page_no)}/{constants.file_names.page_analysis_json}"
+                )
+            except ResourceNotFoundError:
+                break
+            page_analysis_json = json.loads(page_analysis_json)
+            checkpoints.append(
+                self.get_page_checkpoint(
+                    page_analysis_json[constants.page_analysis_parameters.page_number],
+                    page_analysis_json,
+                )
+            )
+        return checkpoints
 
-        # Upload converted image to blob storage
-        image_url = self.blob_storage_util.upload_file_to_blob_storage(
-            type=constants.file_types.image,
-            file_data=image_byte_array,
-            file_path=page_image_blob_path,
-        )
+    def get_page_checkpoint(self, page_no, page_analysis):
+        return {
+            constants.page_analysis_parameters.page_number: page_no,
+            constants.page_analysis_parameters.words_count_matched: page_analysis[
+                constants.page_analysis_parameters.matched_keywords_count
+            ],
+        }
 
-        # Extract text from image using azure vision api
-        extracted_text_array_from_image = (
-            self.extract_text_from_image_using_azure_vision_api(
-                image_byte_array, page_no, file_name, thread_id
-            )
+    def add_page_checkpoint_to_file_analysis_result(
+        self, file_analysis_result, checkpoint
+    ):
+        file_analysis_result[constants.file_analysis_parameters.pagewise_data].append(
+            checkpoint
         )
-        page_text_json_words_dict = extracted_text_array_from_image.as_dict()
+        file_analysis_result[
+            constants.file_analysis_parameters.words_count_matched
+        ] += checkpoint[constants.page_analysis_parameters.words_count_matched]
 
-        return page_text_json_words_dict, image_url
+    def get_resume_point_of_file(self, file_path, thread_id):
+        """
+        Return the first unfinished page of an interrupted file and the file analysis
+        result of the pages finished before it, from one read of the page checkpoint log.
+        """
+        checkpoints = self.page_checkpoint_log.read(file_path)
+        if checkpoints is None:
+            checkpoints = self.get_page_checkpoints_for_zombie_file(
+                file_path,
+                pages_count=self.get_no_of_pages_processed_for_file(
+                    f"{file_path}/{constants.page_folder_prefix}"
+                ),
+            )
+            # Next resumes of this file read the log
+            self.page_checkpoint_log.start(file_path, checkpoints)
 
-    def get_file_analysis_json_for_zombie_file(self, file_path, pages_count):
         file_analysis_result = self.initialize_file_analysis_result()
-        for i in range(1, pages_count):
-            page_analysis_json = self.blob_storage_util.get_file_content_from_blob_storage(
-                file_path=f"{file_path}/{constants.page_folder_prefix}{'{:03}'.format(i)}/{constants.file_names.page_analysis_json}"
-            )
-            page_analysis_json = json.loads(page_analysis_json)
-            page_no = page_analysis_json[constants.page_analysis_parameters.page_number]
-            words_count_matched = page_analysis_json[
-                constants.page_analysis_parameters.matched_keywords_count
-            ]
-            file_analysis_result[
-                constants.file_analysis_parameters.pagewise_data
-            ].append(
-                {
-                    constants.page_analysis_parameters.page_number: page_no,
-                    constants.page_analysis_parameters.words_count_matched: words_count_matched,
-                }
+        next_page_no = 1
+        for checkpoint in checkpoints:
+            if checkpoint[constants.page_analysis_parameters.page_number] != next_page_no:
+                break
+            self.add_page_checkpoint_to_file_analysis_result(
+                file_analysis_result, checkpoint
             )
-            file_analysis_result[
-                constants.file_analysis_parameters.words_count_matched
-            ] += words_count_matched
-        return file_analysis_result
+            next_page_no += 1
+
+        self.logger.info(
+            f"Thread : {thread_id} :: {file_path} : resuming from page {next_page_no}"
+        )
+        return next_page_no, file_analysis_result
 
     def initialize_file_analysis_result(self):
         return {
@@ -439,12 +638,10 @@ class FileAnalysisService:
 
         if file_status == constants.statuses.processing:
             # If the file is in processing state already it means the process is not finished in one go
-            start_processing_from_page_no = self.get_no_of_pages_processed_for_file(
-                f"{blob_storage_output_folder_path_file_level}/{constants.page_folder_prefix}"
-            )
-            file_analysis_result = self.get_file_analysis_json_for_zombie_file(
-                blob_storage_output_folder_path_file_level,
-                pages_count=start_processing_from_page_no,
+            start_processing_from_page_no, file_analysis_result = (
+                self.get_resume_point_of_file(
+                    blob_storage_output_folder_path_file_level, thread_id
+                )
             )
 
         elif force:
@@ -454,8 +651,10 @@ class FileAnalysisService:
         elif file_status == constants.statuses.finished:
             process_file_with_already_extracted_text = True
         elif file_status == constants.statuses.failed:
-            start_processing_from_page_no = self.get_no_of_pages_processed_for_file(
-                f"{blob_storage_output_folder_path_file_level}/{constants.page_folder_prefix}"
+            start_processing_from_page_no, file_analysis_result = (
+                self.get_resume_point_of_file(
+                    blob_storage_output_folder_path_file_level, thread_id
+                )
             )
 
         return (
@@ -471,14 +670,25 @@ class FileAnalysisService:
         blob_storage_output_folder_path_file_level,
         thread_id,
     ):
+        """
+        Return the keywords searched in a file and their compiled matcher. Matchers of
+        the global keywords are cached on the version of the global keyword set,
+        together with the local keywords of the request for the "both" scope.
+        """
         words_to_search = []
+        keyword_matcher = None
         if search_scope == constants.search_scopes.local_scope:
             words_to_search = local_keywords
         elif search_scope == constants.search_scopes.global_scope:
-            words_to_search = self.get_keywords_from_global_keywords(thread_id)
+            keyword_set = self.get_global_keyword_set()
+            words_to_search = list(keyword_set.keywords)
+            keyword_matcher = keyword_set.get_matcher()
         elif search_scope == constants.search_scopes.both:
-            words_to_search = local_keywords
-            words_to_search.extend(self.get_keywords_from_global_keywords(thread_id))
+            keyword_set = self.get_global_keyword_set()
+            words_to_search = list(local_keywords) + list(keyword_set.keywords)
+            keyword_matcher = keyword_set.get_matcher(local_keywords)
+        if keyword_matcher is None:
+            keyword_matcher = KeywordMatcher.get_matcher(words_to_search)
 
         keywords_dict = {constants.keywords: words_to_search}
         keywords_json_url = self.blob_storage_util.upload_file_to_blob_storage(
@@ -486,49 +696,7 @@ class FileAnalysisService:
             file_data=keywords_dict,
             file_path=f"{blob_storage_output_folder_path_file_level}/{constants.file_names.keywords}",
         )
-        return words_to_search
-
-    def get_page_text_json(
-        self,
-        process_file_with_already_extracted_text,
-        page_image_blob_path,
-        page_text_array_blob_path,
-        page_no,
-        page_analysis,
-        file_name,
-        thread_id,
-        image=None,
-    ):
-        image_url = None
-        page_text_json = None
-        if process_file_with_already_extracted_text:
-            image_url = self.blob_storage_util.get_uri_from_path(page_image_blob_path)
-            page_text_json = self.read_json_from_blob(page_text_array_blob_path)
-        else:
-            # Get page text dict from image and upload image to blob storage
-            page_text_json, image_url = (
-                self.extract_page_text_dict_from_image_and_upload_image_to_blob(
-                    image=image,
-                    page_image_blob_path=page_image_blob_path,
-                    page_no=page_no,
-                    file_name=file_name,
-                    thread_id=thread_id,
-                )
-            )
-
-            # Save extracted text output in text file and store it in blob storage
-            self.blob_storage_util.upload_file_to_blob_storage(
-                type=constants.file_types.json,
-                file_data=page_text_json,
-                file_path=page_text_array_blob_path,
-            )
-
-        page_text_json = page_text_json[
-            constants.vision_ai_api_response_parameters.read_result
-        ]
-        page_analysis[constants.page_analysis_parameters.page_number] = page_no
-        page_analysis[constants.page_analysis_parameters.page_image] = image_url
-        return page_text_json
+        return words_to_search, keyword_matcher
 
     def process_memory(self):
         process = psutil.Process(os.getpid())
@@ -574,13 +742,7 @@ class FileAnalysisService:
         list: A list of PIL Image objects representing each page of the PDF.
         """
 
-        # Render the page to a pixmap (image)
-        pix = pdf_document.load_page(page_num).get_pixmap(dpi=200)
-
-        # Convert pixmap to an image using Pillow
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-        return img
+        return render_page_to_image(pdf_document, page_num)
 
     def get_file_name_from_file_uri(self, file_uri, input_file_source):
         file_name = ""
@@ -589,42 +751,141 @@ class FileAnalysisService:
             file_name = self.blob_storage_util.get_file_name_from_blob_uri(file_uri)
         return file_name
 
-    def process_page(
+    def get_page_folder_path(self, blob_storage_output_folder_path_file_level, page_no):
+        return f"{blob_storage_output_folder_path_file_level}/{constants.page_folder_prefix}{'{:03}'.format(page_no)}"
+
+    def render_page(
         self,
-        page_no,
+        task,
         pdf_document,
-        file_name,
-        blob_storage_output_folder_path_file_level,
+        render_document,
         process_file_with_already_extracted_text,
-        words_to_search,
+        file_name,
         thread_id,
+        document_lock,
     ):
-        # Initialing variables
-        page_processing_start_time = time.time()
-        blob_storage_output_folder_path_page_level = f"{blob_storage_output_folder_path_file_level}/{constants.page_folder_prefix}{'{:03}'.format(page_no)}"
-        page_text_array_blob_path = f"{blob_storage_output_folder_path_page_level}/{constants.file_names.page_text_json}"
-        page_image_blob_path = f"{blob_storage_output_folder_path_page_level}/{constants.file_names.page_image}"
+        task.start_time = time.time()
+        if process_file_with_already_extracted_text:
+            return task
 
-        # Initialize empty page analysis result json
-        page_analysis = self.initialize_page_analysis_result()
+        if constants.text_extraction_mode == constants.text_extraction_modes.hybrid:
+            with document_lock:
+                task.page_text_json = self.extract_page_text_layer(
+                    pdf_document, task.page_no, file_name, thread_id
+                )
+
+        if render_document is not None:
+            # Rendered and PNG encoded by a render worker process
+            task.image_bytes = self.page_renderer.render_page(
+                render_document, task.page_no - 1
+            )
+            self.log_image_size(task.image_bytes, task.page_no, file_name, thread_id)
+        else:
+            with document_lock:
+                task.image = self.pdf_doc_to_image(pdf_document, task.page_no - 1)
+        return task
+
+    def extract_page_text_layer(self, pdf_document, page_no, file_name, thread_id):
+        page_text_json = extract_text_layer(
+            pdf_document,
+            page_no - 1,
+            dpi=render_dpi,
+            min_characters=constants.text_layer_min_characters,
+            max_unrecognised_ratio=constants.text_layer_max_unrecognised_ratio,
+        )
+        if page_text_json is None:
+            self.logger.info(
+                f"Thread : {thread_id} :: {file_name} : Page No - {page_no} : No usable text layer, page needs OCR"
+            )
+        return page_text_json
+
+    def encode_page(self, task, file_name, thread_id):
+        if task.image is not None:
+            task.image_bytes = self.convert_image_to_byte_array(
+                task.image, task.page_no, file_name, thread_id
+            )
+            # Release the rendered pixmap as soon as it is encoded
+            task.image = None
+        return task
+
+    def extract_page_text(
+        self, task, process_file_with_already_extracted_text, file_name, thread_id
+    ):
+        page_image_blob_path = f"{task.page_folder_path}/{constants.file_names.page_image}"
+        page_text_array_blob_path = (
+            f"{task.page_folder_path}/{constants.file_names.page_text_json}"
+        )
 
         # Get page_text json from blob if already extracted or generate from image
-        image = (
-            None
-            if process_file_with_already_extracted_text
-            else self.pdf_doc_to_image(pdf_document, page_no - 1)
+        if process_file_with_already_extracted_text:
+            task.image_url = self.blob_storage_util.get_uri_from_path(
+                page_image_blob_path
+            )
+            task.page_text_json = self.read_json_from_blob(page_text_array_blob_path)
+            return task
+
+        # Upload converted image to blob storage
+        task.image_url = self.blob_storage_util.upload_file_to_blob_storage(
+            type=constants.file_types.image,
+            file_data=task.image_bytes,
+            file_path=page_image_blob_path,
         )
 
-        page_text_json = self.get_page_text_json(
-            process_file_with_already_extracted_text,
-            page_image_blob_path,
-            page_text_array_blob_path,
-            page_no,
-            page_analysis,
-            file_name,
-            thread_id,
-            image,
+        # Page text was taken from the pdf text layer, OCR is not needed
+        if task.page_text_json is not None:
+            self.logger.info(
+                f"Thread : {thread_id} :: {file_name} : Page No - {task.page_no} : Text layer used, OCR skipped"
+            )
+            task.image_bytes = None
+            return task
+
+        # Identical page images (re-uploads, boilerplate pages) reuse the stored OCR result
+        ocr_cache_key = OcrResultCache.get_key(task.image_bytes)
+        task.page_text_json = self.ocr_cache.get(ocr_cache_key)
+        if task.page_text_json is not None:
+            self.logger.info(
+                f"Thread : {thread_id} :: {file_name} : Page No - {task.page_no} : OCR cache hit {ocr_cache_key}"
+            )
+            task.image_bytes = None
+            return task
+
+        # Extract text from image using azure vision api
+        extracted_text_array_from_image = (
+            self.extract_text_from_image_using_azure_vision_api(
+                task.image_bytes, task.page_no, file_name, thread_id
+            )
         )
+        task.page_text_json = extracted_text_array_from_image.as_dict()
+        self.ocr_cache.put(ocr_cache_key, task.page_text_json)
+        task.image_bytes = None
+        return task
+
+    def persist_page(
+        self,
+        task,
+        process_file_with_already_extracted_text,
+        keyword_matcher,
+        file_name,
+        thread_id,
+    ):
+        page_no = task.page_no
+
+        # Save extracted text output in text file and store it in blob storage
+        if not process_file_with_already_extracted_text:
+            self.blob_storage_util.upload_file_to_blob_storage(
+                type=constants.file_types.json,
+                file_data=task.page_text_json,
+                file_path=f"{task.page_folder_path}/{constants.file_names.page_text_json}",
+            )
+
+        page_text_json = task.page_text_json[
+            constants.vision_ai_api_response_parameters.read_result
+        ]
+
+        # Initialize empty page analysis result json
+        page_analysis = self.initialize_page_analysis_result()
+        page_analysis[constants.page_analysis_parameters.page_number] = page_no
+        page_analysis[constants.page_analysis_parameters.page_image] = task.image_url
 
         # Concat all the text data from page text dict
         page_text_data = self.concat_json_dict_data_into_string(page_text_json)
@@ -633,7 +894,7 @@ class FileAnalysisService:
         self.blob_storage_util.upload_file_to_blob_storage(
             type=constants.file_types.txt,
             file_data=page_text_data,
-            file_path=f"{blob_storage_output_folder_path_page_level}/{constants.file_names.page_text}",
+            file_path=f"{task.page_folder_path}/{constants.file_names.page_text}",
         )
 
         # Logging
@@ -644,32 +905,150 @@ class FileAnalysisService:
         # Search keywords in extracted text data
         self.search_keywords_in_extracted_text(
             page_no,
-            words_to_search,
+            keyword_matcher,
             page_text_json,
             page_analysis,
         )
 
-        duration_ms = (time.time() - page_processing_start_time) * 1000
+        duration_ms = (time.time() - task.start_time) * 1000
 
         # Logging
         self.logger.info(
             f"Thread : {thread_id} :: {file_name} : Page No - {page_no} : Keywords analysis finished :: {duration_ms} milliseconds",
         )
 
-        # Update page analysis and file analysis json with page processing details
+        # Update page analysis json with page processing details
         page_analysis[constants.page_analysis_parameters.duration_ms] = duration_ms
-        page_analysis[constants.page_analysis_parameters.matched_keywords_count] = (
-            page_analysis[constants.page_analysis_parameters.matched_keywords_count]
-        )
 
         # Upload pagewise analysis json to blob storage
         self.blob_storage_util.upload_file_to_blob_storage(
             type=constants.file_types.json,
             file_data=page_analysis,
-            file_path=f"{blob_storage_output_folder_path_page_level}/{constants.file_names.page_analysis_json}",
+            file_path=f"{task.page_folder_path}/{constants.file_names.page_analysis_json}",
+        )
+
+        task.page_text_json = None
+        task.page_analysis = page_analysis
+        return task
+
+    def build_page_pipeline(
+        self,
+        pdf_document,
+        document_lock,
+        render_document,
+        file_name,
+        process_file_with_already_extracted_text,
+        keyword_matcher,
+        thread_id,
+    ):
+        stage_workers = constants.page_pipeline_stage_workers
+        stages = [
+            # PyMuPDF documents are not thread safe, so a document is rendered by one
+            # worker unless the pages are rendered by the render worker processes
+            PipelineStage(
+                constants.page_pipeline_stages.render,
+                lambda task: self.render_page(
+                    task,
+                    pdf_document,
+                    render_document,
+                    process_file_with_already_extracted_text,
+                    file_name,
+                    thread_id,
+                    document_lock,
+                ),
+                workers=(
+                    1 if render_document is None else self.page_renderer.max_workers
+                ),
+            ),
+            PipelineStage(
+                constants.page_pipeline_stages.encode,
+                lambda task: self.encode_page(task, file_name, thread_id),
+                workers=stage_workers.encode,
+            ),
+            PipelineStage(
+                constants.page_pipeline_stages.ocr,
+                lambda task: self.extract_page_text(
+                    task, process_file_with_already_extracted_text, file_name, thread_id
+                ),
+                workers=stage_workers.ocr,
+            ),
+            PipelineStage(
+                constants.page_pipeline_stages.persist,
+                lambda task: self.persist_page(
+                    task,
+                    process_file_with_already_extracted_text,
+                    keyword_matcher,
+                    file_name,
+                    thread_id,
+                ),
+                workers=stage_workers.persist,
+            ),
+        ]
+        return PagePipeline(
+            stages,
+            max_pages_in_flight=constants.page_pipeline_max_pages_in_flight,
+            queue_size=constants.page_pipeline_queue_size,
+            thread_name_prefix=f"page-pipeline-{thread_id}",
+        )
+
+    def process_pages(
+        self,
+        page_numbers,
+        pdf_document,
+        file_name,
+        blob_storage_output_folder_path_file_level,
+        process_file_with_already_extracted_text,
+        keyword_matcher,
+        thread_id,
+    ):
+        """
+        Stream pages through the render -> encode -> ocr -> persist pipeline.
+
+        Page analysis results are yielded strictly in page order.
+        """
+        render_document = None
+        if (
+            self.page_renderer is not None
+            and pdf_document is not None
+            and not process_file_with_already_extracted_text
+        ):
+            render_document = self.page_renderer.open_document(
+                pdf_document.stream or pdf_document.tobytes(), pdf_document.page_count
+            )
+
+        page_pipeline = self.build_page_pipeline(
+            pdf_document,
+            threading.Lock(),
+            render_document,
+            file_name,
+            process_file_with_already_extracted_text,
+            keyword_matcher,
+            thread_id,
         )
+        tasks = [
+            PageTask(
+                page_no,
+                self.get_page_folder_path(
+                    blob_storage_output_folder_path_file_level, page_no
+                ),
+            )
+            for page_no in page_numbers
+        ]
+        try:
+            for task in page_pipeline.run(tasks):
+                yield task.page_no, task.page_analysis
+        finally:
+            if render_document is not None:
+                self.page_renderer.close_document(render_document)
+            for counter in page_pipeline.counters.values():
+                self.page_pipeline_counters[counter.name].merge(counter)
+            self.logger.info(
+                f"Thread : {thread_id} :: {file_name} : Page pipeline stage counters : {json.dumps(page_pipeline.get_stage_counters())}"
+            )
 
-        return page_analysis
+    def get_page_pipeline_counters(self):
+        """Cumulative per stage throughput of every page processed by this service"""
+        return [counter.as_dict() for counter in self.page_pipeline_counters.values()]
 
     def process_queue_item(
         self,
@@ -680,11 +1059,11 @@ class FileAnalysisService:
         local_keywords,
         force,
         thread_id,
+        idempotency_key=None,
+        run_id=None,
     ):
+        status_manifest = None
         try:
-            start_Time = time.time()
-            max_processing_time = int(global_constants.queue_visiblity_time * 0.9)
-
             # Encode input file uri using base64 encoding
             base64_encoded_file_uri = self.encoder.encode_data(file_uri)
 
@@ -696,12 +1075,26 @@ class FileAnalysisService:
             # Get input file name from file uri
             file_name = self.get_file_name_from_file_uri(file_uri, input_file_source)
 
+            # Coalesce duplicates of a request onto the run which holds its key,
+            # including a run superseded by a forced request
+            if idempotency_key is not None:
+                claimed_marker = self.idempotency_marker_store.start(
+                    global_constants.queue_message_types.keyword_analysis,
+                    idempotency_key,
+                    run_id,
+                )
+                if claimed_marker is not None:
+                    self.logger.info(
+                        f"Thread : {thread_id} :: {file_name} : Duplicate of run {claimed_marker.owner} ({claimed_marker.status}), skipped - {base64_encoded_file_uri}"
+                    )
+                    return queue_item
+
             self.logger.info(
                 f"[Memory: {self.process_memory()}, CPU: {self.system_cpu()}] Thread : {thread_id} :: {file_name} : {base64_encoded_file_uri} : Processing started",
             )
 
             # Get status of file if already processed
-            file_status = self.get_status_of_file_if_already_processed(
+            file_status, status_manifest = self.get_status_manifest_of_file(
                 blob_storage_output_folder_path_file_level
             )
 
@@ -723,15 +1116,17 @@ class FileAnalysisService:
             )
             file_processing_start_time = time.time()
 
-            # Upload processing.lock file to blob storage to indicate file is in progress
-            self.update_progress_status(
+            # Update status manifest to indicate file is in progress
+            previous_status_manifest = status_manifest
+            status_manifest = self.update_progress_status(
                 status=constants.statuses.processing,
                 file_path=blob_storage_output_folder_path_file_level,
                 thread_id=thread_id,
+                status_manifest=status_manifest,
             )
 
             # Get keywords from blob storage based on search scope and upload keywords to blob storage
-            words_to_search = self.get_words_to_search(
+            words_to_search, keyword_matcher = self.get_words_to_search(
                 search_scope,
                 local_keywords,
                 blob_storage_output_folder_path_file_level,
@@ -741,10 +1136,16 @@ class FileAnalysisService:
             # Get total no of pages in file and pdf document object
             pdf_document, total_no_of_pages_in_file = None, 0
             if process_file_with_already_extracted_text:
-                # file is always going to be status false so counting no of pages processed already
-                total_no_of_pages_in_file = self.get_no_of_pages_processed_for_file(
-                    f"{blob_storage_output_folder_path_file_level}/{constants.page_folder_prefix}"
-                )
+                if (
+                    previous_status_manifest is not None
+                    and previous_status_manifest.page_count is not None
+                ):
+                    total_no_of_pages_in_file = previous_status_manifest.page_count
+                else:
+                    # file is always going to be status false so counting no of pages processed already
+                    total_no_of_pages_in_file = self.get_no_of_pages_processed_for_file(
+                        f"{blob_storage_output_folder_path_file_level}/{constants.page_folder_prefix}"
+                    )
             else:
                 pdf_document, total_no_of_pages_in_file = (
                     self.get_input_file_from_input_source(
@@ -757,56 +1158,27 @@ class FileAnalysisService:
             self.logger.info(
                 f"Thread : {thread_id} :: {file_name} : Page analysis process started for {base64_encoded_file_uri}",
             )
-            for i in range(
-                start_processing_from_page_no - 1, total_no_of_pages_in_file
+            if start_processing_from_page_no == 1:
+                self.page_checkpoint_log.start(blob_storage_output_folder_path_file_level)
+            for page_no, page_analysis in self.process_pages(
+                range(start_processing_from_page_no, total_no_of_pages_in_file + 1),
+                pdf_document,
+                file_name,
+                blob_storage_output_folder_path_file_level,
+                process_file_with_already_extracted_text,
+                keyword_matcher,
+                thread_id,
             ):
-                page_no = i + 1
-                # Process pdf page and get page analysis json
-                page_analysis = self.process_page(
-                    page_no,
-                    pdf_document,
-                    file_name,
-                    blob_storage_output_folder_path_file_level,
-                    process_file_with_already_extracted_text,
-                    words_to_search,
-                    thread_id,
-                )
-
                 # Update file analysis json with page processing details
-                words_count_matched = page_analysis[
-                    constants.page_analysis_parameters.matched_keywords_count
-                ]
-                file_analysis_result[
-                    constants.file_analysis_parameters.words_count_matched
-                ] += words_count_matched
-                file_analysis_result[
-                    constants.file_analysis_parameters.pagewise_data
-                ].append(
-                    {
-                        constants.page_analysis_parameters.page_number: page_no,
-                        constants.page_analysis_parameters.words_count_matched: words_count_matched,
-                    }
+                page_checkpoint = self.get_page_checkpoint(page_no, page_analysis)
+                self.add_page_checkpoint_to_file_analysis_result(
+                    file_analysis_result, page_checkpoint
                 )
 
-                # If the processing time exceeds max processing time then raise exception
-                if time.time() - start_Time > max_processing_time:
-                    visibility_timeout = (time.time() - start_Time) + int(
-                        global_constants.queue_visiblity_time
-                    )
-                    self.logger.info(
-                        f"Thread : {thread_id} :: {file_name} : visibility timeout is {visibility_timeout} seconds for {base64_encoded_file_uri}",
-                    )
-                    updated_message = self.azure_queue_util.update_queue_message(
-                        message_id=queue_item.id,
-                        pop_receipt=queue_item.pop_receipt,
-                        visibility_timeout=visibility_timeout,
-                    )
-                    queue_item = updated_message
-                    max_processing_time = visibility_timeout * 0.9
-
-                    self.logger.warn(
-                        f"Thread : {thread_id} :: {file_name} : Max processing time reached for file {base64_encoded_file_uri} - increasing visibility timeout to {max_processing_time}.",
-                    )
+                # Pages are yielded in page order, so the log always ends at the last finished page
+                self.page_checkpoint_log.append(
+                    blob_storage_output_folder_path_file_level, page_checkpoint
+                )
             self.logger.info(
                 f"Thread : {thread_id} :: {file_name} : Page analysis process completed for {base64_encoded_file_uri}",
             )
@@ -829,14 +1201,17 @@ class FileAnalysisService:
                 file_path=f"{blob_storage_output_folder_path_file_level}/{constants.file_names.file_analysis_json}",
             )
 
-            # Upload finished.lock file with count of pages to blob storage to indicate file processing finished
-            self.update_progress_status(
+            # Update status manifest with count of pages to indicate file processing finished
+            status_manifest = self.update_progress_status(
                 status=constants.statuses.finished,
                 file_path=blob_storage_output_folder_path_file_level,
                 content=str(total_no_of_pages_in_file),
                 thread_id=thread_id,
+                status_manifest=status_manifest,
             )
 
+            self.finish_run(idempotency_key, run_id)
+
             # Logging
             self.logger.info(
                 f"Thread : {thread_id} :: File Name: {file_name}, Status: File analysis process completed Total Pages: {total_no_of_pages_in_file}, Base64 Encoded File URI: {base64_encoded_file_uri}, File URI: {file_uri}, Total Duration: {duration_ms} milliseconds."
@@ -859,45 +1234,55 @@ class FileAnalysisService:
             self.logger.exception(
                 f"Thread : {thread_id} :: {file_name} : FileNotSupported - {base64_encoded_file_uri} :: {str(e)}"
             )
-            self.update_progress_status(
-                status=constants.statuses.failed,
+            self.mark_file_as_failed(
                 file_path=blob_storage_output_folder_path_file_level,
                 content=constants.messages.unsupported_file_type,
                 thread_id=thread_id,
+                status_manifest=status_manifest,
             )
+            self.finish_run(idempotency_key, run_id, succeeded=False)
         
         except Doc2PDFConversionError as e:
             self.logger.exception(
                 f"Thread : {thread_id} :: {file_name} : Document to PDF conversion error - {base64_encoded_file_uri} :: {str(e)}"
             )
-            self.update_progress_status(
-                status=constants.statuses.failed,
+            self.mark_file_as_failed(
                 file_path=blob_storage_output_folder_path_file_level,
                 content=constants.messages.conversion_error,
                 thread_id=thread_id,
+                status_manifest=status_manifest,
             )
+            self.finish_run(idempotency_key, run_id, succeeded=False)
         except ResourceNotFoundError as e:
             self.logger.exception(
                 f"Thread : {thread_id} :: {file_name} : ResourceNotFoundError - {base64_encoded_file_uri} :: {str(e)}"
             )
-            self.update_progress_status(
-                status=constants.statuses.failed,
+            self.mark_file_as_failed(
                 file_path=blob_storage_output_folder_path_file_level,
                 content=constants.messages.blob_not_found,
                 thread_id=thread_id,
+                status_manifest=status_manifest,
+            )
+            self.finish_run(idempotency_key, run_id, succeeded=False)
+
+        except StatusManifestConflictError as e:
+            # Another run moved the file meanwhile, its status is left to that run
+            self.logger.warning(
+                f"Thread : {thread_id} :: {file_name} : Status changed concurrently, processing abandoned - {base64_encoded_file_uri} :: {str(e)}"
             )
 
         except Exception as e:
             self.logger.exception(
                 f"Thread : {thread_id} :: {file_name} : Error while processing file - {base64_encoded_file_uri} :: {str(e)}"
             )
-            # Upload failed.lock file with error to blob storage to indicate file processing finished
-            self.update_progress_status(
-                status=constants.statuses.failed,
+            # Update status manifest with error to indicate file processing finished
+            self.mark_file_as_failed(
                 file_path=blob_storage_output_folder_path_file_level,
                 content=str(e),
                 thread_id=thread_id,
+                status_manifest=status_manifest,
             )
+            self.finish_run(idempotency_key, run_id, succeeded=False)
         return queue_item
     def enqueue_api_request(
         self, file_uri, search_scope, input_file_source, local_keywords, force
@@ -912,50 +1297,98 @@ class FileAnalysisService:
         )
 
         # Get status of file if already processed
-        file_status = self.get_status_of_file_if_already_processed(
+        file_status, status_manifest = self.get_status_manifest_of_file(
             blob_storage_output_folder_path_file_level
         )
 
+        file_is_in_processing_response = {
+            global_constants.api_response_parameters.status: global_constants.api_status_codes.bad_request,
+            global_constants.api_response_parameters.message: constants.messages.file_is_in_processing,
+        }
+
+        accepted_response = {
+            global_constants.api_response_parameters.status: global_constants.api_status_codes.ok,
+            global_constants.api_response_parameters.message: global_constants.api_response_messages.accepted,
+            global_constants.api_response_parameters.identifier: base64_encoded_file_uri,
+        }
+
         # Return response if file is already processing irrespective of force flag
         if file_status == constants.statuses.processing:
-            return {
-                global_constants.api_response_parameters.status: global_constants.api_status_codes.bad_request,
-                global_constants.api_response_parameters.message: constants.messages.file_is_in_processing,
-            }
+            return file_is_in_processing_response
+
+        # A queued file already covers the request, unless it is forced
+        if file_status == constants.statuses.queued and not force:
+            return accepted_response
+
+        # Without a file version the request can not be told apart, it is enqueued as it is
+        idempotency_key = self.get_idempotency_key(
+            file_uri, input_file_source, search_scope, local_keywords
+        )
+        run_id = uuid.uuid4().hex
+
+        # An identical request which is queued or already ran is answered by it, a forced
+        # request supersedes it unless it is processing meanwhile
+        if idempotency_key is not None and not self.idempotency_marker_store.claim(
+            global_constants.queue_message_types.keyword_analysis,
+            idempotency_key,
+            run_id,
+            take_over=force,
+        ):
+            if force:
+                return file_is_in_processing_response
+            self.logger.info(
+                f"{base64_encoded_file_uri} : Identical request already processed, not enqueued again"
+            )
+            return accepted_response
 
         # Add api payload to azure queue
         args = {
+            "message_type": global_constants.queue_message_types.keyword_analysis,
             constants.api_parameters.file_uri: file_uri,
             constants.api_parameters.source: input_file_source,
             constants.api_parameters.search_scope: search_scope,
             constants.api_parameters.keywords: local_keywords,
             constants.api_parameters.force: force,
+            constants.queue_message_parameters.idempotency_key: idempotency_key,
+            constants.queue_message_parameters.run_id: run_id,
         }
 
-        # Upload queued.lock file to indicate file is queued for processing
-        self.update_progress_status(
-            status=constants.statuses.queued,
-            file_path=blob_storage_output_folder_path_file_level,
-        )
+        # Mark the file as queued, unless its status changed since it was read
+        # (another request queued it or a worker started processing it)
+        try:
+            status_manifest = self.status_manifest_store.write(
+                blob_storage_output_folder_path_file_level,
+                constants.statuses.queued,
+                manifest=status_manifest,
+            )
+        except StatusManifestConflictError:
+            self.finish_run(idempotency_key, run_id, succeeded=False)
+            return file_is_in_processing_response
 
         try:
             self.azure_queue_util.enqueue(args)
         except Exception as e:
-            # Upload failed.lock file to indicate that enqueue failed
+            # Update status manifest to indicate that enqueue failed
             self.update_progress_status(
                 status=constants.statuses.failed,
                 file_path=blob_storage_output_folder_path_file_level,
                 content=str(e),
+                status_manifest=status_manifest,
             )
+            self.finish_run(idempotency_key, run_id, succeeded=False)
 
-        return {
-            global_constants.api_response_parameters.status: global_constants.api_status_codes.ok,
-            global_constants.api_response_parameters.message: global_constants.api_response_messages.accepted,
-            global_constants.api_response_parameters.identifier: base64_encoded_file_uri,
-        }
+        return accepted_response
 
     def get_status_of_file(self, file_url_base64_encoded):
         base_dir = f"{constants.output_folder_name}/{file_url_base64_encoded}"
+
+        status_manifest = self.status_manifest_store.read(base_dir)
+        if status_manifest is not None:
+            return self.get_status_response_from_status_manifest(
+                base_dir, status_manifest
+            )
+
+        # Files analysed before the status manifest existed only have lock files
         processing_lock_path = f"{base_dir}/{constants.file_names.processing_lock}"
         finished_lock_path = f"{base_dir}/{constants.file_names.finished_lock}"
         failed_lock_path = f"{base_dir}/{constants.file_names.failed_lock}"
@@ -990,3 +1423,23 @@ class FileAnalysisService:
                 }
 
         return constants.statuses.failed, constants.messages.invalid_file_identifier
+
+    def get_status_response_from_status_manifest(self, base_dir, status_manifest):
+        if status_manifest.status in (
+            constants.statuses.queued,
+            constants.statuses.processing,
+        ):
+            return constants.statuses.processing, None
+
+        elif status_manifest.status == constants.statuses.finished:
+            return constants.statuses.success, {
+                constants.api_parameters.total_pages: int(status_manifest.page_count),
+                constants.api_parameters.file_uri: f"{self.blob_storage_base_uri}/{base_dir}",
+            }
+
+        elif status_manifest.status == constants.statuses.failed:
+            return constants.statuses.failed, {
+                global_constants.api_response_parameters.reason: f"{global_constants.api_response_messages.error_while_processing_file} : {status_manifest.error}"
+            }
+
+        return constants.statuses.failed, constants.messages.invalid_file_identifier
@@ -42,9 +42,29 @@ class HandleQueueItem:
                 local_keywords=keywords_to_search,
                 force=force,
                 thread_id=thread_id,
+                idempotency_key=request_data.get(
+                    constants.queue_message_parameters.idempotency_key
+                ),
+                run_id=request_data.get(constants.queue_message_parameters.run_id),
             )
             return file_uri, processed_queue_item
 
         # If the queue item is not json serielized it will throw an error
         except json.decoder.JSONDecodeError:
             self.logger.exception(f"Thread : {thread_id} :: Error while decoding json")
+
+    def mark_queue_item_as_failed(self, queue_item, reason, thread_id):
+        """Report the file of a quarantined message as failed"""
+        request_data = json.loads(queue_item.content)
+        file_uri = request_data.get(constants.api_parameters.file_uri)
+        if not file_uri:
+            return
+        self.file_analysis_service.mark_quarantined_file_as_failed(
+            file_uri,
+            reason,
+            thread_id,
+            idempotency_key=request_data.get(
+                constants.queue_message_parameters.idempotency_key
+            ),
+            run_id=request_data.get(constants.queue_message_parameters.run_id),
+        )
@@ -0,0 +1,219 @@
+import string
+import threading
+from collections import OrderedDict, deque
+from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+
+constants = KeywordAnalysisConstants
+
+
+class KeywordMatcher:
+    """
+    Finds every keyword contained in the OCR words of a page in a single pass per word.
+
+    A keyword matches a word when its lower case text is contained in the lower case
+    word text. All keywords are compiled once into an Aho-Corasick automaton, so the
+    cost per word depends on the word length instead of the number of keywords.
+
+    Keywords made of several words ("perfluorooctanoic acid") are also indexed in a
+    token trie and matched against consecutive words of a line, or of a block when
+    phrases may cross lines. A phrase match is reported as one word whose bounding
+    polygon encloses every word of the phrase.
+
+    Matchers are immutable once built and are shared across pages and threads.
+    """
+
+    _matchers = OrderedDict()
+    _matchers_lock = threading.Lock()
+    max_cached_matchers = 32
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+
+        # Duplicate keywords share a pattern but are reported once per occurrence
+        self.pattern_keyword_indices = {}
+        self.matches_every_word = []
+        for keyword_index, keyword in enumerate(self.keywords):
+            pattern = keyword.lower()
+            if not pattern:
+                # An empty keyword is contained in every word
+                self.matches_every_word.append(keyword_index)
+                continue
+            self.pattern_keyword_indices.setdefault(pattern, []).append(keyword_index)
+
+        self._build_automaton(list(self.pattern_keyword_indices))
+        self._build_phrase_trie()
+
+    @classmethod
+    def get_matcher(cls, keywords):
+        """Return the compiled matcher of a keyword list, building it only once"""
+        cache_key = tuple(keywords)
+        with cls._matchers_lock:
+            matcher = cls._matchers.get(cache_key)
+            if matcher is not None:
+                cls._matchers.move_to_end(cache_key)
+                return matcher
+
+        matcher = cls(cache_key)
+        with cls._matchers_lock:
+            cls._matchers[cache_key] = matcher
+            while len(cls._matchers) > cls.max_cached_matchers:
+                cls._matchers.popitem(last=False)
+        return matcher
+
+    def _build_automaton(self, patterns):
+        self._transitions = [{}]
+        self._outputs = [[]]
+        for pattern in patterns:
+            state = 0
+            for character in pattern:
+                next_state = self._transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(self._transitions)
+                    self._transitions[state][character] = next_state
+                    self._transitions.append({})
+                    self._outputs.append([])
+                state = next_state
+            self._outputs[state].append(pattern)
+
+        # Breadth first pass to link every state with its longest proper suffix state
+        self._failures = [0] * len(self._transitions)
+        states_to_visit = deque(self._transitions[0].values())
+        while states_to_visit:
+            state = states_to_visit.popleft()
+            for character, next_state in self._transitions[state].items():
+                states_to_visit.append(next_state)
+                failure_state = self._failures[state]
+                while failure_state and character not in self._transitions[failure_state]:
+                    failure_state = self._failures[failure_state]
+                self._failures[next_state] = self._transitions[failure_state].get(
+                    character, 0
+                )
+                self._outputs[next_state] = (
+                    self._outputs[next_state] + self._outputs[self._failures[next_state]]
+                )
+
+    @staticmethod
+    def normalise_token(text):
+        return text.strip(string.punctuation).lower()
+
+    def _build_phrase_trie(self):
+        # Every trie node is {token: child node}, keyword indices of the phrases
+        # ending on a node are stored under the None key
+        self._phrase_trie = {}
+        self.has_phrases = False
+        for keyword_index, keyword in enumerate(self.keywords):
+            tokens = [self.normalise_token(token) for token in keyword.split()]
+            if len(tokens) < 2 or not all(tokens):
+                continue
+            node = self._phrase_trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node.setdefault(None, []).append(keyword_index)
+            self.has_phrases = True
+
+    def find_phrases(self, words):
+        """Yield (start position, keyword index, matched words) for every phrase in words"""
+        tokens = [
+            self.normalise_token(word[constants.vision_ai_api_response_parameters.text])
+            for word in words
+        ]
+        for start in range(len(tokens)):
+            node = self._phrase_trie.get(tokens[start])
+            end = start
+            while node is not None:
+                for keyword_index in node.get(None, []):
+                    yield start, keyword_index, words[start : end + 1]
+                end += 1
+                if end == len(tokens):
+                    break
+                node = node.get(tokens[end])
+
+    @staticmethod
+    def merge_words(words):
+        """Single word covering a phrase, with the enclosing box as bounding polygon"""
+        points = [point for word in words for point in word["boundingPolygon"]]
+        min_x = min(point["x"] for point in points)
+        min_y = min(point["y"] for point in points)
+        max_x = max(point["x"] for point in points)
+        max_y = max(point["y"] for point in points)
+        return {
+            constants.vision_ai_api_response_parameters.text: " ".join(
+                word[constants.vision_ai_api_response_parameters.text] for word in words
+            ),
+            "confidence": min(word["confidence"] for word in words),
+            # Same corner order as the bounding polygons returned by azure vision
+            "boundingPolygon": [
+                {"x": min_x, "y": min_y},
+                {"x": max_x, "y": min_y},
+                {"x": max_x, "y": max_y},
+                {"x": min_x, "y": max_y},
+            ],
+        }
+
+    def find_keyword_indices(self, text):
+        """Return the indices of the keywords contained in text, in keyword order"""
+        found_patterns = set()
+        state = 0
+        transitions = self._transitions
+        failures = self._failures
+        outputs = self._outputs
+        for character in text.lower():
+            while state and character not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(character, 0)
+            if outputs[state]:
+                found_patterns.update(outputs[state])
+
+        keyword_indices = list(self.matches_every_word)
+        for pattern in found_patterns:
+            keyword_indices.extend(self.pattern_keyword_indices[pattern])
+        return sorted(keyword_indices)
+
+    def match_words(self, extracted_text_data, phrases_across_lines=None):
+        """
+        Return (keyword, word) pairs for a page in the order of the former
+        keyword -> block -> line -> word loops.
+        """
+        if phrases_across_lines is None:
+            phrases_across_lines = constants.keyword_phrase_match_across_lines
+
+        matches_by_keyword_index = {}
+        keyword_indices_by_text = {}
+        position = 0
+        for block in extracted_text_data[constants.vision_ai_api_response_parameters.blocks]:
+            phrase_streams = []
+            for line in block[constants.vision_ai_api_response_parameters.lines]:
+                line_words = line[constants.vision_ai_api_response_parameters.words]
+                if phrases_across_lines and phrase_streams:
+                    phrase_streams[-1][1].extend(line_words)
+                else:
+                    phrase_streams.append((position, list(line_words)))
+
+                for word in line_words:
+                    word_text = word[constants.vision_ai_api_response_parameters.text]
+                    keyword_indices = keyword_indices_by_text.get(word_text)
+                    if keyword_indices is None:
+                        keyword_indices = self.find_keyword_indices(word_text)
+                        keyword_indices_by_text[word_text] = keyword_indices
+                    for keyword_index in keyword_indices:
+                        matches_by_keyword_index.setdefault(keyword_index, []).append(
+                            (position, word)
+                        )
+                    position += 1
+
+            if not self.has_phrases:
+                continue
+            for stream_position, words in phrase_streams:
+                for start, keyword_index, phrase_words in self.find_phrases(words):
+                    matches_by_keyword_index.setdefault(keyword_index, []).append(
+                        (stream_position + start, self.merge_words(phrase_words))
+                    )
+
+        pairs = []
+        for keyword_index in sorted(matches_by_keyword_index):
+            # Words and phrases of a keyword are reported in page order
+            matches = sorted(
+                matches_by_keyword_index[keyword_index], key=lambda match: match[0]
+            )
+            pairs.extend((self.keywords[keyword_index], word) for _, word in matches)
+        return pairs
@@ -0,0 +1,151 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError
+from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+from app.modules.keyword_analysis.services.keyword_matcher import KeywordMatcher
+
+constants = KeywordAnalysisConstants
+
+
+class KeywordSet:
+    """
+    A stored keyword set with the etag of its blob and its compiled matchers.
+
+    A new version of the blob is a new KeywordSet, so its matchers, alone or combined
+    with the local keywords of a request, are cached for that version only.
+    """
+
+    def __init__(self, id, keywords, etag, last_modified=None):
+        self.id = id
+        self.keywords = keywords
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = time.monotonic()
+        self._matcher = None
+        self._local_matchers = OrderedDict()
+        self._local_matchers_lock = threading.Lock()
+
+    def is_newer_than(self, keyword_set: "KeywordSet"):
+        # A missing blob has no last modified time and is never newer
+        if self.last_modified is None:
+            return False
+        if keyword_set.last_modified is None:
+            return True
+        return self.last_modified > keyword_set.last_modified
+
+    def get_matcher(self, local_keywords=()) -> KeywordMatcher:
+        """Matcher of the local keywords followed by the keywords of the set"""
+        if not local_keywords:
+            # Compiled on first use, KeywordMatcher.get_matcher makes concurrent builds share one matcher
+            if self._matcher is None:
+                self._matcher = KeywordMatcher.get_matcher(self.keywords)
+            return self._matcher
+
+        cache_key = tuple(local_keywords)
+        with self._local_matchers_lock:
+            matcher = self._local_matchers.get(cache_key)
+            if matcher is not None:
+                self._local_matchers.move_to_end(cache_key)
+                return matcher
+
+        matcher = KeywordMatcher(list(local_keywords) + list(self.keywords))
+        with self._local_matchers_lock:
+            self._local_matchers[cache_key] = matcher
+            while len(self._local_matchers) > KeywordMatcher.max_cached_matchers:
+                self._local_matchers.popitem(last=False)
+        return matcher
+
+
+class KeywordSetCache:
+    """
+    Process wide cache of the keyword set blobs, shared by every queue thread and API request.
+
+    A cached set is served without any blob request for `keyword_set_cache_ttl_seconds`,
+    after that it is revalidated with a download conditional on its etag, so the blob
+    is only transferred again when it changed. Sets written by this process replace the
+    cached entry immediately, sets written by other processes are seen after the TTL.
+    A download finishing after a newer set was cached never replaces it.
+    """
+
+    _entries = {}
+    _lock = threading.Lock()
+
+    def __init__(self, blob_storage_container_client, logger):
+        self.blob_storage_container_client = blob_storage_container_client
+        self.logger = logger
+
+    def get(self, file_path) -> KeywordSet:
+        with KeywordSetCache._lock:
+            cached_keyword_set = KeywordSetCache._entries.get(file_path)
+
+        if (
+            cached_keyword_set is not None
+            and time.monotonic() - cached_keyword_set.checked_at
+            < constants.keyword_set_cache_ttl_seconds
+        ):
+            return cached_keyword_set
+
+        blob_client = self.blob_storage_container_client.get_blob_client(file_path)
+        try:
+            if cached_keyword_set is not None and cached_keyword_set.etag is not None:
+                blob_data = blob_client.download_blob(
+                    etag=cached_keyword_set.etag,
+                    match_condition=MatchConditions.IfModified,
+                )
+            else:
+                blob_data = blob_client.download_blob()
+            keywords_json = json.loads(blob_data.readall())
+            keyword_set = self.build_keyword_set(
+                keywords_json,
+                blob_data.properties.etag,
+                blob_data.properties.last_modified,
+            )
+            self.logger.info(f"Keyword-Set-Cache : {file_path} loaded : {len(keyword_set.keywords)} keywords")
+
+        except ResourceNotModifiedError:
+            cached_keyword_set.checked_at = time.monotonic()
+            return cached_keyword_set
+
+        except ResourceNotFoundError:
+            keyword_set = KeywordSet(None, [], None)
+
+        with KeywordSetCache._lock:
+            current_keyword_set = KeywordSetCache._entries.get(file_path)
+            # Replaced or invalidated while downloading : only a newer set is cached
+            if (
+                current_keyword_set is not None
+                and current_keyword_set is not cached_keyword_set
+                and not keyword_set.is_newer_than(current_keyword_set)
+            ):
+                return current_keyword_set
+            KeywordSetCache._entries[file_path] = keyword_set
+        return keyword_set
+
+    def put(self, file_path, keywords_json, etag, last_modified=None):
+        keyword_set = self.build_keyword_set(keywords_json, etag, last_modified)
+        with KeywordSetCache._lock:
+            current_keyword_set = KeywordSetCache._entries.get(file_path)
+            if current_keyword_set is not None and current_keyword_set.is_newer_than(
+                keyword_set
+            ):
+                return current_keyword_set
+            KeywordSetCache._entries[file_path] = keyword_set
+        return keyword_set
+
+    def invalidate(self, file_path):
+        with KeywordSetCache._lock:
+            KeywordSetCache._entries.pop(file_path, None)
+
+    @staticmethod
+    def build_keyword_set(keywords_json, etag, last_modified=None):
+        # A keyword set blob holds a single {id: keywords} entry, the id is only
+        # reported when the blob is well formed, the last keywords are searched anyway
+        if not keywords_json:
+            return KeywordSet(None, [], etag, last_modified)
+        id, keywords = list(keywords_json.items())[-1]
+        return KeywordSet(
+            id if len(keywords_json) == 1 else None, keywords, etag, last_modified
+        )
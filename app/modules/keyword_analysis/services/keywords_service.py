@@ -2,6 +2,7 @@ import json
 from connectors.blob_storage_connector import AzureBlobStorageConnector
 from azure.core.exceptions import ResourceNotFoundError
 from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+from app.modules.keyword_analysis.services.keyword_set_cache import KeywordSetCache
 
 
 constants = KeywordAnalysisConstants
@@ -11,6 +12,9 @@ class KeywordsService:
     def __init__(self,logger):
         self.blob_storage_connector = AzureBlobStorageConnector()
         self.blob_storage_container_client = self.blob_storage_connector.connect()
+        self.keyword_set_cache = KeywordSetCache(
+            self.blob_storage_container_client, logger
+        )
 
     def get_keyword_from_blob_storage(self, file_path):
         try:
@@ -25,21 +29,24 @@ class KeywordsService:
     def store_keywords_in_blob_storage(self, keywords_json, file_path):
         blob_client = self.blob_storage_container_client.get_blob_client(file_path)
         keywords_json_data = json.dumps(keywords_json).encode(constants.utf_8)
-        blob_client.upload_blob(
+        # Stale keywords must not be served while the upload is in progress
+        self.keyword_set_cache.invalidate(file_path)
+        upload_response = blob_client.upload_blob(
             keywords_json_data,
             blob_type=constants.blob_types.block_blob,
             overwrite=True,
         )
+        self.keyword_set_cache.put(
+            file_path,
+            keywords_json,
+            upload_response.get("etag"),
+            upload_response.get("last_modified"),
+        )
         return blob_client.url
 
     def get_keywords_id(self):
         file_path = f"{constants.keyword_analysis_results_folder}/{constants.file_names.global_keywords}"
-        keywords_json = self.get_keyword_from_blob_storage(file_path)
-        keyword_id_list = list(keywords_json.keys())
-        if len(keyword_id_list) == 1:
-            return keyword_id_list[0]
-        else:
-            return None
+        return self.keyword_set_cache.get(file_path).id
 
     def store_keywords(self, id, keywords):
         file_path = f"{constants.keyword_analysis_results_folder}/{constants.file_names.global_keywords}"
@@ -0,0 +1,203 @@
+import os
+import json
+import hashlib
+import threading
+from logging import Logger
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+from azure.core.exceptions import ResourceNotFoundError
+from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+from utils.azure_blob_storage import BlobStorage
+
+constants = KeywordAnalysisConstants
+
+
+class OcrCacheBackend:
+    name = "base"
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, page_text_json):
+        raise NotImplementedError
+
+
+class DiskOcrCacheBackend(OcrCacheBackend):
+    """
+    Least recently used OCR results on local disk, shared by every service of the process.
+    """
+
+    name = "disk"
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Rebuild the recency order from the files left by a previous run
+        file_names = [
+            file_name
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith(".json")
+        ]
+        file_names.sort(
+            key=lambda file_name: os.path.getmtime(
+                os.path.join(self.directory, file_name)
+            )
+        )
+        self._entries = OrderedDict(
+            (file_name[: -len(".json")], None) for file_name in file_names
+        )
+
+    @classmethod
+    def get_instance(cls, directory, max_entries):
+        with cls._instances_lock:
+            if directory not in cls._instances:
+                cls._instances[directory] = cls(directory, max_entries)
+            return cls._instances[directory]
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            with open(self.get_path(key), "r", encoding=constants.utf_8) as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+
+    def put(self, key, page_text_json):
+        # Write to a temporary file first so readers never see a partial entry
+        with NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".tmp", delete=False, encoding=constants.utf_8
+        ) as temp_file:
+            json.dump(page_text_json, temp_file)
+        os.replace(temp_file.name, self.get_path(key))
+
+        evicted_keys = []
+        with self._lock:
+            self._entries[key] = None
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                evicted_keys.append(evicted_key)
+
+        for evicted_key in evicted_keys:
+            try:
+                os.remove(self.get_path(evicted_key))
+            except FileNotFoundError:
+                pass
+
+
+class BlobOcrCacheBackend(OcrCacheBackend):
+    """
+    OCR results in the keyword analysis blob container, shared by every pod.
+
+    Every lookup missed by the disk tier costs a blob GET, answered with a 404 for a
+    page never analysed before. The keys last missed by the process are remembered (at
+    most `ocr_cache_blob_miss_max_entries`) so the same page is not looked up again,
+    e.g. on a retry of the file, until it is put by this process.
+    """
+
+    name = "blob"
+    # Shared by every service of the process, as the blob container is
+    _missed_keys = OrderedDict()
+    _missed_keys_lock = threading.Lock()
+
+    def __init__(self, blob_storage_util: BlobStorage):
+        self.blob_storage_util = blob_storage_util
+
+    def get_path(self, key):
+        return f"{constants.ocr_cache_folder_name}/{key}.json"
+
+    def is_known_missing(self, key):
+        with BlobOcrCacheBackend._missed_keys_lock:
+            if key not in BlobOcrCacheBackend._missed_keys:
+                return False
+            BlobOcrCacheBackend._missed_keys.move_to_end(key)
+            return True
+
+    def remember_missing(self, key):
+        with BlobOcrCacheBackend._missed_keys_lock:
+            BlobOcrCacheBackend._missed_keys[key] = None
+            BlobOcrCacheBackend._missed_keys.move_to_end(key)
+            while (
+                len(BlobOcrCacheBackend._missed_keys)
+                > constants.ocr_cache_blob_miss_max_entries
+            ):
+                BlobOcrCacheBackend._missed_keys.popitem(last=False)
+
+    def get(self, key):
+        if self.is_known_missing(key):
+            return None
+        try:
+            return json.loads(
+                self.blob_storage_util.get_file_content_from_blob_storage(
+                    self.get_path(key)
+                )
+            )
+        except ResourceNotFoundError:
+            self.remember_missing(key)
+            return None
+
+    def put(self, key, page_text_json):
+        self.blob_storage_util.upload_file_to_blob_storage(
+            type=constants.file_types.json,
+            file_data=page_text_json,
+            file_path=self.get_path(key),
+        )
+        with BlobOcrCacheBackend._missed_keys_lock:
+            BlobOcrCacheBackend._missed_keys.pop(key, None)
+
+
+class OcrResultCache:
+    """
+    Content addressed cache of azure vision results, keyed by the hash of the page image.
+
+    Backends are checked in order (fastest first), a hit in a slower backend is copied
+    to the faster ones. Cache failures are logged and never fail the page.
+    """
+
+    key_version = "v1"
+
+    def __init__(self, backends, logger: Logger):
+        self.backends = backends
+        self.logger = logger
+
+    @classmethod
+    def get_key(cls, image_bytes):
+        return f"{cls.key_version}-{hashlib.sha256(image_bytes).hexdigest()}"
+
+    def get(self, key):
+        for index, backend in enumerate(self.backends):
+            try:
+                page_text_json = backend.get(key)
+            except Exception as e:
+                self.logger.warning(f"OCR-Cache : {backend.name} : get {key} failed : {str(e)}")
+                continue
+
+            if page_text_json is not None:
+                for faster_backend in self.backends[:index]:
+                    self.put_in_backend(faster_backend, key, page_text_json)
+                return page_text_json
+        return None
+
+    def put(self, key, page_text_json):
+        for backend in self.backends:
+            self.put_in_backend(backend, key, page_text_json)
+
+    def put_in_backend(self, backend, key, page_text_json):
+        try:
+            backend.put(key, page_text_json)
+        except Exception as e:
+            self.logger.warning(f"OCR-Cache : {backend.name} : put {key} failed : {str(e)}")
@@ -0,0 +1,62 @@
+import json
+from azure.core.exceptions import ResourceNotFoundError
+from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+
+constants = KeywordAnalysisConstants
+
+
+class PageCheckpointLog:
+    """
+    Append only log of the pages finished for a file, one json line per page.
+
+    Pages are appended in page order once their analysis is stored, so an interrupted
+    run is resumed from a single read of the log : the finished pages rebuild the file
+    analysis result and processing restarts from the page following the last entry.
+    """
+
+    def __init__(self, blob_storage_container_client, logger):
+        self.blob_storage_container_client = blob_storage_container_client
+        self.logger = logger
+
+    def get_path(self, file_path):
+        return f"{file_path}/{constants.file_names.checkpoint_log}"
+
+    def get_blob_client(self, file_path):
+        return self.blob_storage_container_client.get_blob_client(
+            self.get_path(file_path)
+        )
+
+    def read(self, file_path):
+        """Return the checkpoints of a file in page order, None if it has no log"""
+        try:
+            log_data = self.get_blob_client(file_path).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+        checkpoints = []
+        for line in log_data.decode(constants.utf_8).splitlines():
+            if not line.strip():
+                continue
+            try:
+                checkpoints.append(json.loads(line))
+            except json.JSONDecodeError:
+                self.logger.warning(
+                    f"Page-Checkpoint-Log : {file_path} : skipped invalid line {line!r}"
+                )
+        return checkpoints
+
+    def start(self, file_path, checkpoints=()):
+        """Start a new log for a file, replacing any previous log"""
+        blob_client = self.get_blob_client(file_path)
+        blob_client.create_append_blob()
+        if checkpoints:
+            blob_client.append_block(self.serialise(checkpoints))
+
+    def append(self, file_path, checkpoint):
+        self.get_blob_client(file_path).append_block(self.serialise([checkpoint]))
+
+    @staticmethod
+    def serialise(checkpoints):
+        return "".join(
+            json.dumps(checkpoint) + "\n" for checkpoint in checkpoints
+        ).encode(constants.utf_8)
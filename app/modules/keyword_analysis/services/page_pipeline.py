@@ -0,0 +1,218 @@
+import time
+import queue
+import threading
+
+
+class PageTask:
+    """State of a single page while it moves through the page pipeline."""
+
+    def __init__(self, page_no, page_folder_path):
+        self.page_no = page_no
+        self.page_folder_path = page_folder_path
+        self.start_time = None
+        self.image = None
+        self.image_bytes = None
+        self.image_url = None
+        self.page_text_json = None
+        self.page_analysis = None
+
+
+class PipelineStage:
+    def __init__(self, name, handler, workers=1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+
+
+class StageCounter:
+    """Thread safe throughput counter of a pipeline stage."""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.pages = 0
+        self.failed_pages = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds, wait_seconds, failed=False):
+        with self._lock:
+            self.pages += 1
+            self.failed_pages += 1 if failed else 0
+            self.busy_seconds += busy_seconds
+            self.wait_seconds += wait_seconds
+
+    def add_wall_time(self, wall_seconds):
+        with self._lock:
+            self.wall_seconds += wall_seconds
+
+    def merge(self, other):
+        with self._lock:
+            self.workers = other.workers
+            self.pages += other.pages
+            self.failed_pages += other.failed_pages
+            self.busy_seconds += other.busy_seconds
+            self.wait_seconds += other.wait_seconds
+            self.wall_seconds += other.wall_seconds
+
+    def as_dict(self):
+        with self._lock:
+            capacity_seconds = self.workers * self.wall_seconds
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "pages": self.pages,
+                "failed_pages": self.failed_pages,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "queue_wait_seconds": round(self.wait_seconds, 3),
+                "pages_per_second": (
+                    round(self.pages / self.busy_seconds * self.workers, 2)
+                    if self.busy_seconds
+                    else 0
+                ),
+                # Share of the stage worker time spent doing work, the busiest stage is the bottleneck
+                "utilisation": (
+                    round(self.busy_seconds / capacity_seconds, 2)
+                    if capacity_seconds
+                    else 0
+                ),
+            }
+
+
+class PagePipeline:
+    """
+    Streams pages through a chain of stages connected by bounded queues.
+
+    Every stage runs on its own worker threads, so CPU bound stages (render, encode)
+    overlap with network bound stages (OCR, persist). At most `max_pages_in_flight`
+    pages are inside the pipeline at any time, including pages which finished out of
+    order and wait to be handed back, which bounds the rendered images held in memory.
+    Results are yielded in the order the tasks were given.
+    """
+
+    poll_interval_seconds = 0.1
+
+    def __init__(
+        self, stages, max_pages_in_flight, queue_size=1, thread_name_prefix="page"
+    ):
+        self.stages = stages
+        self.max_pages_in_flight = max(1, int(max_pages_in_flight))
+        self.queue_size = max(1, int(queue_size))
+        self.thread_name_prefix = thread_name_prefix
+        self.counters = {
+            stage.name: StageCounter(stage.name, stage.workers) for stage in stages
+        }
+
+    def run(self, tasks):
+        tasks = list(tasks)
+        stage_queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        pages_in_flight = threading.BoundedSemaphore(self.max_pages_in_flight)
+        stop_event = threading.Event()
+        results = {}
+        results_condition = threading.Condition()
+
+        def put_until_stopped(target_queue, item):
+            while not stop_event.is_set():
+                try:
+                    target_queue.put(item, timeout=self.poll_interval_seconds)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def finish(sequence_no, task, error):
+            with results_condition:
+                results[sequence_no] = (task, error)
+                results_condition.notify_all()
+
+        def feed():
+            for sequence_no, task in enumerate(tasks):
+                # Backpressure : wait until a page leaves the pipeline
+                while not pages_in_flight.acquire(timeout=self.poll_interval_seconds):
+                    if stop_event.is_set():
+                        return
+                if not put_until_stopped(
+                    stage_queues[0], (sequence_no, task, time.perf_counter())
+                ):
+                    return
+
+        def work(stage_index):
+            stage = self.stages[stage_index]
+            counter = self.counters[stage.name]
+            input_queue = stage_queues[stage_index]
+            is_last_stage = stage_index == len(self.stages) - 1
+
+            while not stop_event.is_set():
+                try:
+                    sequence_no, task, queued_at = input_queue.get(
+                        timeout=self.poll_interval_seconds
+                    )
+                except queue.Empty:
+                    continue
+
+                started_at = time.perf_counter()
+                try:
+                    task = stage.handler(task)
+                except Exception as e:
+                    counter.record(
+                        time.perf_counter() - started_at,
+                        started_at - queued_at,
+                        failed=True,
+                    )
+                    finish(sequence_no, task, e)
+                    continue
+
+                finished_at = time.perf_counter()
+                counter.record(finished_at - started_at, started_at - queued_at)
+
+                if is_last_stage:
+                    finish(sequence_no, task, None)
+                elif not put_until_stopped(
+                    stage_queues[stage_index + 1], (sequence_no, task, finished_at)
+                ):
+                    return
+
+        threads = [
+            threading.Thread(
+                target=feed, name=f"{self.thread_name_prefix}-feeder", daemon=True
+            )
+        ]
+        for stage_index, stage in enumerate(self.stages):
+            for worker_no in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=work,
+                        args=(stage_index,),
+                        name=f"{self.thread_name_prefix}-{stage.name}-{worker_no}",
+                        daemon=True,
+                    )
+                )
+
+        pipeline_start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        try:
+            for sequence_no in range(len(tasks)):
+                with results_condition:
+                    while sequence_no not in results:
+                        results_condition.wait()
+                    task, error = results.pop(sequence_no)
+                pages_in_flight.release()
+
+                if error is not None:
+                    raise error
+                yield task
+
+        finally:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+            wall_seconds = time.perf_counter() - pipeline_start_time
+            for counter in self.counters.values():
+                counter.add_wall_time(wall_seconds)
+
+    def get_stage_counters(self):
+        return [counter.as_dict() for counter in self.counters.values()]
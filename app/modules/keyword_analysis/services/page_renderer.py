@@ -0,0 +1,111 @@
+import io
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+from PIL import Image
+
+render_dpi = 200
+image_format = "PNG"
+
+# Documents opened by a render worker process, keyed by the temporary pdf path
+_worker_documents = OrderedDict()
+_max_worker_documents = 4
+
+
+def render_page_to_image(pdf_document, page_num, dpi=render_dpi):
+    # Render the page to a pixmap (image)
+    pix = pdf_document.load_page(page_num).get_pixmap(dpi=dpi)
+
+    # Convert pixmap to an image using Pillow
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
+def encode_image(image):
+    image_byte_array = io.BytesIO()
+    image.save(image_byte_array, format=image_format)
+    return image_byte_array.getvalue()
+
+
+def render_page_in_worker_process(pdf_path, page_num, dpi=render_dpi):
+    """Runs inside a render worker process, every document is opened once per process"""
+    pdf_document = _worker_documents.get(pdf_path)
+    if pdf_document is None:
+        pdf_document = fitz.open(pdf_path)
+        _worker_documents[pdf_path] = pdf_document
+        if len(_worker_documents) > _max_worker_documents:
+            _, oldest_document = _worker_documents.popitem(last=False)
+            oldest_document.close()
+    else:
+        _worker_documents.move_to_end(pdf_path)
+
+    return encode_image(render_page_to_image(pdf_document, page_num, dpi))
+
+
+class RenderDocument:
+    """Handle of a pdf document shared with the render worker processes"""
+
+    def __init__(self, pdf_path, page_count):
+        self.pdf_path = pdf_path
+        self.page_count = page_count
+
+
+class ProcessPageRenderer:
+    """
+    Rasterises pdf pages on a pool of worker processes, away from the GIL of the queue threads.
+
+    The pdf bytes are handed to the workers once per document through a temporary file,
+    each render request then only carries the file path and the page index, and returns
+    the encoded PNG bytes.
+
+    Opt-in only (PageRenderBackend=process) : benchmarks/page_render_benchmark.py on a
+    single core host renders 4.04 pages/s in-thread against 0.98x of that with 1 worker
+    and 0.83x with 2, the pool only pays off with idle cores while queue threads hold
+    the GIL.
+    """
+
+    # One pool per worker count and process, shared by every queue thread
+    _executors = {}
+    _executor_lock = threading.Lock()
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with ProcessPageRenderer._executor_lock:
+            executor = ProcessPageRenderer._executors.get(self.max_workers)
+            if executor is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    # Forking a process with running queue threads can deadlock, so spawn workers
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                ProcessPageRenderer._executors[self.max_workers] = executor
+            return executor
+
+    def open_document(self, pdf_bytes, page_count) -> RenderDocument:
+        with NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf_file:
+            temp_pdf_file.write(pdf_bytes)
+        return RenderDocument(temp_pdf_file.name, page_count)
+
+    def close_document(self, render_document: RenderDocument):
+        try:
+            os.remove(render_document.pdf_path)
+        except FileNotFoundError:
+            pass
+
+    def render_page(self, render_document: RenderDocument, page_num, dpi=render_dpi):
+        future = self.get_executor().submit(
+            render_page_in_worker_process, render_document.pdf_path, page_num, dpi
+        )
+        return future.result()
+
+    @classmethod
+    def shutdown(cls):
+        with cls._executor_lock:
+            for executor in cls._executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+            cls._executors.clear()
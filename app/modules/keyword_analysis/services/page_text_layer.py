@@ -0,0 +1,101 @@
+import fitz
+
+text_layer_model_version = "pdf-text-layer"
+unrecognised_character = "�"
+pdf_points_per_inch = 72
+
+
+def get_polygon(x0, y0, x1, y1, transformation_matrix):
+    # Same corner order as the bounding polygons returned by azure vision
+    corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    polygon = []
+    for x, y in corners:
+        point = fitz.Point(x, y) * transformation_matrix
+        polygon.append({"x": int(round(point.x)), "y": int(round(point.y))})
+    return polygon
+
+
+def get_enclosing_rect(rects):
+    return (
+        min(rect[0] for rect in rects),
+        min(rect[1] for rect in rects),
+        max(rect[2] for rect in rects),
+        max(rect[3] for rect in rects),
+    )
+
+
+def has_usable_text_layer(words, min_characters, max_unrecognised_ratio):
+    page_text = "".join(word[4] for word in words)
+    # A page without text has no text layer, whatever the minimum is
+    if not page_text:
+        return False
+    recognised_characters = sum(1 for character in page_text if character.isalnum())
+    if recognised_characters < min_characters:
+        return False
+
+    unrecognised_characters = page_text.count(unrecognised_character)
+    return unrecognised_characters / len(page_text) <= max_unrecognised_ratio
+
+
+def extract_text_layer(
+    pdf_document, page_num, dpi, min_characters, max_unrecognised_ratio
+):
+    """
+    Build the azure vision `as_dict()` structure of a page from its embedded text layer.
+
+    Words are taken with their block, line and word numbers from PyMuPDF, and their
+    bounding polygons are converted to the pixel space of the page image rendered at
+    `dpi`, so keyword coordinates match the uploaded page image. Returns None when the
+    page has no usable text layer (scanned pages), these pages still need OCR.
+    """
+    page = pdf_document.load_page(page_num)
+    words = page.get_text("words")
+    if not has_usable_text_layer(words, min_characters, max_unrecognised_ratio):
+        return None
+
+    # Text is extracted in unrotated page coordinates while the page is rendered rotated
+    transformation_matrix = page.rotation_matrix * fitz.Matrix(
+        dpi / pdf_points_per_inch, dpi / pdf_points_per_inch
+    )
+
+    lines_by_block = {}
+    for x0, y0, x1, y1, text, block_no, line_no, word_no in words:
+        block_lines = lines_by_block.setdefault(block_no, {})
+        block_lines.setdefault(line_no, []).append((x0, y0, x1, y1, text))
+
+    blocks = []
+    for block_no in sorted(lines_by_block):
+        lines = []
+        for line_no in sorted(lines_by_block[block_no]):
+            line_words = lines_by_block[block_no][line_no]
+            lines.append(
+                {
+                    "text": " ".join(word[4] for word in line_words),
+                    "boundingPolygon": get_polygon(
+                        *get_enclosing_rect(line_words), transformation_matrix
+                    ),
+                    "words": [
+                        {
+                            "text": text,
+                            "boundingPolygon": get_polygon(
+                                x0, y0, x1, y1, transformation_matrix
+                            ),
+                            "confidence": 1.0,
+                        }
+                        for x0, y0, x1, y1, text in line_words
+                    ],
+                }
+            )
+        blocks.append({"lines": lines})
+
+    page_pixel_rect = page.rect * fitz.Matrix(
+        dpi / pdf_points_per_inch, dpi / pdf_points_per_inch
+    )
+    return {
+        "modelVersion": text_layer_model_version,
+        "metadata": {
+            "width": int(round(page_pixel_rect.width)),
+            "height": int(round(page_pixel_rect.height)),
+        },
+        "readResult": {"blocks": blocks},
+    }
@@ -0,0 +1,180 @@
+import json
+from datetime import datetime, timezone
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+from utils.exceptions import StatusManifestConflictError
+
+constants = KeywordAnalysisConstants
+
+
+class StatusManifest:
+    """Processing status of an analysed file, stored as one json blob in its output folder"""
+
+    def __init__(
+        self,
+        status,
+        page_count=None,
+        error=None,
+        created_at=None,
+        updated_at=None,
+        etag=None,
+    ):
+        self.status = status
+        self.page_count = page_count
+        self.error = error
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.etag = etag
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "page_count": self.page_count,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data, etag):
+        return cls(
+            status=data.get("status"),
+            page_count=data.get("page_count"),
+            error=data.get("error"),
+            created_at=data.get("created_at"),
+            updated_at=data.get("updated_at"),
+            etag=etag,
+        )
+
+
+class StatusManifestStore:
+    """
+    Reads and writes the status manifest of analysed files.
+
+    A status read is one GET and a status transition is one PUT. Every write is
+    conditional : a new manifest is only created if none exists and an existing one
+    is only replaced if its etag is still the one that was read, so concurrent
+    transitions of the same file are detected instead of silently overwritten.
+    """
+
+    # Statuses a file can move to from its current one (None : no manifest yet),
+    # a finished or failed file is only processed again after being queued again
+    allowed_transitions = {
+        None: {
+            constants.statuses.queued,
+            constants.statuses.processing,
+            constants.statuses.failed,
+        },
+        constants.statuses.queued: {
+            constants.statuses.queued,
+            constants.statuses.processing,
+            constants.statuses.failed,
+        },
+        constants.statuses.processing: {
+            constants.statuses.queued,
+            constants.statuses.finished,
+            constants.statuses.failed,
+        },
+        constants.statuses.finished: {constants.statuses.queued},
+        constants.statuses.failed: {constants.statuses.queued},
+    }
+
+    owned_statuses = (constants.statuses.queued, constants.statuses.processing)
+
+    @classmethod
+    def is_transition_allowed(cls, manifest, status):
+        current_status = manifest.status if manifest is not None else None
+        return status in cls.allowed_transitions.get(current_status, set())
+
+    def __init__(self, blob_storage_container_client, logger):
+        self.blob_storage_container_client = blob_storage_container_client
+        self.logger = logger
+
+    def get_path(self, file_path):
+        return f"{file_path}/{constants.file_names.status_manifest}"
+
+    def read(self, file_path):
+        blob_client = self.blob_storage_container_client.get_blob_client(
+            self.get_path(file_path)
+        )
+        try:
+            blob_data = blob_client.download_blob()
+            return StatusManifest.from_dict(
+                json.loads(blob_data.readall()), blob_data.properties.etag
+            )
+        except ResourceNotFoundError:
+            return None
+
+    def write(self, file_path, status, page_count=None, error=None, manifest=None):
+        """
+        Move the file to `status`, based on `manifest` as last read by the caller
+        (None if the file has no manifest yet). Raises StatusManifestConflictError
+        if the manifest was changed since.
+        """
+        updated_at = datetime.now(timezone.utc).isoformat()
+        new_manifest = StatusManifest(
+            status=status,
+            page_count=page_count,
+            error=error,
+            created_at=manifest.created_at if manifest is not None else updated_at,
+            updated_at=updated_at,
+        )
+        manifest_data = json.dumps(new_manifest.to_dict()).encode(constants.utf_8)
+
+        blob_client = self.blob_storage_container_client.get_blob_client(
+            self.get_path(file_path)
+        )
+        try:
+            if manifest is not None and manifest.etag is not None:
+                upload_response = blob_client.upload_blob(
+                    manifest_data,
+                    blob_type=constants.blob_types.block_blob,
+                    overwrite=True,
+                    etag=manifest.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            else:
+                upload_response = blob_client.upload_blob(
+                    manifest_data,
+                    blob_type=constants.blob_types.block_blob,
+                    overwrite=False,
+                )
+        except (ResourceModifiedError, ResourceExistsError, ResourceNotFoundError) as e:
+            raise StatusManifestConflictError(details=str(e))
+
+        new_manifest.etag = upload_response.get("etag")
+        return new_manifest
+
+    def transition(self, file_path, status, page_count=None, error=None, manifest=None):
+        """
+        Write a transition decided from `manifest`. When it is stale, the manifest is
+        re-read once and the transition is only retried if it is still allowed from
+        the current status and no other run holds the file, e.g. a file another worker
+        started processing meanwhile is not taken over. Raises
+        StatusManifestConflictError otherwise.
+        """
+        try:
+            return self.write(file_path, status, page_count, error, manifest)
+        except StatusManifestConflictError:
+            current_manifest = self.read(file_path)
+            current_status = (
+                current_manifest.status if current_manifest is not None else None
+            )
+            # A queued or processing file belongs to the run which moved it there
+            if (
+                current_status == status
+                or current_status in self.owned_statuses
+                or not self.is_transition_allowed(current_manifest, status)
+            ):
+                raise StatusManifestConflictError(
+                    f"{file_path} moved to {current_status} concurrently, transition to {status} dropped"
+                )
+            self.logger.warning(
+                f"Status-Manifest : {file_path} changed concurrently to {current_status}, retrying transition to {status}"
+            )
+            return self.write(file_path, status, page_count, error, current_manifest)
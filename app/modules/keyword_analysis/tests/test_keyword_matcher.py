@@ -0,0 +1,106 @@
+import pytest
+from app.modules.keyword_analysis.services.keyword_matcher import KeywordMatcher
+
+
+def make_word(text, x=0, confidence=0.9):
+    return {
+        "text": text,
+        "confidence": confidence,
+        "boundingPolygon": [
+            {"x": x, "y": 0},
+            {"x": x + 10, "y": 0},
+            {"x": x + 10, "y": 10},
+            {"x": x, "y": 10},
+        ],
+    }
+
+
+def make_page(*lines_by_block):
+    return {
+        "blocks": [
+            {"lines": [{"words": [make_word(text) for text in line]} for line in lines]}
+            for lines in lines_by_block
+        ]
+    }
+
+
+def naive_matches(keywords, page):
+    # The former keyword -> block -> line -> word loops
+    return [
+        (keyword, word["text"])
+        for keyword in keywords
+        for block in page["blocks"]
+        for line in block["lines"]
+        for word in line["words"]
+        if keyword.lower() in word["text"].lower()
+    ]
+
+
+def test_find_keyword_indices_matches_substrings_case_insensitively():
+    matcher = KeywordMatcher(["PFAS", "oct", "acid"])
+    assert matcher.find_keyword_indices("Perfluorooctanoic-ACID") == [1, 2]
+    assert matcher.find_keyword_indices("pfas") == [0]
+    assert matcher.find_keyword_indices("water") == []
+
+
+def test_overlapping_and_duplicate_keywords_are_all_reported():
+    matcher = KeywordMatcher(["he", "she", "hers", "she"])
+    assert matcher.find_keyword_indices("ushers") == [0, 1, 2, 3]
+
+
+def test_empty_keyword_matches_every_word():
+    matcher = KeywordMatcher(["", "lead"])
+    assert matcher.find_keyword_indices("water") == [0]
+    assert matcher.find_keyword_indices("Lead") == [0, 1]
+
+
+def test_match_words_keeps_keyword_then_page_order():
+    keywords = ["lead", "pfas"]
+    page = make_page([["PFAS", "and", "lead"], ["unleaded"]], [["pfas-free"]])
+    pairs = KeywordMatcher(keywords).match_words(page, phrases_across_lines=False)
+    assert [(keyword, word["text"]) for keyword, word in pairs] == naive_matches(
+        keywords, page
+    )
+
+
+@pytest.mark.parametrize(
+    "phrases_across_lines, expected",
+    [(False, []), (True, ["perfluorooctanoic acid,"])],
+)
+def test_phrases_crossing_lines(phrases_across_lines, expected):
+    matcher = KeywordMatcher(["perfluorooctanoic acid"])
+    page = make_page([["perfluorooctanoic"], ["acid,"]])
+    pairs = matcher.match_words(page, phrases_across_lines=phrases_across_lines)
+    assert [word["text"] for _, word in pairs] == expected
+
+
+def test_phrase_match_is_one_word_enclosing_the_phrase():
+    matcher = KeywordMatcher(["perfluorooctanoic acid"])
+    page = {
+        "blocks": [
+            {
+                "lines": [
+                    {
+                        "words": [
+                            make_word("Perfluorooctanoic", x=0, confidence=0.8),
+                            make_word("acid", x=20, confidence=0.95),
+                        ]
+                    }
+                ]
+            }
+        ]
+    }
+    [(keyword, word)] = matcher.match_words(page, phrases_across_lines=False)
+    assert keyword == "perfluorooctanoic acid"
+    assert word["text"] == "Perfluorooctanoic acid"
+    assert word["confidence"] == 0.8
+    assert [point["x"] for point in word["boundingPolygon"]] == [0, 30, 30, 0]
+
+
+def test_get_matcher_reuses_the_compiled_matcher():
+    assert KeywordMatcher.get_matcher(["a", "b"]) is KeywordMatcher.get_matcher(
+        ("a", "b")
+    )
+    assert KeywordMatcher.get_matcher(["a", "b"]) is not KeywordMatcher.get_matcher(
+        ["b", "a"]
+    )
@@ -0,0 +1,57 @@
+import json
+from collections import OrderedDict
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+from app.modules.keyword_analysis.services.ocr_cache import BlobOcrCacheBackend
+
+
+class FakeBlobStorage:
+    def __init__(self):
+        self.blobs = {}
+        self.reads = 0
+
+    def get_file_content_from_blob_storage(self, file_path):
+        self.reads += 1
+        if file_path not in self.blobs:
+            raise ResourceNotFoundError("not found")
+        return self.blobs[file_path]
+
+    def upload_file_to_blob_storage(self, type, file_data, file_path):
+        self.blobs[file_path] = json.dumps(file_data)
+
+
+@pytest.fixture(autouse=True)
+def missed_keys(monkeypatch):
+    # Misses are shared by the process, keep them per test
+    monkeypatch.setattr(BlobOcrCacheBackend, "_missed_keys", OrderedDict())
+
+
+def test_missed_key_is_not_looked_up_again():
+    blob_storage = FakeBlobStorage()
+    backend = BlobOcrCacheBackend(blob_storage)
+    assert backend.get("key") is None
+    # Another service of the process shares the misses
+    assert BlobOcrCacheBackend(blob_storage).get("key") is None
+    assert blob_storage.reads == 1
+
+
+def test_put_forgets_the_miss():
+    blob_storage = FakeBlobStorage()
+    backend = BlobOcrCacheBackend(blob_storage)
+    assert backend.get("key") is None
+    backend.put("key", {"text": "PFOA"})
+    assert backend.get("key") == {"text": "PFOA"}
+
+
+def test_misses_are_bounded(monkeypatch):
+    monkeypatch.setattr(
+        "app.modules.keyword_analysis.services.ocr_cache.constants.ocr_cache_blob_miss_max_entries",
+        2,
+    )
+    blob_storage = FakeBlobStorage()
+    backend = BlobOcrCacheBackend(blob_storage)
+    for key in ("a", "b", "c"):
+        backend.get(key)
+    assert list(BlobOcrCacheBackend._missed_keys) == ["b", "c"]
+    backend.get("a")
+    assert blob_storage.reads == 4
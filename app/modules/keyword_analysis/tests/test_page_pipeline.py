@@ -0,0 +1,97 @@
+import time
+import random
+import threading
+import pytest
+from app.modules.keyword_analysis.services.page_pipeline import (
+    PagePipeline,
+    PageTask,
+    PipelineStage,
+)
+
+
+def make_tasks(page_numbers):
+    return [PageTask(page_no, f"pages/{page_no}") for page_no in page_numbers]
+
+
+def sleep_randomly(task, max_seconds=0.005):
+    time.sleep(random.random() * max_seconds)
+    return task
+
+
+def test_results_are_yielded_in_task_order():
+    def persist(task):
+        task.page_analysis = task.page_no
+        return task
+
+    pipeline = PagePipeline(
+        [
+            PipelineStage("render", sleep_randomly),
+            PipelineStage("ocr", sleep_randomly, workers=4),
+            PipelineStage("persist", persist, workers=2),
+        ],
+        max_pages_in_flight=5,
+    )
+    results = [task.page_analysis for task in pipeline.run(make_tasks(range(1, 41)))]
+    assert results == list(range(1, 41))
+
+    counters = {counter["stage"]: counter for counter in pipeline.get_stage_counters()}
+    assert counters["ocr"]["workers"] == 4
+    assert all(counter["pages"] == 40 for counter in counters.values())
+
+
+def test_pages_in_flight_are_bounded():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def enter(task):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        return sleep_randomly(task)
+
+    def leave(task):
+        with lock:
+            in_flight[0] -= 1
+        return task
+
+    pipeline = PagePipeline(
+        [
+            PipelineStage("render", enter, workers=4),
+            PipelineStage("ocr", sleep_randomly, workers=4),
+            PipelineStage("persist", leave),
+        ],
+        max_pages_in_flight=3,
+    )
+    assert len(list(pipeline.run(make_tasks(range(30))))) == 30
+    assert in_flight[1] <= 3
+
+
+def test_stage_error_is_raised_in_page_order():
+    def fail_on_page_3(task):
+        if task.page_no == 3:
+            raise ValueError("page 3")
+        return task
+
+    pipeline = PagePipeline([PipelineStage("ocr", fail_on_page_3, workers=2)], 4)
+    yielded = []
+    with pytest.raises(ValueError, match="page 3"):
+        for task in pipeline.run(make_tasks(range(1, 10))):
+            yielded.append(task.page_no)
+    assert yielded == [1, 2]
+    assert pipeline.get_stage_counters()[0]["failed_pages"] == 1
+
+
+def test_closing_the_results_stops_every_worker():
+    pipeline = PagePipeline(
+        [PipelineStage("render", sleep_randomly, workers=3)],
+        2,
+        thread_name_prefix="closed-pipeline",
+    )
+    results = pipeline.run(make_tasks(range(20)))
+    next(results)
+    results.close()
+    assert not [
+        thread
+        for thread in threading.enumerate()
+        if thread.name.startswith("closed-pipeline")
+    ]
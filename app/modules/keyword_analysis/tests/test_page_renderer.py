@@ -0,0 +1,13 @@
+from app.modules.keyword_analysis.services.page_renderer import ProcessPageRenderer
+
+
+def test_executor_is_shared_per_worker_count():
+    try:
+        one_worker = ProcessPageRenderer(1).get_executor()
+        assert ProcessPageRenderer(1).get_executor() is one_worker
+        # A later renderer with another worker count gets a pool of that size
+        two_workers = ProcessPageRenderer(2).get_executor()
+        assert two_workers is not one_worker
+        assert two_workers._max_workers == 2
+    finally:
+        ProcessPageRenderer.shutdown()
@@ -0,0 +1,60 @@
+import fitz
+import pytest
+from app.modules.keyword_analysis.services.page_text_layer import (
+    extract_text_layer,
+    has_usable_text_layer,
+    text_layer_model_version,
+)
+
+
+def make_words(*texts):
+    # (x0, y0, x1, y1, text, block_no, line_no, word_no) as returned by PyMuPDF
+    return [(0, 0, 10, 10, text, 0, 0, word_no) for word_no, text in enumerate(texts)]
+
+
+@pytest.fixture
+def pdf_document():
+    document = fitz.open()
+    page = document.new_page(width=200, height=100)
+    page.insert_text((10, 20), "PFAS free water", fontsize=10)
+    page.insert_text((10, 50), "second line", fontsize=10)
+    document.new_page(width=200, height=100)
+    yield document
+    document.close()
+
+
+@pytest.mark.parametrize(
+    "words, min_characters, expected",
+    [
+        (make_words("perfluorooctanoic", "acid"), 10, True),
+        (make_words("acid"), 10, False),
+        (make_words("��", "ab"), 0, False),
+        (make_words(), 0, False),
+        (make_words(), 10, False),
+    ],
+)
+def test_has_usable_text_layer(words, min_characters, expected):
+    assert has_usable_text_layer(words, min_characters, 0.1) is expected
+
+
+def test_extract_text_layer_builds_the_vision_structure(pdf_document):
+    page_text_json = extract_text_layer(pdf_document, 0, 144, 5, 0.1)
+
+    assert page_text_json["modelVersion"] == text_layer_model_version
+    # Pixel size of the page rendered at 144 dpi
+    assert page_text_json["metadata"] == {"width": 400, "height": 200}
+    lines = [
+        line
+        for block in page_text_json["readResult"]["blocks"]
+        for line in block["lines"]
+    ]
+    assert [line["text"] for line in lines] == ["PFAS free water", "second line"]
+    first_word = lines[0]["words"][0]
+    assert first_word["text"] == "PFAS"
+    assert first_word["confidence"] == 1.0
+    xs = [point["x"] for point in first_word["boundingPolygon"]]
+    assert xs[0] == pytest.approx(20, abs=2)
+
+
+def test_extract_text_layer_skips_pages_without_text(pdf_document):
+    assert extract_text_layer(pdf_document, 1, 144, 0, 0.1) is None
@@ -0,0 +1,161 @@
+"""
+Compares the former keyword -> word search loop with the compiled keyword matcher.
+
+Usage (from the repository root):
+    python -m benchmarks.keyword_matcher_benchmark --keywords 5000 --words 400 --pages 5
+or from anywhere:
+    python benchmarks/keyword_matcher_benchmark.py --keywords 5000 --words 400 --pages 5
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+# The app packages are imported from the repository root, wherever this is run from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
+from app.modules.keyword_analysis.services.file_analysis_service import (
+    FileAnalysisService,
+)
+from app.modules.keyword_analysis.services.keyword_matcher import KeywordMatcher
+
+constants = KeywordAnalysisConstants
+
+chemical_name_parts = [
+    "perfluoro", "octan", "oic", "sulfon", "acid", "hexa", "fluoro", "propylene",
+    "oxide", "dimer", "tetra", "chloro", "ethyl", "methyl", "benz", "amide",
+    "phenyl", "trimethyl", "silane", "nonan", "decan", "butyl", "ether", "ketone",
+]
+
+
+def build_keywords(no_of_keywords, rng):
+    keywords = []
+    for keyword_no in range(no_of_keywords):
+        name = "".join(rng.choice(chemical_name_parts) for _ in range(rng.randint(1, 3)))
+        # CAS numbers are a large share of real keyword lists
+        if keyword_no % 3 == 0:
+            name = f"{rng.randint(50, 99999)}-{rng.randint(10, 99)}-{rng.randint(0, 9)}"
+        keywords.append(name)
+    return keywords
+
+
+def build_page(no_of_words, keywords, rng):
+    words = []
+    for word_no in range(no_of_words):
+        if word_no % 20 == 0:
+            text = rng.choice(keywords).upper()
+        else:
+            text = "".join(rng.choice(chemical_name_parts) for _ in range(rng.randint(1, 2)))
+        x = (word_no % 10) * 80
+        y = (word_no // 10) * 20
+        words.append(
+            {
+                "text": text,
+                "confidence": rng.random(),
+                "boundingPolygon": [
+                    {"x": x, "y": y},
+                    {"x": x + 70, "y": y},
+                    {"x": x + 70, "y": y + 15},
+                    {"x": x, "y": y + 15},
+                ],
+            }
+        )
+    lines = [{"words": words[index : index + 10]} for index in range(0, len(words), 10)]
+    return {"blocks": [{"lines": lines[index : index + 5]} for index in range(0, len(lines), 5)]}
+
+
+def new_page_analysis():
+    return {constants.page_analysis_parameters.matched_keywords: []}
+
+
+def search_keywords_with_loops(keywords, extracted_text_data, page_analysis):
+    """The keyword search as it was before the compiled matcher, used as the reference"""
+    keywords_matched_on_page = set()
+    words_matched_on_page = []
+    for search_key in keywords:
+        for block in extracted_text_data["blocks"]:
+            for line in block["lines"]:
+                for word in line["words"]:
+                    search_key_pattern = r"\b{}\b".format(re.escape(search_key))
+                    if (
+                        re.search(search_key_pattern.lower(), word["text"].lower())
+                    ) or (search_key.lower() in word["text"].lower()):
+                        words_matched_on_page.append(word["text"])
+                        keywords_matched_on_page.add(search_key)
+                        page_analysis[constants.page_analysis_parameters.matched_keywords].append(
+                            {
+                                constants.page_analysis_parameters.keyword: search_key,
+                                constants.page_analysis_parameters.word: word["text"],
+                                constants.page_analysis_parameters.confidence: round(
+                                    word["confidence"] * 100, 2
+                                ),
+                                constants.page_analysis_parameters.coordinates: [
+                                    coord
+                                    for point in word["boundingPolygon"]
+                                    for coord in [point["x"], point["y"]]
+                                ],
+                            }
+                        )
+    page_analysis[constants.page_analysis_parameters.unique_matched_keywords_count] = len(
+        keywords_matched_on_page
+    )
+    page_analysis[constants.page_analysis_parameters.matched_keywords_count] = len(
+        words_matched_on_page
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keywords", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    keywords = build_keywords(args.keywords, rng)
+    pages = [build_page(args.words, keywords, rng) for _ in range(args.pages)]
+
+    start_time = time.perf_counter()
+    baseline_results = []
+    for page in pages:
+        page_analysis = new_page_analysis()
+        search_keywords_with_loops(keywords, page, page_analysis)
+        baseline_results.append(page_analysis)
+    baseline_duration = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    keyword_matcher = KeywordMatcher(keywords)
+    build_duration = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    results = []
+    for page_no, page in enumerate(pages, start=1):
+        page_analysis = new_page_analysis()
+        FileAnalysisService.search_keywords_in_extracted_text(
+            page_no, keyword_matcher, page, page_analysis
+        )
+        results.append(page_analysis)
+    duration = time.perf_counter() - start_time
+
+    if results != baseline_results:
+        raise AssertionError("Compiled matcher output differs from the keyword loops")
+
+    matches = sum(
+        page_analysis[constants.page_analysis_parameters.matched_keywords_count]
+        for page_analysis in results
+    )
+    print(f"{args.keywords} keywords, {args.pages} pages of {args.words} words, {matches} matches")
+    print(f"keyword loops    : {baseline_duration / args.pages * 1000:10.2f} ms/page")
+    print(f"matcher build    : {build_duration * 1000:10.2f} ms (once per keyword set)")
+    print(
+        f"compiled matcher : {duration / args.pages * 1000:10.2f} ms/page"
+        f"  speedup {baseline_duration / duration:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares in-thread pdf rasterisation with the process pool render backend.
+
+Usage (from the repository root):
+    python -m benchmarks.page_render_benchmark --pages 40 --processes 1 2 4
+"""
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+from app.modules.keyword_analysis.services.page_renderer import (
+    ProcessPageRenderer,
+    encode_image,
+    render_page_to_image,
+)
+
+
+def build_fixture_pdf(no_of_pages):
+    # Text and vector drawings, close to the cost of rendering a real MSDS page
+    pdf_document = fitz.open()
+    for page_no in range(no_of_pages):
+        page = pdf_document.new_page()
+        for line_no in range(60):
+            page.insert_text(
+                (40, 40 + line_no * 12),
+                f"Page {page_no + 1} line {line_no} : perfluorooctanoic acid (PFOA) CAS 335-67-1 - 0.1 %",
+                fontsize=9,
+            )
+        for shape_no in range(40):
+            page.draw_rect(
+                fitz.Rect(30 + shape_no * 13, 760, 40 + shape_no * 13, 800),
+                color=(0, 0, 1),
+                fill=(shape_no / 40, 0.5, 0.5),
+            )
+    return pdf_document.tobytes()
+
+
+def render_in_thread(pdf_bytes, no_of_pages):
+    pdf_document = fitz.open("pdf", pdf_bytes)
+    return [
+        encode_image(render_page_to_image(pdf_document, page_num))
+        for page_num in range(no_of_pages)
+    ]
+
+
+def render_in_processes(pdf_bytes, no_of_pages, processes):
+    renderer = ProcessPageRenderer(processes)
+    render_document = renderer.open_document(pdf_bytes, no_of_pages)
+    try:
+        # Spawn the workers before timing
+        renderer.render_page(render_document, 0)
+
+        start_time = time.perf_counter()
+        # One submitting thread per worker process, like the render stage of the page pipeline
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            images = list(
+                executor.map(
+                    lambda page_num: renderer.render_page(render_document, page_num),
+                    range(no_of_pages),
+                )
+            )
+        return images, time.perf_counter() - start_time
+    finally:
+        renderer.close_document(render_document)
+        ProcessPageRenderer.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument(
+        "--processes", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1})
+    )
+    args = parser.parse_args()
+
+    pdf_bytes = build_fixture_pdf(args.pages)
+
+    start_time = time.perf_counter()
+    baseline_images = render_in_thread(pdf_bytes, args.pages)
+    baseline_duration = time.perf_counter() - start_time
+    print(
+        f"in-thread          : {baseline_duration:8.2f} s  {args.pages / baseline_duration:8.2f} pages/s"
+    )
+
+    for processes in args.processes:
+        images, duration = render_in_processes(pdf_bytes, args.pages, processes)
+        if images != baseline_images:
+            raise AssertionError("Process pool output differs from in-thread rendering")
+        print(
+            f"process pool x {processes:<3}: {duration:8.2f} s  {args.pages / duration:8.2f} pages/s"
+            f"  speedup {baseline_duration / duration:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
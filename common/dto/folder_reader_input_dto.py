@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, ValidationError
+from global_constants import GlobalConstants
 
 
 class FolderReaderInputDTO(BaseModel):
@@ -6,3 +7,7 @@ class FolderReaderInputDTO(BaseModel):
     location_type: str = Field(..., description="Source name must not be null")
     folder_location: str = Field(..., description="Source name must not be null")
     folder_upload_id: str = Field(..., description="Source name must not be null")
+    sync_mode: str = Field(
+        default=GlobalConstants.folder_scan_default_sync_mode,
+        description="FULL to list the whole folder, DELTA for the changes since the last scan",
+    )
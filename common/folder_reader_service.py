@@ -1,7 +1,10 @@
 import json
+import asyncio
 from utils.sharepoint import SharePoint
 from connectors.sharepoint_connector import SharePointConnector
-from utils.azure_queue import AzureQueue
+from utils.azure_queue import AsyncAzureQueue
+from utils.idempotency_marker import IdempotencyMarkerStore
+from connectors.blob_storage_connector import AzureBlobStorageConnector
 from connectors.mysql_connector import MySQLConnector
 from utils.mysql import MySQL
 import uuid
@@ -16,48 +19,70 @@ from azure.storage.queue import QueueMessage
 from sqlalchemy.orm import Session
 from common.dto.folder_reader_input_dto import FolderReaderInputDTO
 from utils.threading_tools import ThreadingTool
-from utils.task_visiblity_controller import TaskVisibilityController
+from global_constants import GlobalConstants
+
+global_constants = GlobalConstants
 
 
 class FolderReader:
-    def __init__(self, logger: Logger, asyncio_event_loop=None):
+    def __init__(self, logger: Logger):
         self.logger = logger
-        self.asyncio_event_loop = asyncio_event_loop
         self.sharepoint_util = self._init_sharepoint_util()
-        self.azure_queue_util = AzureQueue()
+        # Only used on the event loop of the process
+        self.azure_queue_util = AsyncAzureQueue.for_message_type(
+            global_constants.queue_message_types.msds_artifact_upload
+        )
+        self.idempotency_marker_store = IdempotencyMarkerStore(
+            AzureBlobStorageConnector().connect(), logger
+        )
 
     def _init_sharepoint_util(self):
         share_point_connector = SharePointConnector()
         sharepoint_client = share_point_connector.get_client()
         return SharePoint(sharepoint_client)
 
-    def add_file_in_queue(
-        self, file_path, artifact_upload_run_state_id
+    async def add_file_in_queue(
+        self, file_path, artifact_upload_run_state_id, idempotency_key=None
     ) -> QueueMessage:
         queue_message = {
-            "message_type": "msds-artifact-upload",
+            "message_type": global_constants.queue_message_types.msds_artifact_upload,
             "data": {
                 "full_path": file_path,
                 "artifact_upload_run_state_id": artifact_upload_run_state_id,
+                "idempotency_key": idempotency_key,
             },
         }
-        return self.azure_queue_util.enqueue(queue_message)
+        return await self.azure_queue_util.enqueue(queue_message)
+
+    def claim_file(
+        self, file_path, version, artifact_upload_run_state_id, folder_upload_id
+    ):
+        """
+        Claim this version of the file for the run, returns its idempotency key or None
+        if the same version is already queued, processing or processed
+        """
+        idempotency_key = self.idempotency_marker_store.get_key(file_path, version)
+        claimed = self.idempotency_marker_store.claim(
+            global_constants.queue_message_types.msds_artifact_upload,
+            idempotency_key,
+            owner=artifact_upload_run_state_id,
+            data={
+                "full_path": file_path,
+                "version": version,
+                "folder_upload_id": folder_upload_id,
+            },
+        )
+        return idempotency_key if claimed else None
 
-    def add_entry_in_artifact_upload_run_state_details_table(
+    def get_artifact_upload_run_state_details_entry(
         self,
         id,
         folder_id,
         full_path,
         message_id,
-        mysql_session: Session,
     ):
-        mysql_util = MySQL(
-            logger=self.logger,
-            session=mysql_session,
-            table=ArtifactUploadRunStateDetails,
-        )
         current_timestamp = int(time.time())
-        data = {
+        return {
             "id": id,
             "folder_upload_id": folder_id,
             "full_path": full_path,
@@ -69,7 +94,143 @@ class FolderReader:
             "created_at": current_timestamp,
             "updated_at": current_timestamp,
         }
-        mysql_util.add_entry(data)
+
+    def get_artifact_upload_run_state_details_util(self, mysql_session: Session):
+        return MySQL(
+            logger=self.logger,
+            session=mysql_session,
+            table=ArtifactUploadRunStateDetails,
+        )
+
+    def add_entries_in_artifact_upload_run_state_details_table(
+        self, entries, mysql_session: Session
+    ):
+        self.get_artifact_upload_run_state_details_util(mysql_session).add_entries(
+            entries
+        )
+
+    def update_entries_in_artifact_upload_run_state_details_table(
+        self, update_data_list, mysql_session: Session
+    ):
+        self.get_artifact_upload_run_state_details_util(mysql_session).update_entries(
+            update_data_list
+        )
+
+    async def release_claim(self, idempotency_key, artifact_upload_run_state_id):
+        # Release the claim so the next scan enqueues the file
+        await ThreadingTool.run_blocking(
+            self.idempotency_marker_store.finish,
+            global_constants.queue_message_types.msds_artifact_upload,
+            idempotency_key,
+            artifact_upload_run_state_id,
+            succeeded=False,
+        )
+
+    async def claim_file_entry(
+        self, file_path, version, folder_upload_id, semaphore: asyncio.Semaphore
+    ):
+        """
+        Claim a file for a new run, returns its artifact_upload_run_state_details entry,
+        without message id yet, and its idempotency key, or None if this version of the
+        file is already enqueued
+        """
+        async with semaphore:
+            artifact_upload_run_state_id = str(uuid.uuid1()).replace("-", "")
+
+            # Skip versions of files already enqueued by a previous scan
+            idempotency_key = await ThreadingTool.run_blocking(
+                self.claim_file,
+                file_path,
+                version,
+                artifact_upload_run_state_id,
+                folder_upload_id,
+            )
+            if idempotency_key is None:
+                return None
+
+            entry = self.get_artifact_upload_run_state_details_entry(
+                artifact_upload_run_state_id, folder_upload_id, file_path, None
+            )
+            return entry, idempotency_key
+
+    async def send_file_entry(
+        self, entry, idempotency_key, semaphore: asyncio.Semaphore
+    ) -> QueueMessage:
+        """Enqueue the file of a recorded run, releasing its claim if it fails"""
+        async with semaphore:
+            try:
+                return await self.add_file_in_queue(
+                    entry["full_path"], entry["id"], idempotency_key
+                )
+            except Exception:
+                await self.release_claim(idempotency_key, entry["id"])
+                raise
+
+    async def enqueue_file_batch(
+        self, files, folder_upload_id, semaphore, mysql_session: Session
+    ):
+        """
+        Claim, record and enqueue a batch of files. The run state entries are inserted
+        in one transaction before any message is sent, so a worker always finds the
+        entry of its message, then their message ids are set in one transaction.
+        Returns the number of files enqueued, the number of duplicates and the errors.
+        """
+        results = await asyncio.gather(
+            *(
+                # The eTag is the content version of the file
+                self.claim_file_entry(
+                    file.web_url, file.e_tag, folder_upload_id, semaphore
+                )
+                for file in files
+            ),
+            return_exceptions=True,
+        )
+        claimed = [result for result in results if isinstance(result, tuple)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        duplicate_count = sum(1 for result in results if result is None)
+
+        try:
+            await ThreadingTool.run_blocking(
+                self.add_entries_in_artifact_upload_run_state_details_table,
+                [entry for entry, _ in claimed],
+                mysql_session,
+            )
+        except Exception:
+            for entry, idempotency_key in claimed:
+                await self.release_claim(idempotency_key, entry["id"])
+            raise
+
+        messages = await asyncio.gather(
+            *(
+                self.send_file_entry(entry, idempotency_key, semaphore)
+                for entry, idempotency_key in claimed
+            ),
+            return_exceptions=True,
+        )
+        update_data_list = []
+        for (entry, _), message in zip(claimed, messages):
+            if isinstance(message, BaseException):
+                errors.append(message)
+                update_data_list.append(
+                    {
+                        "id": entry["id"],
+                        "completed_stage_status": "FAILED",
+                        "completed_stage_status_reason": str(message),
+                    }
+                )
+            else:
+                # Only the message id, a worker may already be updating the stage
+                update_data_list.append({"id": entry["id"], "message_id": message.id})
+        await ThreadingTool.run_blocking(
+            self.update_entries_in_artifact_upload_run_state_details_table,
+            update_data_list,
+            mysql_session,
+        )
+
+        enqueued_count = sum(
+            1 for message in messages if not isinstance(message, BaseException)
+        )
+        return enqueued_count, duplicate_count, errors
 
     def get_running_count_and_next_page_link_from_database(
         self, folder_upload_id, mysql_folder_upload_util
@@ -78,19 +239,90 @@ class FolderReader:
         if data is None:
             raise MissingRequiredDetailsError("folder_upload_id is invalid")
         return (
-            0 if data.running_count is None else int(data.running_count)
-        ), data.next_page_link
-
-    def fetch_files_from_sharepoint(self, folder_location, next_page_link):
-        return self.asyncio_event_loop.run_until_complete(
-            self.sharepoint_util.get_files_from_folder_in_batch(
-                root_folder_uri=(folder_location if next_page_link is None else None),
-                page_link=next_page_link,
-                batch_size=200,
-            )
+            (0 if data.running_count is None else int(data.running_count)),
+            data.next_page_link,
+            data.delta_link,
+        )
+
+    async def fetch_files_from_sharepoint(self, folder_location, next_page_link):
+        # Files of the page and of its sub-folders are streamed while they are crawled
+        return await self.sharepoint_util.get_files_from_folder_page(
+            root_folder_uri=(folder_location if next_page_link is None else None),
+            page_link=next_page_link,
+            page_size=global_constants.folder_reader_page_size,
+        )
+
+    async def fetch_changed_files_from_sharepoint(self, folder_location, delta_link):
+        # Changes since the last delta sync, or every file of the folder on the first one
+        return await self.sharepoint_util.get_changed_files_from_folder_page(
+            folder_uri=folder_location, delta_link=delta_link
         )
 
+    async def enqueue_files(
+        self, files, folder_upload_id, semaphore, mysql_session: Session
+    ):
+        """
+        Enqueue the files of an async iterator in batches of `folder_reader_page_size`
+        as they are discovered, the crawl going on meanwhile. Returns the number of
+        files enqueued, the number of duplicates and the errors.
+        """
+        enqueued_count = 0
+        duplicate_count = 0
+        errors = []
+
+        async def enqueue_batch(batch):
+            nonlocal enqueued_count, duplicate_count
+            batch_enqueued_count, batch_duplicate_count, batch_errors = (
+                await self.enqueue_file_batch(
+                    batch, folder_upload_id, semaphore, mysql_session
+                )
+            )
+            enqueued_count += batch_enqueued_count
+            duplicate_count += batch_duplicate_count
+            errors.extend(batch_errors)
+
+        batch = []
+        files = aiter(files)
+        while True:
+            try:
+                file = await anext(files)
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                # The files found before the crawl failed are still enqueued and recorded
+                errors.append(e)
+                break
+            batch.append(file)
+            if len(batch) >= global_constants.folder_reader_page_size:
+                await enqueue_batch(batch)
+                batch = []
+        if batch:
+            await enqueue_batch(batch)
+        return enqueued_count, duplicate_count, errors
+
     def process_folder(self, folder_reader_input_data: FolderReaderInputDTO):
+        # Graph and queue calls run on the event loop of the process
+        ThreadingTool.run_coroutine(self.process_folder_async(folder_reader_input_data))
+
+    async def process_folder_async(
+        self, folder_reader_input_data: FolderReaderInputDTO
+    ):
+        """
+        Enqueue every file of the folder, a page at a time. Graph and queue calls are
+        awaited on the event loop, MySQL and marker calls run on its executor.
+
+        The files of a page are enqueued concurrently, up to
+        `folder_reader_enqueue_concurrency` at a time, in batches whose run state
+        entries are inserted in one transaction before their messages are sent.
+        `running_count` and `next_page_link` are only updated once a page is fully
+        enqueued, so a failed scan resumes from that page.
+
+        In DELTA sync mode only the files added or modified since the last scan are
+        listed, through the Graph delta query of the folder. Its link, the next link
+        while a sync is in progress and the delta link once it is done, is kept in
+        `delta_link` instead of `next_page_link`. Delta is only supported on the root
+        folder of a drive, other folders are scanned in FULL mode.
+        """
         try:
             thread_id = ThreadingTool.get_thread_id()
             # Logging
@@ -98,7 +330,9 @@ class FolderReader:
                 f"Folder-Reader : {thread_id} :: {folder_reader_input_data.folder_upload_id} : Started"
             )
             # Create mysql session
-            mysql_session = MySQLConnector().get_session()
+            mysql_session = await ThreadingTool.run_blocking(
+                MySQLConnector().get_session
+            )
             mysql_folder_upload_util = MySQL(
                 logger=self.logger, session=mysql_session, table=FolderUpload
             )
@@ -108,32 +342,55 @@ class FolderReader:
             )
 
             # Get running count and next page link from folder upload table if the folder is already processed
-            running_count, next_page_link = (
-                self.get_running_count_and_next_page_link_from_database(
-                    folder_reader_input_data.folder_upload_id, mysql_folder_upload_util
-                )
+            running_count, next_page_link, delta_link = await ThreadingTool.run_blocking(
+                self.get_running_count_and_next_page_link_from_database,
+                folder_reader_input_data.folder_upload_id,
+                mysql_folder_upload_util,
             )
-
-            while True:
-                # Get files from sharepoint using folder uri or next page link
-                files, next_page_link = self.fetch_files_from_sharepoint(
-                    folder_reader_input_data.folder_location, next_page_link
+            is_delta_sync = (
+                folder_reader_input_data.sync_mode
+                == global_constants.folder_scan_sync_modes.delta
+            )
+            if is_delta_sync and not await self.sharepoint_util.supports_delta_sync(
+                folder_reader_input_data.folder_location
+            ):
+                self.logger.warning(
+                    f"Folder-Reader : {thread_id} :: {folder_reader_input_data.folder_upload_id} : delta sync is only supported on the root folder of a drive, scanning in FULL mode"
                 )
-                running_count += len(files)
+                is_delta_sync = False
 
-                # Add files to queue and add entry in artifact_upload_run_state_details table
-                for file_path in files:
-                    artifact_upload_run_state_id = str(uuid.uuid1()).replace("-", "")
-                    message = self.add_file_in_queue(
-                        file_path, artifact_upload_run_state_id
+            semaphore = asyncio.Semaphore(
+                global_constants.folder_reader_enqueue_concurrency
+            )
+            while True:
+                if is_delta_sync:
+                    # Get changed files from sharepoint using the delta query of the folder
+                    files, next_page_link, next_delta_link = (
+                        await self.fetch_changed_files_from_sharepoint(
+                            folder_reader_input_data.folder_location, delta_link
+                        )
                     )
+                    delta_link = next_page_link or next_delta_link
+                else:
+                    # Get files from sharepoint using folder uri or next page link
+                    files, next_page_link = await self.fetch_files_from_sharepoint(
+                        folder_reader_input_data.folder_location, next_page_link
+                    )
+                # Record and add files to queue concurrently, a batch at a time
+                enqueued_count, duplicate_count, errors = await self.enqueue_files(
+                    files,
+                    folder_reader_input_data.folder_upload_id,
+                    semaphore,
+                    mysql_session,
+                )
+                if errors:
+                    raise errors[0]
 
-                    self.add_entry_in_artifact_upload_run_state_details_table(
-                        artifact_upload_run_state_id,
-                        folder_reader_input_data.folder_upload_id,
-                        file_path,
-                        message.id,
-                        mysql_session,
+                # Only the files enqueued by this scan are counted
+                running_count += enqueued_count
+                if duplicate_count:
+                    self.logger.info(
+                        f"Folder-Reader : {thread_id} :: {folder_reader_input_data.folder_upload_id} : skipped {duplicate_count} files already enqueued"
                     )
 
                 # Update folder_upload table
@@ -147,23 +404,24 @@ class FolderReader:
                         running_count if next_page_link is None else 0
                     ),  # Update the total count after total files fetched
                     "running_count": running_count,
-                    "next_page_link": next_page_link,
                 }
+                if is_delta_sync:
+                    folder_upload_table_record_data["delta_link"] = delta_link
+                else:
+                    folder_upload_table_record_data["next_page_link"] = next_page_link
 
-                mysql_folder_upload_util.update_entry(
+                await ThreadingTool.run_blocking(
+                    mysql_folder_upload_util.update_entry,
                     folder_reader_input_data.folder_upload_id,
                     folder_upload_table_record_data,
                 )
 
-                # If the execution time reaches visibility time then extend the visibility time
-                TaskVisibilityController.check_and_extend_visibility_timeout()
-
                 # Break the loop if there are no more files to fetch
                 if next_page_link is None:
                     break
 
             self.logger.info(
-                f"Folder-Reader : {thread_id} :: {folder_reader_input_data.folder_upload_id} : added {len(files)} artifact files in queue"
+                f"Folder-Reader : {thread_id} :: {folder_reader_input_data.folder_upload_id} : added {running_count} artifact files in queue"
             )
 
         except Exception as e:
@@ -174,7 +432,8 @@ class FolderReader:
                 "id": folder_reader_input_data.folder_upload_id,
                 "status": "FAILED",
             }
-            mysql_folder_upload_util.update_entry(
+            await ThreadingTool.run_blocking(
+                mysql_folder_upload_util.update_entry,
                 folder_reader_input_data.folder_upload_id,
                 folder_upload_table_record_data,
             )
@@ -42,6 +42,8 @@ class FolderUpload(Base):
     total_count = Column(Integer)
     running_count = Column(String(255))
     next_page_link = Column(Text)
+    # Link the delta query of the folder continues from, a next or delta link
+    delta_link = Column(Text)
     run_state_details = relationship(
         "ArtifactUploadRunStateDetails", back_populates="folder_upload"
     )
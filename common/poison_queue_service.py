@@ -0,0 +1,159 @@
+import json
+from logging import Logger
+from datetime import datetime, timezone
+from azure.storage.queue import QueueMessage
+from global_constants import GlobalConstants
+from utils.azure_queue import AzureQueue
+
+global_constants = GlobalConstants
+
+
+class PoisonQueueService:
+    """
+    Quarantines queue messages which keep failing and replays them once fixed.
+
+    Failed attempts are counted in the message itself, as deliveries also count the
+    messages released on a stop or a drain without being processed. A message failing
+    `queue_max_failed_attempts` times is moved to the poison queue of the queue it came
+    from (`<queue name>-poison`), together with the reason of its last failure, instead of
+    being downloaded and analysed again on every retry.
+    """
+
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self.azure_queues = {}
+
+    def get_azure_queue(self, queue_lane) -> AzureQueue:
+        azure_queue = self.azure_queues.get(queue_lane)
+        if azure_queue is None:
+            azure_queue = AzureQueue(queue_lane)
+            self.azure_queues[queue_lane] = azure_queue
+        return azure_queue
+
+    @staticmethod
+    def get_failed_attempts(queue_item: QueueMessage):
+        """Failed attempts recorded in the message by `record_failed_attempt`"""
+        try:
+            return int(
+                json.loads(queue_item.content).get(
+                    global_constants.queue_failed_attempts_key, 0
+                )
+            )
+        except (json.JSONDecodeError, TypeError, AttributeError, ValueError):
+            return 0
+
+    @staticmethod
+    def is_retry_budget_exhausted(queue_item: QueueMessage):
+        """True if a failure of the current attempt is the last one allowed"""
+        return (
+            PoisonQueueService.get_failed_attempts(queue_item) + 1
+            >= global_constants.queue_max_failed_attempts
+        )
+
+    @staticmethod
+    def is_poison(queue_item: QueueMessage):
+        """True if the message was delivered more often than any retry budget allows"""
+        return (
+            queue_item.dequeue_count or 0
+        ) > global_constants.queue_max_dequeue_count
+
+    def record_failed_attempt(self, queue_item: QueueMessage, azure_queue: AzureQueue):
+        """
+        Count the failed attempt in the message, which is retried once visible again. To
+        be called once its visibility is no longer extended.
+        """
+        try:
+            content = json.loads(queue_item.content)
+            content[global_constants.queue_failed_attempts_key] = (
+                self.get_failed_attempts(queue_item) + 1
+            )
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            # Not a message of ours, left to the delivery limit
+            return
+        azure_queue.update_queue_message(
+            message_id=queue_item.id,
+            pop_receipt=queue_item.pop_receipt,
+            visibility_timeout=global_constants.queue_failed_retry_seconds,
+            new_content=json.dumps(content),
+        )
+
+    def quarantine(self, queue_item: QueueMessage, azure_queue: AzureQueue, reason):
+        """
+        Copy the message to the poison queue with its failure reason. The caller deletes
+        the original message afterwards.
+        """
+        poison_message = {
+            "message_id": queue_item.id,
+            "queue_name": azure_queue.queue_name,
+            "queue_lane": azure_queue.queue_lane,
+            "dequeue_count": queue_item.dequeue_count,
+            "failed_attempts": self.get_failed_attempts(queue_item),
+            "failure_reason": reason,
+            "quarantined_at": datetime.now(timezone.utc).isoformat(),
+            "content": queue_item.content,
+        }
+        azure_queue.get_poison_queue().enqueue(poison_message)
+        self.logger.warning(
+            f"Poison-Queue :: {azure_queue.queue_name} : Message {queue_item.id} quarantined after {self.get_failed_attempts(queue_item)} failed attempts and {queue_item.dequeue_count} deliveries : {reason}"
+        )
+
+    def replay(self, queue_lane=None, max_messages=None):
+        """
+        Move quarantined messages back to their queue, as new messages with a fresh retry
+        budget. Returns the number of messages replayed per lane.
+        """
+        queue_lanes = (
+            [queue_lane]
+            if queue_lane is not None
+            else list(global_constants.queue_lanes.values())
+        )
+        replayed_counts = {}
+        replayed_queue_names = set()
+        for lane_name in queue_lanes:
+            azure_queue = self.get_azure_queue(lane_name)
+            # Lanes sharing a queue share its poison queue
+            if azure_queue.queue_name in replayed_queue_names:
+                continue
+            replayed_queue_names.add(azure_queue.queue_name)
+            replayed_counts[lane_name] = self.replay_queue(azure_queue, max_messages)
+        return replayed_counts
+
+    @staticmethod
+    def reset_failed_attempts(content):
+        try:
+            message = json.loads(content)
+            if message.pop(global_constants.queue_failed_attempts_key, None) is None:
+                return content
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            return content
+        return json.dumps(message)
+
+    def replay_queue(self, azure_queue: AzureQueue, max_messages=None):
+        poison_queue = azure_queue.get_poison_queue()
+        replayed_count = 0
+        while max_messages is None or replayed_count < max_messages:
+            batch_size = global_constants.queue_dequeue_batch_size
+            if max_messages is not None:
+                batch_size = min(batch_size, max_messages - replayed_count)
+            poison_queue_items = poison_queue.dequeue_batch(
+                max_messages=batch_size,
+                visiblity_timeout=global_constants.queue_visiblity_time,
+            )
+            if not poison_queue_items:
+                break
+
+            for poison_queue_item in poison_queue_items:
+                try:
+                    content = json.loads(poison_queue_item.content)["content"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # Not written by quarantine, replay the message as it is
+                    content = poison_queue_item.content
+                content = self.reset_failed_attempts(content)
+                azure_queue.enqueue_content(content)
+                poison_queue.delete_queue_item(poison_queue_item)
+                replayed_count += 1
+
+        self.logger.info(
+            f"Poison-Queue :: {azure_queue.queue_name} : {replayed_count} messages replayed"
+        )
+        return replayed_count
@@ -0,0 +1,60 @@
+import json
+import logging
+from types import SimpleNamespace
+from global_constants import GlobalConstants
+from common.poison_queue_service import PoisonQueueService
+
+global_constants = GlobalConstants
+logger = logging.getLogger(__name__)
+
+
+class FakeAzureQueue:
+    def __init__(self):
+        self.updates = []
+
+    def update_queue_message(
+        self, message_id, pop_receipt, visibility_timeout=0, new_content=None
+    ):
+        self.updates.append((message_id, pop_receipt, visibility_timeout, new_content))
+
+
+def make_queue_item(content, dequeue_count=1):
+    return SimpleNamespace(
+        id="message-id",
+        pop_receipt="pop-receipt",
+        content=json.dumps(content),
+        dequeue_count=dequeue_count,
+    )
+
+
+def test_deliveries_without_failures_do_not_use_the_retry_budget():
+    # e.g. released on every stop or drain before a worker ran it
+    queue_item = make_queue_item(
+        {"message_type": "keyword-analysis"},
+        dequeue_count=global_constants.queue_max_failed_attempts + 2,
+    )
+    assert not PoisonQueueService.is_retry_budget_exhausted(queue_item)
+    assert not PoisonQueueService.is_poison(queue_item)
+
+
+def test_failed_attempts_are_counted_in_the_message():
+    azure_queue = FakeAzureQueue()
+    poison_queue_service = PoisonQueueService(logger)
+    queue_item = make_queue_item({"message_type": "keyword-analysis"})
+
+    for _ in range(global_constants.queue_max_failed_attempts - 1):
+        assert not poison_queue_service.is_retry_budget_exhausted(queue_item)
+        poison_queue_service.record_failed_attempt(queue_item, azure_queue)
+        queue_item.content = azure_queue.updates[-1][3]
+
+    assert poison_queue_service.is_retry_budget_exhausted(queue_item)
+    assert azure_queue.updates[-1][2] == global_constants.queue_failed_retry_seconds
+    assert json.loads(queue_item.content)["message_type"] == "keyword-analysis"
+
+
+def test_replayed_messages_get_a_fresh_retry_budget():
+    content = json.dumps({"message_type": "keyword-analysis", "failed_attempts": 4})
+    assert json.loads(PoisonQueueService.reset_failed_attempts(content)) == {
+        "message_type": "keyword-analysis"
+    }
+    assert PoisonQueueService.reset_failed_attempts("not json") == "not json"
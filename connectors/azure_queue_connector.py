@@ -1,4 +1,5 @@
 from azure.storage.queue import QueueClient
+from azure.storage.queue.aio import QueueClient as AsyncQueueClient
 from connectors.key_vault_connector import AzureKeyVaultConnector
 from global_constants import GlobalConstants
 
@@ -6,7 +7,9 @@ global_constants = GlobalConstants
 
 
 class AzureQueueConnector:
-    def __init__(self):
+    def __init__(
+        self, queue_lane=global_constants.queue_lanes.interactive, queue_name=None
+    ):
         # Instantiate AzureKeyVaultConnector
         kv_client = AzureKeyVaultConnector()
 
@@ -15,11 +18,27 @@ class AzureQueueConnector:
             global_constants.keys_of_key_vault_secrets.azure_queue_conn_string
         )
         self.queue_name = kv_client.get_secret(
-            global_constants.keys_of_key_vault_secrets.queue_name
+            global_constants.queue_lane_queue_name_secrets[queue_lane]
         )
 
+        # Queues derived from the lane queue (e.g. its poison queue) are named explicitly
+        if queue_name is not None:
+            self.queue_name = queue_name
+
+        # Lanes without a queue of their own share the default queue
+        if self.queue_name is None:
+            self.queue_name = kv_client.get_secret(
+                global_constants.keys_of_key_vault_secrets.queue_name
+            )
+
     def connect(self)-> QueueClient:
         # Create and return QueueClient
         return QueueClient.from_connection_string(
             self.connection_string, queue_name=self.queue_name
-        )
\ No newline at end of file
+        )
+
+    def connect_async(self) -> AsyncQueueClient:
+        # Bound to the event loop it is first used on
+        return AsyncQueueClient.from_connection_string(
+            self.connection_string, queue_name=self.queue_name
+        )
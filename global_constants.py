@@ -11,16 +11,98 @@ class DotAccessDict(dict):
             )
 
 
+def parse_key_value_pairs(value, cast=str):
+    # "interactive:3,bulk:1" -> {"interactive": 3, "bulk": 1}
+    pairs = {}
+    for pair in value.split(","):
+        if ":" in pair:
+            key, pair_value = pair.split(":", 1)
+            pairs[key.strip()] = cast(pair_value.strip())
+    return pairs
+
+
 class GlobalConstants(DotAccessDict):
     api_version = "/v1"
     utf_8 = "utf-8"
     graph_service_scope = "https://graph.microsoft.com/.default"
+    # Concurrent Graph calls of a SharePoint folder crawl
+    sharepoint_crawl_concurrency = int(os.getenv("SharePointCrawlConcurrency", 8))
+    # Retries of a throttled Graph call (429 / 503), waiting for its Retry-After
+    sharepoint_throttle_max_retries = int(os.getenv("SharePointThrottleMaxRetries", 5))
+    sharepoint_throttle_default_wait_seconds = float(
+        os.getenv("SharePointThrottleDefaultWaitSeconds", 10)
+    )
+    graph_throttled_status_codes = (429, 503)
+    graph_download_url_key = "@microsoft.graph.downloadUrl"
+    sharepoint_download_timeout_seconds = int(
+        os.getenv("SharePointDownloadTimeoutSeconds", 300)
+    )
+    # Bytes of a file downloaded and staged as one blob block at a time
+    blob_upload_block_size = int(os.getenv("BlobUploadBlockSize", 4 * 1024 * 1024))
+    # Items per page of a drive item listing ($top)
+    sharepoint_page_size = int(os.getenv("SharePointPageSize", 200))
+    # Drive item fields requested by folder listings ($select)
+    sharepoint_drive_item_fields = (
+        "id",
+        "webUrl",
+        "eTag",
+        "size",
+        "folder",
+        "deleted",
+        "parentReference",
+        "root",
+    )
     flask_app_port = os.getenv("WEBSITES_PORT", 8000)
     flask_host = "0.0.0.0"
     u = "u"
     queue_visiblity_time = int(os.getenv("QueueVisiblityTime", 300))
     azure_kv_uri = os.getenv("AZURE_KEY_VAULT_URL", None)
     no_of_threads = int(os.getenv("NoOfThreads", 20))
+    # Run the queue workers inside every web process, disable when they run from worker.py
+    queue_workers_in_web_process = (
+        os.getenv("QueueWorkersInWebProcess", "true").lower() == "true"
+    )
+    queue_worker_processes = int(os.getenv("QueueWorkerProcesses", 1))
+    # "threads" for the worker pools, "asyncio" for the event loop consumer of worker.py
+    queue_worker_runtime = os.getenv("QueueWorkerRuntime", "threads")
+    queue_dequeue_batch_size = min(int(os.getenv("QueueDequeueBatchSize", 32)), 32)
+    queue_prefetch_count = int(os.getenv("QueuePrefetchCount", 0))
+    queue_idle_min_wait_seconds = float(os.getenv("QueueIdleMinWaitSeconds", 0.5))
+    queue_idle_max_wait_seconds = float(os.getenv("QueueIdleMaxWaitSeconds", 30))
+    queue_idle_backoff_multiplier = float(os.getenv("QueueIdleBackoffMultiplier", 2))
+    queue_length_sample_interval_seconds = int(
+        os.getenv("QueueLengthSampleIntervalSeconds", 60)
+    )
+    queue_lease_renew_ahead_seconds = int(os.getenv("QueueLeaseRenewAheadSeconds", 60))
+    queue_lease_retry_seconds = int(os.getenv("QueueLeaseRetrySeconds", 5))
+    queue_max_lease_seconds = int(os.getenv("QueueMaxLeaseSeconds", 7200))
+    # Failed attempts of a message before it is moved to the poison queue of its queue
+    queue_max_failed_attempts = int(os.getenv("QueueMaxFailedAttempts", 5))
+    # Delay before a failed message is attempted again
+    queue_failed_retry_seconds = int(os.getenv("QueueFailedRetrySeconds", 60))
+    # Deliveries before quarantine of a message whose failures are never recorded (e.g. it
+    # kills the worker), deliveries also count releases on stop and drain so keep it high
+    queue_max_dequeue_count = int(os.getenv("QueueMaxDequeueCount", 20))
+    queue_failed_attempts_key = "failed_attempts"
+    queue_poison_suffix = "-poison"
+    # Age after which a claimed file version can be enqueued again
+    idempotency_marker_ttl_seconds = int(
+        os.getenv("IdempotencyMarkerTtlSeconds", 7 * 24 * 3600)
+    )
+    idempotency_marker_folder = "idempotency"
+    # Run state entries inserted per transaction by a folder scan
+    folder_reader_page_size = 200
+    # Queue messages sent at a time by a folder scan
+    folder_reader_enqueue_concurrency = int(
+        os.getenv("FolderReaderEnqueueConcurrency", 32)
+    )
+    # Has to stay below the grace period given by the platform before killing the process
+    queue_drain_timeout_seconds = int(os.getenv("QueueDrainTimeoutSeconds", 20))
+    # Asyncio queue runtime: messages in flight and executor threads for blocking handlers
+    queue_async_concurrency = int(os.getenv("QueueAsyncConcurrency", 200))
+    queue_async_executor_workers = int(os.getenv("QueueAsyncExecutorWorkers", 8))
+    # Threads of the asyncio runtime for blocking I/O calls (MySQL, blob markers)
+    queue_async_io_workers = int(os.getenv("QueueAsyncIoWorkers", 32))
     azure_client_id = "AZURE_CLIENT_ID"
     azure_client_secret = "AZURE_CLIENT_SECRET"
     azure_tenant_id = "AZURE_TENANT_ID"
@@ -162,6 +244,73 @@ class GlobalConstants(DotAccessDict):
 
     queue_message_types = DotAccessDict(queue_message_types)
 
+    # FULL lists the whole folder tree, DELTA only the items changed since the last scan
+    folder_scan_sync_modes = {
+        "full": "FULL",
+        "delta": "DELTA",
+    }
+
+    folder_scan_sync_modes = DotAccessDict(folder_scan_sync_modes)
+
+    folder_scan_default_sync_mode = os.getenv(
+        "FolderScanSyncMode", folder_scan_sync_modes.full
+    )
+
+    # Named queues polled by the queue processor, the first lane is the default queue
+    queue_lanes = {
+        "interactive": "interactive",
+        "bulk": "bulk",
+    }
+    queue_lanes = DotAccessDict(queue_lanes)
+
+    # Lane each message type is sent to
+    queue_message_type_lanes = {
+        queue_message_types.keyword_analysis: queue_lanes.interactive,
+        queue_message_types.folder_scan: queue_lanes.bulk,
+        queue_message_types.msds_artifact_upload: queue_lanes.bulk,
+    }
+    queue_message_type_lanes = DotAccessDict(queue_message_type_lanes)
+
+    # Share of the polls given to each lane while several lanes have work and free workers
+    queue_lane_weights = parse_key_value_pairs(
+        os.getenv("QueueLaneWeights", "interactive:3,bulk:1"), int
+    )
+    queue_lane_weights = DotAccessDict(queue_lane_weights)
+
+    # Maximum number of messages of each lane processed at the same time
+    queue_lane_concurrency = parse_key_value_pairs(
+        os.getenv("QueueLaneConcurrency", "interactive:8,bulk:12"), int
+    )
+    queue_lane_concurrency = DotAccessDict(queue_lane_concurrency)
+
+    # Worker threads of the pool processing each message type
+    queue_worker_pool_threads = parse_key_value_pairs(
+        os.getenv(
+            "QueueWorkerPoolThreads",
+            "keyword-analysis:8,folder-scan:6,msds-artifact-upload:6",
+        ),
+        int,
+    )
+
+    # Maximum number of messages held by each pool, defaults to its threads plus the prefetch
+    queue_worker_pool_max_in_flight = parse_key_value_pairs(
+        os.getenv("QueueWorkerPoolMaxInFlight", ""), int
+    )
+
+    # Pools running their messages in worker processes instead of threads, e.g. "keyword-analysis:true"
+    queue_worker_pool_processes = parse_key_value_pairs(
+        os.getenv("QueueWorkerPoolProcesses", ""),
+        lambda value: value.lower() == "true",
+    )
+
+    idempotency_statuses = {
+        "queued": "queued",
+        "processing": "processing",
+        "finished": "finished",
+        "failed": "failed",
+    }
+    idempotency_statuses = DotAccessDict(idempotency_statuses)
+
     file_extensions = {
         "txt": "txt",
         "pdf": "pdf",
@@ -184,6 +333,7 @@ class GlobalConstants(DotAccessDict):
         "azure_queue_conn_string": "AzureQueueConnString",
         "app_insights_conn_string": "AppInsightsConnString",
         "queue_name": "QueueName",
+        "bulk_queue_name": "BulkQueueName",
         "blob_storage_base_uri": "BlobStorageBaseUri",
         "azure_vision_ai_endpoint": "AzureVisionAiEndpoint",
         "azure_vision_ai_key": "AzureVisionAiKey",
@@ -212,3 +362,9 @@ class GlobalConstants(DotAccessDict):
     }
 
     keys_of_key_vault_secrets = DotAccessDict(keys_of_key_vault_secrets)
+
+    queue_lane_queue_name_secrets = {
+        queue_lanes.interactive: keys_of_key_vault_secrets.queue_name,
+        queue_lanes.bulk: keys_of_key_vault_secrets.bulk_queue_name,
+    }
+    queue_lane_queue_name_secrets = DotAccessDict(queue_lane_queue_name_secrets)
@@ -0,0 +1,438 @@
+import json
+import time
+import signal
+import asyncio
+from logging import Logger
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.queue import QueueMessage
+from global_constants import GlobalConstants
+from utils.azure_queue import AzureQueue, AsyncAzureQueue
+from utils.exceptions import MaxProcessingTimeExceededException
+from utils.exceptions import MissingRequiredDetailsError
+from utils.threading_tools import ThreadingTool
+from utils.visibility_lease_renewer import VisibilityLease, VisibilityLeaseRenewer
+from processors.queue import QueueProcessor
+from processors.queue_dispatcher import IdleBackoff, QueueLane
+
+global_constants = GlobalConstants
+
+
+class AsyncQueueLane:
+    """A lane of the queue processor with the aio client of its queue"""
+
+    def __init__(self, lane: QueueLane, async_azure_queue: AsyncAzureQueue):
+        self.lane = lane
+        self.async_azure_queue = async_azure_queue
+        self.idle_backoff = IdleBackoff()
+        self.wake_event = asyncio.Event()
+        self.waiting_for_slot = False
+
+    @property
+    def name(self):
+        return self.lane.name
+
+    @property
+    def azure_queue(self) -> AzureQueue:
+        return self.lane.azure_queue
+
+
+class AsyncVisibilityLease:
+    """A received message kept invisible from the loop until its lease is stopped"""
+
+    def __init__(self, queue_item: QueueMessage, async_lane: AsyncQueueLane):
+        self.queue_item = queue_item
+        self.async_lane = async_lane
+        self.released = asyncio.Event()
+        self.task = None
+
+
+class AsyncQueueProcessor:
+    """
+    Queue consumer running on the event loop of the process instead of worker threads.
+
+    Messages are received, kept invisible and deleted through the aio queue clients, and
+    at most `concurrency` of them are in flight at a time. Message types with a coroutine
+    handler (e.g. the folder scan, which only waits on Graph, the queue and MySQL) run on
+    the loop, so a single process holds hundreds of them. The other types, whose work is
+    CPU bound or blocking, run their regular handler on an executor of
+    `executor_workers` threads; the SharePoint calls they make still run on the loop.
+    Blocking I/O calls of the loop handlers (MySQL, blob markers) have an executor of
+    their own, so they do not wait behind these handlers.
+
+    Every message is leased from the loop as soon as it is received. A message routed
+    to the executor waits for a free executor thread under that lease and is handed
+    over to the lease renewer of the thread based processor only when a thread is free
+    to start it, so no message waits unrenewed in the executor queue.
+
+    Once stopped, no message is received anymore and the messages in flight get
+    `queue_drain_timeout_seconds` to finish before they are made visible again.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        queue_processor: QueueProcessor = None,
+        concurrency=global_constants.queue_async_concurrency,
+        executor_workers=global_constants.queue_async_executor_workers,
+    ):
+        self.logger = logger
+        self.queue_processor = queue_processor or QueueProcessor(logger)
+        self.concurrency = max(1, concurrency)
+        self.executor_workers = max(1, executor_workers)
+        self.async_handlers = {
+            global_constants.queue_message_types.folder_scan: self.process_folder_scan,
+        }
+        self.lanes = []
+        self.tasks = set()
+        # Leases of the received messages not handed over to an executor thread
+        self.leases = {}
+        self.event_loop = None
+        self.semaphore = None
+        self.executor_slots = None
+        self.handler_executor = None
+        self.stopping = None
+
+    def run(self):
+        """Process messages until stopped, blocks the calling thread"""
+        ThreadingTool.run_coroutine(self.consume())
+
+    def stop(self):
+        """Thread safe, e.g. from a signal handler"""
+        if self.event_loop is not None:
+            self.event_loop.call_soon_threadsafe(self.stopping.set)
+
+    def install_drain_signal_handler(self, signal_numbers=(signal.SIGTERM,)):
+        for signal_number in signal_numbers:
+            signal.signal(signal_number, lambda signum, frame: self.stop())
+
+    def wake(self):
+        # Called by AzureQueue from any thread after a message is sent
+        if self.event_loop is None:
+            return
+        for async_lane in self.lanes:
+            self.event_loop.call_soon_threadsafe(async_lane.wake_event.set)
+
+    def build_lanes(self):
+        return [
+            AsyncQueueLane(lane, AsyncAzureQueue(lane.azure_queue.queue_lane))
+            for lane in self.queue_processor.build_queue_lanes(self.concurrency)
+        ]
+
+    async def consume(self):
+        self.semaphore = asyncio.BoundedSemaphore(self.concurrency)
+        self.executor_slots = asyncio.BoundedSemaphore(self.executor_workers)
+        self.stopping = asyncio.Event()
+        self.event_loop = asyncio.get_running_loop()
+        self.handler_executor = ThreadPoolExecutor(
+            max_workers=self.executor_workers, thread_name_prefix="async-queue-executor"
+        )
+        # Blocking calls made with ThreadingTool.run_blocking
+        io_executor = ThreadPoolExecutor(
+            max_workers=global_constants.queue_async_io_workers,
+            thread_name_prefix="async-queue-io",
+        )
+        self.event_loop.set_default_executor(io_executor)
+        self.lanes = self.build_lanes()
+        AzureQueue.add_enqueue_listener(self.wake)
+
+        self.logger.info(
+            f"Async-Queue-Processor :: Started, {self.concurrency} messages in flight, {self.executor_workers} executor threads"
+        )
+        lane_tasks = [
+            asyncio.create_task(self.consume_lane(async_lane)) for async_lane in self.lanes
+        ]
+        await self.stopping.wait()
+        for async_lane, lane_task in zip(self.lanes, lane_tasks):
+            # Nothing was received by a lane waiting for a free slot
+            if async_lane.waiting_for_slot:
+                lane_task.cancel()
+        await asyncio.gather(*lane_tasks, return_exceptions=True)
+        await self.drain()
+
+        for async_lane in self.lanes:
+            await async_lane.async_azure_queue.close()
+        # Nothing waits in the handler executor, a message is only submitted to a free thread
+        self.handler_executor.shutdown(wait=False)
+        io_executor.shutdown(wait=False)
+
+    async def drain(self):
+        self.logger.info(
+            f"Async-Queue-Processor :: Draining, {len(self.tasks)} messages in flight"
+        )
+        if self.tasks:
+            await asyncio.wait(
+                set(self.tasks), timeout=global_constants.queue_drain_timeout_seconds
+            )
+
+        # Unfinished messages are made visible again for another consumer, the ones
+        # still on the loop or waiting for an executor thread first
+        released_count = 0
+        for lease in list(self.leases.values()):
+            if await self.release(lease):
+                released_count += 1
+        # Then the ones run by executor threads, which do not delete them afterwards.
+        # Not run on an executor, whose threads may all be busy with handlers
+        released_count += VisibilityLeaseRenewer.abandon_all()
+        for task in list(self.tasks):
+            task.cancel()
+        self.logger.info(
+            f"Async-Queue-Processor :: Drained, {released_count} unfinished messages released"
+        )
+
+    async def acquire_slots(self, max_slots):
+        """Wait for a free slot, then take the free ones up to `max_slots`"""
+        await self.semaphore.acquire()
+        slots = 1
+        while slots < max_slots and not self.semaphore.locked():
+            await self.semaphore.acquire()
+            slots += 1
+        return slots
+
+    async def wait_idle(self, async_lane: AsyncQueueLane):
+        # Back off until the next poll, a message sent by this process or a stop
+        async_lane.wake_event.clear()
+        waiters = [
+            asyncio.create_task(async_lane.wake_event.wait()),
+            asyncio.create_task(self.stopping.wait()),
+        ]
+        await asyncio.wait(
+            waiters,
+            timeout=async_lane.idle_backoff.next_wait(),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        for waiter in waiters:
+            waiter.cancel()
+
+    async def consume_lane(self, async_lane: AsyncQueueLane):
+        while not self.stopping.is_set():
+            async_lane.waiting_for_slot = True
+            slots = await self.acquire_slots(global_constants.queue_dequeue_batch_size)
+            async_lane.waiting_for_slot = False
+            if self.stopping.is_set():
+                for _ in range(slots):
+                    self.semaphore.release()
+                return
+
+            try:
+                queue_items = await async_lane.async_azure_queue.dequeue_batch(
+                    max_messages=slots,
+                    visiblity_timeout=global_constants.queue_visiblity_time,
+                )
+            except Exception as e:
+                self.logger.warning(
+                    f"Async-Queue-Processor :: {async_lane.name} : Receiving messages failed :{str(e)}"
+                )
+                queue_items = []
+
+            # Give back the slots no message was received for
+            for _ in range(slots - len(queue_items)):
+                self.semaphore.release()
+
+            if not queue_items:
+                await self.wait_idle(async_lane)
+                continue
+
+            async_lane.idle_backoff.reset()
+            received_at = time.monotonic()
+            for queue_item in queue_items:
+                async_lane.lane.metrics.record_pickup(queue_item, received_at)
+                lease = self.start_lease(queue_item, async_lane)
+                task = asyncio.create_task(self.process(lease))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    def get_message_type(self, queue_item: QueueMessage):
+        try:
+            return json.loads(queue_item.content).get("message_type")
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            return None
+
+    def start_lease(self, queue_item: QueueMessage, async_lane: AsyncQueueLane):
+        lease = AsyncVisibilityLease(queue_item, async_lane)
+        lease.task = asyncio.create_task(self.renew_lease(lease))
+        self.leases[queue_item.id] = lease
+        return lease
+
+    async def stop_lease(self, lease: AsyncVisibilityLease):
+        # Wait for a renewal in progress so the message keeps its current pop receipt
+        lease.released.set()
+        await lease.task
+        self.leases.pop(lease.queue_item.id, None)
+
+    async def release(self, lease: AsyncVisibilityLease):
+        """Stop the lease and make the message visible again right away"""
+        await self.stop_lease(lease)
+        queue_item = lease.queue_item
+        try:
+            await lease.async_lane.async_azure_queue.update_queue_message(
+                queue_item.id, queue_item.pop_receipt, visibility_timeout=0
+            )
+            return True
+        except Exception as e:
+            self.logger.warning(
+                f"Async-Queue-Processor :: Releasing message {queue_item.id} failed :{str(e)}"
+            )
+            return False
+
+    async def process(self, lease: AsyncVisibilityLease):
+        queue_item, async_lane = lease.queue_item, lease.async_lane
+        try:
+            async_handler = self.async_handlers.get(self.get_message_type(queue_item))
+            if async_handler is None:
+                await self.process_in_executor(lease)
+            else:
+                await self.process_on_loop(async_handler, lease)
+        except Exception as e:
+            self.logger.exception(
+                f"Async-Queue-Processor :: {async_lane.name} : Error :{str(e)}"
+            )
+        finally:
+            if not lease.released.is_set():
+                await self.stop_lease(lease)
+            self.semaphore.release()
+
+    async def process_in_executor(self, lease: AsyncVisibilityLease):
+        """
+        Run the message with the thread based processor, which leases, routes and
+        deletes it, once an executor thread is free to start it right away
+        """
+        async with self.executor_slots:
+            if self.stopping.is_set():
+                if not lease.released.is_set():
+                    await self.release(lease)
+                return
+            await self.stop_lease(lease)
+            await self.event_loop.run_in_executor(
+                self.handler_executor,
+                self.process_queue_item,
+                lease.queue_item,
+                lease.async_lane.azure_queue,
+            )
+
+    def process_queue_item(self, queue_item: QueueMessage, azure_queue: AzureQueue):
+        if self.stopping.is_set():
+            # Stopped while handing it over, the drain may have missed it
+            azure_queue.update_queue_message(
+                message_id=queue_item.id,
+                pop_receipt=queue_item.pop_receipt,
+                visibility_timeout=0,
+            )
+            return
+        self.queue_processor.process_queue_item(
+            queue_item, azure_queue, ThreadingTool.get_thread_id()
+        )
+
+    async def process_on_loop(self, async_handler, lease: AsyncVisibilityLease):
+        queue_item, async_lane = lease.queue_item, lease.async_lane
+        self.logger.info(
+            f"Async-Queue-Processor :: {async_lane.name} :: Queue item : {queue_item.content}"
+        )
+        poison_queue_service = self.queue_processor.poison_queue_service
+        delete = False
+        failed = False
+        try:
+            # Delivered far more often than its attempts allow, e.g. it kills the worker
+            if poison_queue_service.is_poison(queue_item):
+                await ThreadingTool.run_blocking(
+                    poison_queue_service.quarantine,
+                    queue_item,
+                    async_lane.azure_queue,
+                    "Retry budget exhausted without a recorded failure",
+                )
+                delete = True
+            else:
+                delete = await async_handler(queue_item)
+        except Exception as e:
+            self.logger.exception(
+                f"Async-Queue-Processor :: {async_lane.name} : Error :{str(e)}"
+            )
+            if poison_queue_service.is_retry_budget_exhausted(queue_item):
+                await ThreadingTool.run_blocking(
+                    poison_queue_service.quarantine,
+                    queue_item,
+                    async_lane.azure_queue,
+                    f"{type(e).__name__}: {str(e)}",
+                )
+                delete = True
+            else:
+                failed = True
+        finally:
+            await self.stop_lease(lease)
+
+        if delete:
+            await async_lane.async_azure_queue.delete_queue_item(queue_item)
+        elif failed:
+            try:
+                await ThreadingTool.run_blocking(
+                    poison_queue_service.record_failed_attempt,
+                    queue_item,
+                    async_lane.azure_queue,
+                )
+            except Exception as e:
+                self.logger.warning(
+                    f"Async-Queue-Processor :: {async_lane.name} : Recording a failed attempt of message {queue_item.id} failed :{str(e)}"
+                )
+
+    async def renew_lease(self, lease: AsyncVisibilityLease):
+        """Extend the visibility of a message from the loop until its lease is stopped"""
+        queue_item, async_lane = lease.queue_item, lease.async_lane
+        leased_at = time.monotonic()
+        renew_in_seconds = VisibilityLease.get_seconds_until_renewal(queue_item)
+        while True:
+            try:
+                await asyncio.wait_for(
+                    lease.released.wait(), timeout=max(0, renew_in_seconds)
+                )
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            if time.monotonic() - leased_at > global_constants.queue_max_lease_seconds:
+                self.logger.warning(
+                    f"Async-Queue-Processor :: Message {queue_item.id} held for more than {global_constants.queue_max_lease_seconds} seconds, lease no longer renewed"
+                )
+                return
+            try:
+                updated_queue_item = (
+                    await async_lane.async_azure_queue.update_queue_message(
+                        queue_item.id,
+                        queue_item.pop_receipt,
+                        visibility_timeout=global_constants.queue_visiblity_time,
+                    )
+                )
+            except ResourceNotFoundError:
+                # Deleted, or its lease was lost and another consumer received it
+                self.logger.warning(
+                    f"Async-Queue-Processor :: Message {queue_item.id} lost, lease no longer renewed"
+                )
+                return
+            except Exception as e:
+                self.logger.warning(
+                    f"Async-Queue-Processor :: Renewing message {queue_item.id} failed :{str(e)}"
+                )
+                renew_in_seconds = global_constants.queue_lease_retry_seconds
+                continue
+
+            queue_item.pop_receipt = updated_queue_item.pop_receipt
+            queue_item.next_visible_on = updated_queue_item.next_visible_on
+            renew_in_seconds = VisibilityLease.get_seconds_until_renewal(queue_item)
+
+    async def process_folder_scan(self, queue_item: QueueMessage):
+        """Returns True if the message has to be deleted"""
+        try:
+            folder_reader_input_data = (
+                self.queue_processor.get_folder_reader_input_data(queue_item)
+            )
+        except (MissingRequiredDetailsError, json.JSONDecodeError) as e:
+            self.logger.exception(f"Async-Queue-Processor :: Exception :{str(e)}")
+            return True
+
+        try:
+            await self.queue_processor.folder_reader_service.process_folder_async(
+                folder_reader_input_data
+            )
+        # If max processing time is reached, the folder will processed later
+        except MaxProcessingTimeExceededException:
+            return False
+        return True
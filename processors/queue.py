@@ -1,6 +1,8 @@
-import time
+import os
 import json
-import asyncio
+import time
+import signal
+import threading
 from global_constants import GlobalConstants
 from utils.azure_queue import AzureQueue
 from utils.exceptions import MaxProcessingTimeExceededException
@@ -11,6 +13,9 @@ from app.modules.keyword_analysis.services.handle_queue_item import (
     HandleQueueItem as KeywordAnalysisQueueHandler,
 )
 from common.folder_reader_service import FolderReader
+from common.poison_queue_service import PoisonQueueService
+from utils.idempotency_marker import IdempotencyMarkerStore
+from connectors.blob_storage_connector import AzureBlobStorageConnector
 from app.modules.artifact_ingestor.services.artifact_ingestor_service import (
     ArtifactIngestorService,
 )
@@ -24,21 +29,28 @@ from common.dto.folder_reader_input_dto import (
 from utils.threading_tools import ThreadingTool
 from azure.storage.queue import QueueMessage
 from utils.task_visiblity_controller import TaskVisibilityController
+from utils.visibility_lease_renewer import VisibilityLeaseRenewer
+from processors.queue_dispatcher import QueueDispatcher, QueueLane
+from processors.worker_pool import WorkerPool
 
 global_constants = GlobalConstants
-azure_queue_util = AzureQueue()
 
 
 class QueueProcessor:
     def __init__(self, logger: Logger):
         self.logger = logger
-        asyncio_event_loop = asyncio.new_event_loop()
+        self.queue_dispatcher = None
+        self.threads = []
+        self._drain_lock = threading.Lock()
+        self._drained = False
         self.encoder = Encoding()
-        self.keyword_analysis_handle_queue_item = KeywordAnalysisQueueHandler(logger)
-        self.folder_reader_service = FolderReader(logger, asyncio_event_loop)
-        self.artifact_ingestor_service = ArtifactIngestorService(
-            logger, asyncio_event_loop
+        self.poison_queue_service = PoisonQueueService(logger)
+        self.idempotency_marker_store = IdempotencyMarkerStore(
+            AzureBlobStorageConnector().connect(), logger
         )
+        self.keyword_analysis_handle_queue_item = KeywordAnalysisQueueHandler(logger)
+        self.folder_reader_service = FolderReader(logger)
+        self.artifact_ingestor_service = ArtifactIngestorService(logger)
 
     def validate_data(self, data, required_fields):
         if data is None:
@@ -50,19 +62,31 @@ class QueueProcessor:
             )
         return True
 
-    def process_keyword_analysis(self, queue_item: QueueMessage):
+    def run_handler(self, worker_pool: WorkerPool, handler, *args):
+        """Run a handler in this process, or in a worker process of a process pool"""
+        if worker_pool is not None and worker_pool.use_processes:
+            return worker_pool.run_in_worker_process(*args)
+        return handler(*args)
+
+    def process_keyword_analysis(
+        self,
+        queue_item: QueueMessage,
+        azure_queue: AzureQueue,
+        worker_pool: WorkerPool = None,
+    ):
         try:
             thread_id = ThreadingTool.get_thread_id()
             # Extract api parameters from queue item and process it
-            file_uri, processed_queue_item = (
-                self.keyword_analysis_handle_queue_item.extract_api_parameters_and_process_queue_item(
-                    queue_item, thread_id
-                )
+            file_uri, processed_queue_item = self.run_handler(
+                worker_pool,
+                self.keyword_analysis_handle_queue_item.extract_api_parameters_and_process_queue_item,
+                queue_item,
+                thread_id,
             )
             if file_uri and processed_queue_item:
                 base64_encoded_file_uri = self.encoder.encode_data(file_uri)
                 # Delete queue item after processing
-                azure_queue_util.delete_queue_item(processed_queue_item)
+                self.delete_queue_item(azure_queue)
                 self.logger.info(
                     f"Thread : {thread_id} :: Queue item deleted for {base64_encoded_file_uri} [{file_uri}]"
                 )
@@ -70,37 +94,51 @@ class QueueProcessor:
         except MaxProcessingTimeExceededException:
             pass
 
-    def process_folder_scan(self, queue_item: QueueMessage):
+    def get_folder_reader_input_data(
+        self, queue_item: QueueMessage
+    ) -> FolderReaderInputDTO:
+        required_fields = [
+            "artifact_type",
+            "location_type",
+            "folder_location",
+            "folder_upload_id",
+        ]
+        queue_content = json.loads(queue_item.content)
+        data = queue_content.get("data")
+        self.validate_data(data, required_fields)
+
+        sync_mode = data.get(
+            "sync_mode", global_constants.folder_scan_default_sync_mode
+        )
+        if sync_mode not in global_constants.folder_scan_sync_modes.values():
+            raise MissingRequiredDetailsError(f"Unsupported sync_mode: {sync_mode}")
+
+        return FolderReaderInputDTO(
+            artifact_type=data.get("artifact_type"),
+            location_type=data.get("location_type"),
+            folder_location=data.get("folder_location"),
+            folder_upload_id=data.get("folder_upload_id"),
+            sync_mode=sync_mode,
+        )
+
+    def process_folder_scan(
+        self,
+        queue_item: QueueMessage,
+        azure_queue: AzureQueue,
+        worker_pool: WorkerPool = None,
+    ):
         try:
             thread_id = ThreadingTool.get_thread_id()
-            TaskVisibilityController.set_queue_item(queue_item)
 
-            required_fields = [
-                "artifact_type",
-                "location_type",
-                "folder_location",
-                "folder_upload_id",
-            ]
-            queue_content = json.loads(queue_item.content)
-            data = queue_content.get("data")
-            self.validate_data(data, required_fields)
+            folder_reader_input_data = self.get_folder_reader_input_data(queue_item)
 
-            artifact_type = data.get("artifact_type")
-            location_type = data.get("location_type")
-            folder_location = data.get("folder_location")
-            folder_upload_id = data.get("folder_upload_id")
-
-            folder_reader_input_data = FolderReaderInputDTO(
-                artifact_type=artifact_type,
-                location_type=location_type,
-                folder_location=folder_location,
-                folder_upload_id=folder_upload_id,
+            self.run_handler(
+                worker_pool,
+                self.folder_reader_service.process_folder,
+                folder_reader_input_data,
             )
 
-            self.folder_reader_service.process_folder(folder_reader_input_data)
-
-            queue_item = TaskVisibilityController.get_queue_item()
-            azure_queue_util.delete_queue_item(queue_item)
+            self.delete_queue_item(azure_queue)
 
         # If max processing time is reached, the file will processed later
         except MaxProcessingTimeExceededException:
@@ -108,18 +146,20 @@ class QueueProcessor:
 
         except (MissingRequiredDetailsError, json.JSONDecodeError) as e:
             self.logger.exception(f"Thread : {thread_id} :: Exception :{str(e)}")
-            azure_queue_util.delete_queue_item(queue_item)
+            self.delete_queue_item(azure_queue)
 
         except Exception as e:
             self.logger.error(f"Thread : {thread_id} :: Error :{str(e)}")
-
-        finally:
-            TaskVisibilityController.clear_data()
-
-    def process_artifact_upload(self, queue_item: QueueMessage):
+            self.handle_failed_queue_item(queue_item, azure_queue, e)
+
+    def process_artifact_upload(
+        self,
+        queue_item: QueueMessage,
+        azure_queue: AzureQueue,
+        worker_pool: WorkerPool = None,
+    ):
         try:
             thread_id = ThreadingTool.get_thread_id()
-            TaskVisibilityController.set_queue_item(queue_item)
 
             required_fields = [
                 "full_path",
@@ -131,14 +171,37 @@ class QueueProcessor:
 
             artifact_file_url = data.get("full_path")
             artifact_upload_run_state_id = data.get("artifact_upload_run_state_id")
+            idempotency_key = data.get("idempotency_key")
+
+            # Coalesce duplicates of a file version onto the run which claimed it
+            if idempotency_key is not None:
+                claimed_marker = self.idempotency_marker_store.start(
+                    global_constants.queue_message_types.msds_artifact_upload,
+                    idempotency_key,
+                    artifact_upload_run_state_id,
+                )
+                if claimed_marker is not None:
+                    self.logger.info(
+                        f"Thread : {thread_id} :: {artifact_upload_run_state_id} : Duplicate of run {claimed_marker.owner} ({claimed_marker.status}), skipped"
+                    )
+                    self.delete_queue_item(azure_queue)
+                    return
 
             data = ArtifactIngestorInputDTO(
                 artifact_file_url=artifact_file_url,
                 artifact_upload_run_state_id=artifact_upload_run_state_id,
             )
-            self.artifact_ingestor_service.ingest_artifact(data)
-            queue_item = TaskVisibilityController.get_queue_item()
-            azure_queue_util.delete_queue_item(queue_item)
+            succeeded = self.run_handler(
+                worker_pool, self.artifact_ingestor_service.ingest_artifact, data
+            )
+            if idempotency_key is not None:
+                self.idempotency_marker_store.finish(
+                    global_constants.queue_message_types.msds_artifact_upload,
+                    idempotency_key,
+                    artifact_upload_run_state_id,
+                    succeeded=bool(succeeded),
+                )
+            self.delete_queue_item(azure_queue)
 
         # If max processing time is reached, the file will processed later
         except MaxProcessingTimeExceededException:
@@ -146,56 +209,282 @@ class QueueProcessor:
 
         except (MissingRequiredDetailsError, json.JSONDecodeError) as e:
             self.logger.exception(f"Thread : {thread_id} :: Exception :{str(e)}")
-            azure_queue_util.delete_queue_item(queue_item)
+            self.delete_queue_item(azure_queue)
 
         except Exception as e:
             self.logger.exception(f"Thread : {thread_id} :: Error :{str(e)}")
+            self.handle_failed_queue_item(queue_item, azure_queue, e)
 
-        finally:
-            TaskVisibilityController.clear_data()
+    def delete_queue_item(self, azure_queue: AzureQueue):
+        # Stop the lease renewal first so the message is deleted with its current pop receipt
+        queue_item = TaskVisibilityController.release_queue_item()
+        if queue_item is not None:
+            azure_queue.delete_queue_item(queue_item)
+
+    def quarantine_queue_item(
+        self, queue_item: QueueMessage, azure_queue: AzureQueue, reason
+    ):
+        try:
+            self.poison_queue_service.quarantine(queue_item, azure_queue, reason)
+        except Exception as e:
+            # Keep the message, it is quarantined again on its next delivery
+            self.logger.exception(
+                f"Poison-Queue :: {azure_queue.queue_name} : Quarantining message {queue_item.id} failed :{str(e)}"
+            )
+            return
+        self.mark_quarantined_queue_item_as_failed(queue_item, reason)
+        self.delete_queue_item(azure_queue)
 
-    def process_waiting_queue_items(self, thread_id: int):
+    def mark_quarantined_queue_item_as_failed(self, queue_item: QueueMessage, reason):
+        """Record the failure of a quarantined message where its status is reported"""
         thread_id = ThreadingTool.get_thread_id()
-        self.logger.info(f"Thread : {thread_id} :: Started...")
-        while True:
-            try:
-                # Get queue item from azure queue
-                queue_item = azure_queue_util.dequeue(
-                    visiblity_timeout=global_constants.queue_visiblity_time
-                )
+        try:
+            queue_content = json.loads(queue_item.content)
+            match queue_content.get("message_type", None):
+                case global_constants.queue_message_types.keyword_analysis:
+                    self.keyword_analysis_handle_queue_item.mark_queue_item_as_failed(
+                        queue_item, reason, thread_id
+                    )
+
+                case global_constants.queue_message_types.msds_artifact_upload:
+                    # Release the claim so the file version can be enqueued again
+                    data = queue_content.get("data") or {}
+                    if data.get("idempotency_key") is not None:
+                        self.idempotency_marker_store.finish(
+                            global_constants.queue_message_types.msds_artifact_upload,
+                            data.get("idempotency_key"),
+                            data.get("artifact_upload_run_state_id"),
+                            succeeded=False,
+                        )
+        except Exception as e:
+            # The message is quarantined already, only its reported status is stale
+            self.logger.exception(
+                f"Thread : {thread_id} :: Poison-Queue : Recording the failure of quarantined message {queue_item.id} failed :{str(e)}"
+            )
 
-                # If queue is empty, wait for 5 seconds and continue
-                if queue_item is None:
-                    time.sleep(5)
-                    continue
+    def handle_failed_queue_item(
+        self, queue_item: QueueMessage, azure_queue: AzureQueue, error
+    ):
+        """Quarantine a failed message on its last allowed attempt, else count the attempt for a retry"""
+        if self.poison_queue_service.is_retry_budget_exhausted(queue_item):
+            self.quarantine_queue_item(
+                queue_item, azure_queue, f"{type(error).__name__}: {str(error)}"
+            )
+            return
 
-                self.logger.info(
-                    f"Thread : {thread_id} :: Items in queue : {azure_queue_util.get_queue_length()}."
+        # Stop the lease renewal first so the attempt is recorded with the current pop receipt
+        leased_queue_item = TaskVisibilityController.release_queue_item()
+        if leased_queue_item is None:
+            # Already deleted, or abandoned and visible again for another consumer
+            return
+        try:
+            self.poison_queue_service.record_failed_attempt(
+                leased_queue_item, azure_queue
+            )
+        except Exception as e:
+            # Retried once its visibility expires, only the delivery limit counts it
+            self.logger.warning(
+                f"Poison-Queue :: {azure_queue.queue_name} : Recording a failed attempt of message {queue_item.id} failed :{str(e)}"
+            )
+
+    def build_queue_lanes(self, num_threads):
+        lanes = []
+        lanes_by_queue_name = {}
+        for lane_name in global_constants.queue_lanes.values():
+            azure_queue = AzureQueue(lane_name)
+            concurrency = global_constants.queue_lane_concurrency.get(
+                lane_name, num_threads
+            )
+
+            message_types = [
+                message_type
+                for message_type, message_type_lane in (
+                    global_constants.queue_message_type_lanes.items()
                 )
-                self.logger.info(
-                    f"Thread : {thread_id} :: Queue item : {queue_item.content}"
+                if message_type_lane == lane_name
+            ]
+
+            # A lane without a queue of its own shares the default queue and its lane
+            shared_lane = lanes_by_queue_name.get(azure_queue.queue_name)
+            if shared_lane is not None:
+                shared_lane.concurrency += concurrency
+                shared_lane.message_types.update(message_types)
+                self.logger.warning(
+                    f"Queue lane {lane_name} has no queue of its own, its messages are processed in lane {shared_lane.name}"
                 )
+                continue
+
+            lane = QueueLane(
+                lane_name,
+                azure_queue,
+                weight=global_constants.queue_lane_weights.get(lane_name, 1),
+                concurrency=concurrency,
+                message_types=message_types,
+            )
+            lanes.append(lane)
+            lanes_by_queue_name[azure_queue.queue_name] = lane
+        return lanes
+
+    def build_worker_pools(self, threads_per_pool=None):
+        return [
+            WorkerPool.from_config(message_type, self.logger, threads_per_pool)
+            for message_type in global_constants.queue_message_types.values()
+        ]
+
+    def start(self, threads_per_pool=None):
+        """
+        Start the queue dispatcher and the worker pool of each message type, with
+        `threads_per_pool` threads per pool instead of the configured ones if given
+        """
+        worker_pools = self.build_worker_pools(threads_per_pool)
+        self.queue_dispatcher = QueueDispatcher(
+            self.build_queue_lanes(sum(pool.threads for pool in worker_pools)),
+            worker_pools,
+            self.logger,
+        )
+        self.queue_dispatcher.start()
+        self.threads = []
+        for worker_pool in worker_pools:
+            self.threads.extend(worker_pool.start(self.process_waiting_queue_items))
+        return self.threads
+
+    def drain(self, timeout=global_constants.queue_drain_timeout_seconds):
+        """
+        Stop receiving messages and give the messages in flight `timeout` seconds to
+        finish. Messages still in flight after that are made visible again, so another
+        consumer picks them up right away instead of after their visibility timeout.
+        """
+        with self._drain_lock:
+            if self._drained or self.queue_dispatcher is None:
+                return
+            self._drained = True
+
+        deadline = time.monotonic() + timeout
+        self.logger.info(
+            f"Queue-Processor :: Draining, {VisibilityLeaseRenewer.get_lease_count()} messages in flight"
+        )
+        self.queue_dispatcher.stop(timeout=timeout)
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
 
-                queue_content = json.loads(queue_item.content)
-                queue_item_type = queue_content.get("message_type", None)
-                match queue_item_type:
-                    case global_constants.queue_message_types.keyword_analysis:
-                        self.process_keyword_analysis(queue_item=queue_item)
+        released_count = VisibilityLeaseRenewer.abandon_all()
+        self.logger.info(
+            f"Queue-Processor :: Drained, {released_count} unfinished messages released"
+        )
 
-                    case global_constants.queue_message_types.folder_scan:
-                        self.process_folder_scan(queue_item=queue_item)
+    def install_drain_signal_handler(self, signal_numbers=(signal.SIGTERM,)):
+        """Drain on shutdown signals, then hand over to the handler installed before (e.g. gunicorn's)"""
+        for signal_number in signal_numbers:
+            previous_handler = signal.getsignal(signal_number)
 
-                    case global_constants.queue_message_types.msds_artifact_upload:
-                        self.process_artifact_upload(queue_item=queue_item)
+            def handle_signal(signum, frame, previous_handler=previous_handler):
+                self.drain()
+                if callable(previous_handler):
+                    previous_handler(signum, frame)
+                elif previous_handler == signal.SIG_DFL:
+                    signal.signal(signum, signal.SIG_DFL)
+                    os.kill(os.getpid(), signum)
 
-                    case _:
-                        self.logger.error(
-                            f"Thread : {thread_id} :: Invalid message type : {queue_item_type}"
-                        )
-                        azure_queue_util.delete_queue_item(queue_item)
+            signal.signal(signal_number, handle_signal)
+
+    def get_queue_metrics(self):
+        """Pickup latency of the messages handled by this process, per lane"""
+        return {
+            lane.name: lane.metrics.as_dict() for lane in self.queue_dispatcher.lanes
+        }
+
+    def process_waiting_queue_items(self, worker_pool: WorkerPool):
+        thread_id = ThreadingTool.get_thread_id()
+        self.logger.info(
+            f"Thread : {thread_id} :: Started for {worker_pool.message_type}..."
+        )
+        while True:
+            # Get queue item received by the queue dispatcher for this pool
+            dispatched_message = self.queue_dispatcher.take(worker_pool)
+            if dispatched_message is None:
+                self.logger.info(f"Thread : {thread_id} :: Stopped")
+                return
+            try:
+                self.process_queue_item(
+                    dispatched_message.queue_item,
+                    dispatched_message.azure_queue,
+                    thread_id,
+                    worker_pool,
+                )
 
             # Handle unknown exceptions
             except Exception as e:
                 self.logger.exception(
                     f"Thread : {thread_id} :: Error :{str(e)}",
                 )
+            finally:
+                self.queue_dispatcher.done(dispatched_message)
+
+    def process_queue_item(
+        self,
+        queue_item: QueueMessage,
+        azure_queue: AzureQueue,
+        thread_id,
+        worker_pool: WorkerPool = None,
+    ):
+        """
+        Process a message of any type, whatever lane it was received from. The message
+        is leased and deleted by the calling thread, even when `worker_pool` runs its
+        handler in a worker process.
+        """
+        self.logger.info(f"Thread : {thread_id} :: Queue item : {queue_item.content}")
+
+        # The visibility of the message is extended in the background until it is released
+        TaskVisibilityController.set_queue_item(queue_item, azure_queue, self.logger)
+        try:
+            # Delivered far more often than its attempts allow, e.g. it kills the worker
+            if self.poison_queue_service.is_poison(queue_item):
+                self.quarantine_queue_item(
+                    queue_item,
+                    azure_queue,
+                    "Retry budget exhausted without a recorded failure",
+                )
+                return
+            self.route_queue_item(queue_item, azure_queue, thread_id, worker_pool)
+        except Exception as e:
+            self.handle_failed_queue_item(queue_item, azure_queue, e)
+            raise
+        finally:
+            TaskVisibilityController.clear_data()
+
+    def route_queue_item(
+        self,
+        queue_item: QueueMessage,
+        azure_queue: AzureQueue,
+        thread_id,
+        worker_pool: WorkerPool = None,
+    ):
+        queue_content = json.loads(queue_item.content)
+        queue_item_type = queue_content.get("message_type", None)
+        match queue_item_type:
+            case global_constants.queue_message_types.keyword_analysis:
+                self.process_keyword_analysis(
+                    queue_item=queue_item,
+                    azure_queue=azure_queue,
+                    worker_pool=worker_pool,
+                )
+
+            case global_constants.queue_message_types.folder_scan:
+                self.process_folder_scan(
+                    queue_item=queue_item,
+                    azure_queue=azure_queue,
+                    worker_pool=worker_pool,
+                )
+
+            case global_constants.queue_message_types.msds_artifact_upload:
+                self.process_artifact_upload(
+                    queue_item=queue_item,
+                    azure_queue=azure_queue,
+                    worker_pool=worker_pool,
+                )
+
+            case _:
+                self.logger.error(
+                    f"Thread : {thread_id} :: Invalid message type : {queue_item_type}"
+                )
+                self.delete_queue_item(azure_queue)
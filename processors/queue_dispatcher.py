@@ -0,0 +1,340 @@
+import json
+import time
+import queue
+import random
+import threading
+from logging import Logger
+from azure.storage.queue import QueueMessage
+from global_constants import GlobalConstants
+from utils.azure_queue import AzureQueue
+from processors.queue_metrics import QueueMetrics
+from processors.worker_pool import WorkerPool
+
+global_constants = GlobalConstants
+
+
+class IdleBackoff:
+    """Exponential backoff with jitter between polls of an empty queue"""
+
+    def __init__(
+        self,
+        min_wait_seconds=global_constants.queue_idle_min_wait_seconds,
+        max_wait_seconds=global_constants.queue_idle_max_wait_seconds,
+        multiplier=global_constants.queue_idle_backoff_multiplier,
+    ):
+        self.min_wait_seconds = min_wait_seconds
+        self.max_wait_seconds = max(min_wait_seconds, max_wait_seconds)
+        self.multiplier = max(1.0, multiplier)
+        self.idle_polls = 0
+
+    def reset(self):
+        self.idle_polls = 0
+
+    def next_wait(self):
+        wait_seconds = min(
+            self.max_wait_seconds,
+            self.min_wait_seconds * self.multiplier**self.idle_polls,
+        )
+        # Stop growing once the maximum is reached to avoid overflowing the exponent
+        if wait_seconds < self.max_wait_seconds:
+            self.idle_polls += 1
+        # Jitter spreads the polls of the idle consumers of every pod over time
+        return random.uniform(wait_seconds / 2, wait_seconds)
+
+
+class QueueLane:
+    """
+    A named azure queue polled by the dispatcher with its own weight and concurrency,
+    `message_types` are the types sent to it (all types if empty)
+    """
+
+    def __init__(
+        self, name, azure_queue: AzureQueue, weight=1, concurrency=1, message_types=()
+    ):
+        self.name = name
+        self.azure_queue = azure_queue
+        self.message_types = set(message_types)
+        self.weight = max(1, weight)
+        self.concurrency = max(1, concurrency)
+        self.reserved = 0
+        self.current_weight = 0
+        self.next_poll_at = 0
+        self.idle_backoff = IdleBackoff()
+        self.metrics = QueueMetrics()
+
+
+class DispatchedMessage:
+    """A received message with the lane it has to be acknowledged on and the pool processing it"""
+
+    def __init__(
+        self, queue_item: QueueMessage, lane: QueueLane, pool: WorkerPool, received_at
+    ):
+        self.queue_item = queue_item
+        self.lane = lane
+        self.pool = pool
+        self.received_at = received_at
+
+    @property
+    def azure_queue(self) -> AzureQueue:
+        return self.lane.azure_queue
+
+
+class QueueDispatcher:
+    """
+    Single thread pulling messages from the azure queues in batches for the worker pools.
+
+    Each message type is processed by its own worker pool. Messages are only received
+    when a pool can take them : a pool holds at most `max_in_flight` messages, counting
+    both the messages waiting in its buffer and the ones being processed. The visibility
+    timeout of a message starts when it is received, so keeping the buffers this small
+    avoids messages expiring before a worker picks them up. A lane receives at most the
+    free slots of the fullest pool its messages are routed to, so every received message
+    has a slot in its pool and none is sent back to the queue.
+
+    Several lanes (queues) can be polled. Each lane holds at most `concurrency` messages,
+    so a bulk lane can never take the workers needed by an interactive lane, and lanes
+    with work and free slots are polled in proportion to their weight.
+
+    While a queue is empty its polls back off exponentially. Any message sent by this
+    process wakes the dispatcher immediately, and idle workers are woken as soon as
+    received messages are put in the buffer.
+
+    Once stopped, no message is received anymore, the buffered messages are made visible
+    again and the workers get None from `take` once they finish their current message.
+    """
+
+    def __init__(
+        self,
+        lanes,
+        pools,
+        logger: Logger,
+        batch_size=global_constants.queue_dequeue_batch_size,
+    ):
+        self.lanes = lanes
+        self.pools = {pool.message_type: pool for pool in pools}
+        # Messages of unknown types go to the first pool, which rejects them
+        self.default_pool = pools[0]
+        self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._last_queue_length_sample = 0
+
+        # Work enqueued by this process (e.g. a folder scan fan-out) ends the idle wait
+        AzureQueue.add_enqueue_listener(self.wake)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.run, name="queue-dispatcher", daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+    def wake(self):
+        with self._condition:
+            for lane in self.lanes:
+                lane.next_poll_at = 0
+            self._condition.notify_all()
+
+    def take(self, pool: WorkerPool) -> DispatchedMessage:
+        """Block until a message is available for the calling worker of the pool"""
+        dispatched_message = pool.local_queue.get()
+        if dispatched_message is None:
+            return None
+        dispatched_message.lane.metrics.record_pickup(
+            dispatched_message.queue_item, dispatched_message.received_at
+        )
+        return dispatched_message
+
+    def done(self, dispatched_message: DispatchedMessage):
+        """Release the slot of a message taken by a worker once it is handled"""
+        with self._condition:
+            dispatched_message.lane.reserved -= 1
+            dispatched_message.pool.reserved -= 1
+            # Lanes routed to the pool have free slots again
+            self._condition.notify_all()
+
+    def release(self, dispatched_message: DispatchedMessage):
+        """Make a message which will not be processed by this process visible again"""
+        queue_item = dispatched_message.queue_item
+        try:
+            dispatched_message.azure_queue.update_queue_message(
+                message_id=queue_item.id,
+                pop_receipt=queue_item.pop_receipt,
+                visibility_timeout=0,
+            )
+        except Exception as e:
+            self.logger.warning(
+                f"Queue-Dispatcher :: {dispatched_message.lane.name} : Releasing message {queue_item.id} failed :{str(e)}"
+            )
+        self.done(dispatched_message)
+
+    def stop(self, timeout=None):
+        """Stop receiving messages and release the ones not taken by a worker yet"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        released_count = 0
+        for pool in self.pools.values():
+            while True:
+                try:
+                    dispatched_message = pool.local_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if dispatched_message is not None:
+                    self.release(dispatched_message)
+                    released_count += 1
+            # Wake every worker of the pool once its current message is finished
+            for _ in range(pool.threads):
+                pool.local_queue.put(None)
+
+        self.logger.info(
+            f"Queue-Dispatcher :: Stopped, {released_count} buffered messages released"
+        )
+
+    def get_lane_pools(self, lane: QueueLane):
+        if not lane.message_types:
+            return list(self.pools.values())
+        return [
+            self.pools.get(message_type, self.default_pool)
+            for message_type in lane.message_types
+        ]
+
+    def get_free_slots(self, lane: QueueLane):
+        # The types of the received messages are unknown until they are read, bounding
+        # by the fullest pool guarantees a slot to each of them whatever their type
+        pool_free_slots = min(
+            pool.max_in_flight - pool.reserved for pool in self.get_lane_pools(lane)
+        )
+        return min(lane.concurrency - lane.reserved, pool_free_slots)
+
+    def get_pool(self, queue_item: QueueMessage) -> WorkerPool:
+        try:
+            message_type = json.loads(queue_item.content).get("message_type")
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            message_type = None
+        return self.pools.get(message_type, self.default_pool)
+
+    def select_lane(self):
+        """
+        Smooth weighted round robin over the lanes which have free slots and are due
+        for a poll. Returns (lane, free slots), or (None, seconds to wait).
+        """
+        now = time.monotonic()
+        ready_lanes = []
+        next_poll_at = None
+        for lane in self.lanes:
+            if self.get_free_slots(lane) <= 0:
+                continue
+            if lane.next_poll_at > now:
+                next_poll_at = (
+                    lane.next_poll_at
+                    if next_poll_at is None
+                    else min(next_poll_at, lane.next_poll_at)
+                )
+                continue
+            ready_lanes.append(lane)
+
+        if not ready_lanes:
+            return None, (None if next_poll_at is None else next_poll_at - now)
+
+        total_weight = sum(lane.weight for lane in ready_lanes)
+        for lane in ready_lanes:
+            lane.current_weight += lane.weight
+        selected_lane = max(ready_lanes, key=lambda lane: lane.current_weight)
+        selected_lane.current_weight -= total_weight
+        return selected_lane, self.get_free_slots(selected_lane)
+
+    def wait_for_lane(self):
+        with self._condition:
+            while not self._stopping:
+                lane, free_slots_or_wait = self.select_lane()
+                if lane is not None:
+                    return lane, free_slots_or_wait
+                # No lane ready : wait for a free slot, a wake up or the next due poll
+                self._condition.wait(free_slots_or_wait)
+            return None, 0
+
+    def log_queue_statistics(self):
+        # Logged periodically instead of once per message, this is one extra call per lane and interval
+        now = time.monotonic()
+        if (
+            now - self._last_queue_length_sample
+            < global_constants.queue_length_sample_interval_seconds
+        ):
+            return
+        self._last_queue_length_sample = now
+        for lane in self.lanes:
+            self.logger.info(
+                f"Queue-Dispatcher :: {lane.name} : Pickup latency : {json.dumps(lane.metrics.as_dict())}"
+            )
+            try:
+                self.logger.info(
+                    f"Queue-Dispatcher :: {lane.name} : Items in queue : {lane.azure_queue.get_queue_length()}."
+                )
+            except Exception as e:
+                self.logger.warning(
+                    f"Queue-Dispatcher :: {lane.name} : Queue length sampling failed :{str(e)}"
+                )
+
+    def poll(self, lane: QueueLane, free_slots):
+        queue_items = lane.azure_queue.dequeue_batch(
+            max_messages=min(free_slots, self.batch_size),
+            visiblity_timeout=global_constants.queue_visiblity_time,
+        )
+
+        with self._condition:
+            # If queue is empty, back off until the next poll or a wake up
+            if not queue_items:
+                lane.next_poll_at = time.monotonic() + lane.idle_backoff.next_wait()
+                return
+
+            lane.idle_backoff.reset()
+            lane.next_poll_at = 0
+            dispatched_messages = []
+            received_at = time.monotonic()
+            for queue_item in queue_items:
+                # Free slots only grow between select_lane and here, each pool has room
+                pool = self.get_pool(queue_item)
+                pool.reserved += 1
+                lane.reserved += 1
+                dispatched_messages.append(
+                    DispatchedMessage(queue_item, lane, pool, received_at)
+                )
+
+        for dispatched_message in dispatched_messages:
+            # Received while stopping : the workers may already be gone
+            if self._stopping:
+                self.release(dispatched_message)
+            else:
+                dispatched_message.pool.local_queue.put(dispatched_message)
+
+    def run(self):
+        self.logger.info(
+            f"Queue-Dispatcher :: Started with batch size {self.batch_size}, lanes "
+            + ", ".join(
+                f"{lane.name} ({lane.azure_queue.queue_name}, weight {lane.weight}, concurrency {lane.concurrency})"
+                for lane in self.lanes
+            )
+        )
+        while not self._stopping:
+            lane = None
+            try:
+                lane, free_slots = self.wait_for_lane()
+                if lane is None:
+                    break
+                self.log_queue_statistics()
+                self.poll(lane, free_slots)
+
+            # Handle unknown exceptions
+            except Exception as e:
+                self.logger.exception(f"Queue-Dispatcher :: Error :{str(e)}")
+                if lane is not None:
+                    with self._condition:
+                        lane.next_poll_at = (
+                            time.monotonic() + lane.idle_backoff.next_wait()
+                        )
@@ -0,0 +1,64 @@
+import time
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from azure.storage.queue import QueueMessage
+
+
+class LatencySamples:
+    """Thread safe window of the most recent latency samples, in seconds"""
+
+    def __init__(self, max_samples=1000):
+        self._samples = deque(maxlen=max_samples)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+
+    def as_dict(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+        if not samples:
+            return {"count": count}
+        return {
+            "count": count,
+            "avg_seconds": round(sum(samples) / len(samples), 3),
+            "p50_seconds": round(samples[len(samples) // 2], 3),
+            "p95_seconds": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+            "max_seconds": round(samples[-1], 3),
+        }
+
+
+class QueueMetrics:
+    """
+    Pickup latency of the queue messages handled by this process.
+
+    `pickup_latency` is the time from the insertion of a message to the moment a worker
+    starts it, only measured on the first delivery because a redelivered message keeps
+    its original insertion time. `buffer_wait` is the time a received message waited
+    in the local buffer for a free worker.
+    """
+
+    def __init__(self):
+        self.pickup_latency = LatencySamples()
+        self.buffer_wait = LatencySamples()
+
+    def record_pickup(self, queue_item: QueueMessage, received_at):
+        self.buffer_wait.add(time.monotonic() - received_at)
+        if queue_item.dequeue_count == 1 and queue_item.inserted_on is not None:
+            inserted_on = queue_item.inserted_on
+            if inserted_on.tzinfo is None:
+                inserted_on = inserted_on.replace(tzinfo=timezone.utc)
+            self.pickup_latency.add(
+                max(0.0, (datetime.now(timezone.utc) - inserted_on).total_seconds())
+            )
+
+    def as_dict(self):
+        return {
+            "pickup_latency": self.pickup_latency.as_dict(),
+            "buffer_wait": self.buffer_wait.as_dict(),
+        }
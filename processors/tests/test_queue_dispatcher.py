@@ -0,0 +1,110 @@
+import json
+import logging
+from collections import Counter
+from types import SimpleNamespace
+import pytest
+from utils.azure_queue import AzureQueue
+from processors.queue_dispatcher import QueueDispatcher, QueueLane
+from processors.worker_pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture(autouse=True)
+def enqueue_listeners(monkeypatch):
+    # Dispatchers register a listener on AzureQueue, keep it per test
+    monkeypatch.setattr(AzureQueue, "_enqueue_listeners", [])
+
+
+def make_lane(name, weight, concurrency=100, message_types=()):
+    azure_queue = SimpleNamespace(queue_name=name)
+    return QueueLane(name, azure_queue, weight, concurrency, message_types)
+
+
+def make_dispatcher(lanes, max_in_flight=100):
+    pools = [
+        WorkerPool("keyword-analysis", logger, threads=1, max_in_flight=max_in_flight)
+    ]
+    return QueueDispatcher(lanes, pools, logger)
+
+
+def select_lanes(dispatcher, count):
+    return [dispatcher.select_lane()[0].name for _ in range(count)]
+
+
+def test_lanes_are_polled_in_proportion_to_their_weight():
+    dispatcher = make_dispatcher([make_lane("interactive", 3), make_lane("bulk", 1)])
+    assert Counter(select_lanes(dispatcher, 400)) == {"interactive": 300, "bulk": 100}
+
+
+def test_weighted_round_robin_is_smooth():
+    dispatcher = make_dispatcher([make_lane("interactive", 3), make_lane("bulk", 1)])
+    # The heavier lane never starves the lighter one for more than its weight
+    assert select_lanes(dispatcher, 8) == [
+        "interactive",
+        "interactive",
+        "bulk",
+        "interactive",
+    ] * 2
+
+
+def test_lane_without_free_slots_is_skipped():
+    interactive = make_lane("interactive", 3, concurrency=2)
+    bulk = make_lane("bulk", 1)
+    dispatcher = make_dispatcher([interactive, bulk])
+    interactive.reserved = 2
+
+    assert set(select_lanes(dispatcher, 5)) == {"bulk"}
+    lane, free_slots = dispatcher.select_lane()
+    assert free_slots == 100
+
+
+def test_free_slots_are_bounded_by_the_pool():
+    lane = make_lane("interactive", 1, concurrency=10)
+    dispatcher = make_dispatcher([lane], max_in_flight=4)
+    assert dispatcher.select_lane() == (lane, 4)
+    dispatcher.pools["keyword-analysis"].reserved = 4
+    assert dispatcher.select_lane() == (None, None)
+
+
+def test_backed_off_lane_waits_for_its_next_poll(monkeypatch):
+    monkeypatch.setattr("processors.queue_dispatcher.time.monotonic", lambda: 100.0)
+    interactive = make_lane("interactive", 3)
+    bulk = make_lane("bulk", 1)
+    dispatcher = make_dispatcher([interactive, bulk])
+    interactive.next_poll_at = 105.0
+    bulk.next_poll_at = 102.0
+
+    assert dispatcher.select_lane() == (None, 2.0)
+    dispatcher.wake()
+    assert dispatcher.select_lane()[0] is interactive
+
+
+def test_messages_go_to_the_pool_of_their_type():
+    lane = make_lane("interactive", 1)
+    pools = [
+        WorkerPool("keyword-analysis", logger),
+        WorkerPool("folder-scan", logger),
+    ]
+    dispatcher = QueueDispatcher([lane], pools, logger)
+
+    def message(message_type):
+        return SimpleNamespace(content=json.dumps({"message_type": message_type}))
+
+    assert dispatcher.get_pool(message("folder-scan")) is pools[1]
+    assert dispatcher.get_pool(message("other")) is pools[0]
+    assert dispatcher.get_pool(SimpleNamespace(content="not json")) is pools[0]
+
+
+def test_lane_of_several_types_is_bounded_by_its_fullest_pool():
+    lane = make_lane("bulk", 1, concurrency=10, message_types=("a", "b"))
+    pools = [
+        WorkerPool("a", logger, max_in_flight=4),
+        WorkerPool("b", logger, max_in_flight=4),
+    ]
+    dispatcher = QueueDispatcher([lane], pools, logger)
+    pools[1].reserved = 3
+    # Whatever the types of the received messages, each has a slot in its pool
+    assert dispatcher.select_lane() == (lane, 1)
+    pools[1].reserved = 4
+    assert dispatcher.select_lane() == (None, None)
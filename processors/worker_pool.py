@@ -0,0 +1,135 @@
+import queue
+import threading
+import multiprocessing
+from logging import Logger
+from concurrent.futures import ProcessPoolExecutor
+from global_constants import GlobalConstants
+
+global_constants = GlobalConstants
+
+# Handler of a pool worker process, built on its first message
+_worker_handler = None
+
+
+def build_worker_handler(message_type):
+    """The service call doing the work of a message type, without any queue client"""
+    from utils.logger import Logging
+
+    logger = Logging().get_logger()
+    match message_type:
+        case global_constants.queue_message_types.keyword_analysis:
+            from app.modules.keyword_analysis.services.handle_queue_item import (
+                HandleQueueItem,
+            )
+
+            return HandleQueueItem(logger).extract_api_parameters_and_process_queue_item
+        case global_constants.queue_message_types.folder_scan:
+            from common.folder_reader_service import FolderReader
+
+            return FolderReader(logger).process_folder
+        case global_constants.queue_message_types.msds_artifact_upload:
+            from app.modules.artifact_ingestor.services.artifact_ingestor_service import (
+                ArtifactIngestorService,
+            )
+
+            return ArtifactIngestorService(logger).ingest_artifact
+        case _:
+            raise ValueError(f"No worker handler for message type {message_type}")
+
+
+def run_handler_in_worker_process(message_type, *args):
+    """
+    Runs inside a pool worker process. Only the handler runs here, the message stays
+    leased, released and deleted by the parent process.
+    """
+    global _worker_handler
+    if _worker_handler is None:
+        _worker_handler = build_worker_handler(message_type)
+    return _worker_handler(*args)
+
+
+class WorkerPool:
+    """
+    Worker threads processing the messages of one message type.
+
+    The dispatcher hands the pool at most `max_in_flight` messages at a time, counting
+    the ones waiting in its buffer and the ones being processed, so a slow message type
+    can not hold the workers or the receive budget of the others.
+
+    With `use_processes` every worker thread runs the handler of its message on a pool
+    of spawned processes of the same size, keeping CPU bound handlers away from the GIL
+    of the dispatcher and of the other pools. The worker thread keeps the message
+    leased meanwhile and deletes it, so a drain of the parent process releases it.
+    """
+
+    def __init__(
+        self,
+        message_type,
+        logger: Logger,
+        threads=1,
+        max_in_flight=None,
+        use_processes=False,
+    ):
+        self.message_type = message_type
+        self.logger = logger
+        self.threads = max(1, threads)
+        self.max_in_flight = max(
+            self.threads,
+            max_in_flight or self.threads + global_constants.queue_prefetch_count,
+        )
+        self.use_processes = use_processes
+        self.local_queue = queue.Queue()
+        self.reserved = 0
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, message_type, logger: Logger, threads=None):
+        return cls(
+            message_type,
+            logger,
+            threads=threads
+            or global_constants.queue_worker_pool_threads.get(message_type, 1),
+            max_in_flight=global_constants.queue_worker_pool_max_in_flight.get(
+                message_type
+            ),
+            use_processes=global_constants.queue_worker_pool_processes.get(
+                message_type, False
+            ),
+        )
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.threads,
+                    # Forking a process with running queue threads can deadlock, so spawn workers
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def run_in_worker_process(self, *args):
+        """Run the handler of the message type of the pool in a worker process"""
+        future = self.get_executor().submit(
+            run_handler_in_worker_process, self.message_type, *args
+        )
+        return future.result()
+
+    def start(self, target):
+        """Start the worker threads of the pool, `target` is called with the pool"""
+        self.logger.info(
+            f"Worker-Pool :: {self.message_type} : Starting {self.threads} "
+            f"{'process' if self.use_processes else 'thread'} workers, max in flight {self.max_in_flight}"
+        )
+        threads = []
+        for _ in range(self.threads):
+            thread = threading.Thread(target=target, args=(self,), daemon=True)
+            threads.append(thread)
+            thread.start()
+        return threads
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
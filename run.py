@@ -21,8 +21,6 @@ threading_tool = ThreadingTool
 app_insights_connector = Logging()
 logger = app_insights_connector.get_logger()
 
-queue_processor = QueueProcessor(logger=logger)
-
 app = Flask(__name__)
 
 # App Config
@@ -64,9 +62,11 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 app.register_blueprint(swaggerui_blueprint, url_prefix=swagger_endpoint)
 
 
-# Create 20 threads to process waiting api calls from queue
-threads = threading_tool.create_and_start_threads(
-    queue_processor.process_waiting_queue_items,
-    num_threads=global_constants.no_of_threads,
-    daemon=True,
-)
+# Start one worker pool per message type to process waiting api calls from queue, fed by one queue dispatcher.
+# Disabled when the queue workers run on their own from worker.py
+if global_constants.queue_workers_in_web_process:
+    queue_processor = QueueProcessor(logger=logger)
+    threads = queue_processor.start()
+
+    # On shutdown, let the messages in flight finish and release the unfinished ones
+    queue_processor.install_drain_signal_handler()
@@ -1,9 +1,10 @@
 import json
+import base64
 from global_constants import GlobalConstants
 from app.modules.keyword_analysis.constants import KeywordAnalysisConstants
 from urllib.parse import urlparse
 from logging import Logger
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, BlobBlock, ContentSettings
 
 
 constants = KeywordAnalysisConstants
@@ -27,6 +28,46 @@ class BlobStorage:
         )
         return blob_client.url
 
+    def upload_chunks_to_blob_storage(
+        self, file_paths, chunks, content_type=None, metadata_provider=None
+    ):
+        """
+        Upload a stream of chunks to every blob of `file_paths`, each chunk being staged
+        as one block of each blob before the next one is read, then commit the block
+        lists. Only one chunk is held in memory. `metadata_provider` is called once every
+        chunk is staged, for the metadata to commit with the blobs. Returns the url of
+        each blob by path.
+        """
+        blob_clients = [
+            self.blob_storage_container_client.get_blob_client(file_path)
+            for file_path in file_paths
+        ]
+        block_ids = []
+        for chunk in chunks:
+            # Ids of the blocks of a blob must all have the same length
+            block_id = base64.b64encode(
+                f"{len(block_ids):08d}".encode(globa_constants.utf_8)
+            ).decode(globa_constants.utf_8)
+            for blob_client in blob_clients:
+                blob_client.stage_block(block_id, chunk, length=len(chunk))
+            block_ids.append(block_id)
+
+        metadata = metadata_provider() if metadata_provider is not None else None
+        for blob_client in blob_clients:
+            blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in block_ids],
+                content_settings=ContentSettings(content_type=content_type),
+                metadata=metadata,
+            )
+        return {
+            file_path: blob_client.url
+            for file_path, blob_client in zip(file_paths, blob_clients)
+        }
+
+    def get_file_chunks_from_blob_storage(self, file_path):
+        blob_client = self.blob_storage_container_client.get_blob_client(file_path)
+        return blob_client.download_blob().chunks()
+
     def delete_file_from_blob_storage(self, file_path, thread_id=-1):
         blob_client = self.blob_storage_container_client.get_blob_client(file_path)
         if blob_client.exists():
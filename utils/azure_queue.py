@@ -1,18 +1,61 @@
 import json
 from connectors.azure_queue_connector import AzureQueueConnector
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from azure.storage.queue import QueueMessage
 import time
 import pytz
 from datetime import datetime, timedelta
+from global_constants import GlobalConstants
+
+global_constants = GlobalConstants
 
 
 class AzureQueue:
-    def __init__(self):
-        self.azure_queue_client = AzureQueueConnector().connect()
+    # Callbacks run after every message sent by this process
+    _enqueue_listeners = []
+
+    def __init__(
+        self, queue_lane=global_constants.queue_lanes.interactive, queue_name=None
+    ):
+        self.queue_lane = queue_lane
+        azure_queue_connector = AzureQueueConnector(queue_lane, queue_name)
+        self.queue_name = azure_queue_connector.queue_name
+        self.azure_queue_client = azure_queue_connector.connect()
+        self._poison_queue = None
+
+    @classmethod
+    def for_message_type(cls, message_type):
+        """Queue of the lane the message type is sent to"""
+        return cls(global_constants.queue_message_type_lanes[message_type])
+
+    @classmethod
+    def add_enqueue_listener(cls, listener):
+        cls._enqueue_listeners.append(listener)
+
+    def get_poison_queue(self) -> "AzureQueue":
+        """Queue holding the messages of this queue which exhausted their retries"""
+        if self._poison_queue is None:
+            poison_queue = AzureQueue(
+                self.queue_lane,
+                f"{self.queue_name}{global_constants.queue_poison_suffix}",
+            )
+            poison_queue.create_if_missing()
+            self._poison_queue = poison_queue
+        return self._poison_queue
+
+    def create_if_missing(self):
+        try:
+            self.azure_queue_client.create_queue()
+        except ResourceExistsError:
+            pass
 
     def enqueue(self, payload) -> QueueMessage:
-        message = self.azure_queue_client.send_message(json.dumps(payload))
+        return self.enqueue_content(json.dumps(payload))
+
+    def enqueue_content(self, content) -> QueueMessage:
+        message = self.azure_queue_client.send_message(content)
+        for listener in AzureQueue._enqueue_listeners:
+            listener()
         return message
 
     def dequeue(self, visiblity_timeout) -> QueueMessage:
@@ -20,6 +63,14 @@ class AzureQueue:
             visibility_timeout=visiblity_timeout
         )
 
+    def dequeue_batch(self, max_messages, visiblity_timeout) -> list[QueueMessage]:
+        # Only the first page is read, so a batch always costs a single receive call
+        pages = self.azure_queue_client.receive_messages(
+            messages_per_page=max(1, min(max_messages, 32)),
+            visibility_timeout=visiblity_timeout,
+        ).by_page()
+        return list(next(pages, []))
+
     def delete_queue_item(self, queue_item):
         try:
             self.azure_queue_client.delete_message(queue_item)
@@ -42,3 +93,62 @@ class AzureQueue:
             visibility_timeout=visibility_timeout,
         )
         return updated_message
+
+
+class AsyncAzureQueue:
+    """
+    Coroutine counterpart of AzureQueue on the azure.storage.queue.aio client, for use
+    on the event loop of the process only
+    """
+
+    def __init__(
+        self, queue_lane=global_constants.queue_lanes.interactive, queue_name=None
+    ):
+        self.queue_lane = queue_lane
+        azure_queue_connector = AzureQueueConnector(queue_lane, queue_name)
+        self.queue_name = azure_queue_connector.queue_name
+        self.azure_queue_client = azure_queue_connector.connect_async()
+
+    @classmethod
+    def for_message_type(cls, message_type):
+        """Queue of the lane the message type is sent to"""
+        return cls(global_constants.queue_message_type_lanes[message_type])
+
+    async def enqueue(self, payload) -> QueueMessage:
+        return await self.enqueue_content(json.dumps(payload))
+
+    async def enqueue_content(self, content) -> QueueMessage:
+        message = await self.azure_queue_client.send_message(content)
+        for listener in AzureQueue._enqueue_listeners:
+            listener()
+        return message
+
+    async def dequeue_batch(self, max_messages, visiblity_timeout) -> list[QueueMessage]:
+        # Only the first page is read, so a batch always costs a single receive call
+        pages = self.azure_queue_client.receive_messages(
+            messages_per_page=max(1, min(max_messages, 32)),
+            visibility_timeout=visiblity_timeout,
+        ).by_page()
+        async for page in pages:
+            return [queue_item async for queue_item in page]
+        return []
+
+    async def delete_queue_item(self, queue_item):
+        try:
+            await self.azure_queue_client.delete_message(queue_item)
+            return True
+        except ResourceNotFoundError:
+            return False
+
+    async def update_queue_message(
+        self, message_id, pop_receipt, visibility_timeout=0, new_content=None
+    ) -> QueueMessage:
+        return await self.azure_queue_client.update_message(
+            message_id,
+            pop_receipt=pop_receipt,
+            content=new_content,
+            visibility_timeout=visibility_timeout,
+        )
+
+    async def close(self):
+        await self.azure_queue_client.close()
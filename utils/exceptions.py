@@ -31,3 +31,9 @@ class LanguageModelException(Exception):
     def __init__(self, message="Error while executing language model", details=None):
         super().__init__(message)
         self.details = details
+
+
+class StatusManifestConflictError(Exception):
+    def __init__(self, message="Status manifest was changed concurrently", details=None):
+        super().__init__(message)
+        self.details = details
@@ -0,0 +1,190 @@
+import json
+import hashlib
+from logging import Logger
+from datetime import datetime, timezone
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from global_constants import GlobalConstants
+
+global_constants = GlobalConstants
+
+
+class IdempotencyMarker:
+    """Claim of one version of a file by the run which processes it"""
+
+    def __init__(self, key, owner, status, data=None, updated_at=None, etag=None):
+        self.key = key
+        self.owner = owner
+        self.status = status
+        self.data = data or {}
+        self.updated_at = updated_at
+        self.etag = etag
+
+    def to_dict(self):
+        return {
+            "key": self.key,
+            "owner": self.owner,
+            "status": self.status,
+            "data": self.data,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data, etag):
+        return cls(
+            key=data.get("key"),
+            owner=data.get("owner"),
+            status=data.get("status"),
+            data=data.get("data"),
+            updated_at=data.get("updated_at"),
+            etag=etag,
+        )
+
+    def is_expired(self):
+        """A failed or expired claim can be taken over by a new run"""
+        if self.status == global_constants.idempotency_statuses.failed:
+            return True
+        if self.updated_at is None:
+            return True
+        age_seconds = (
+            datetime.now(timezone.utc) - datetime.fromisoformat(self.updated_at)
+        ).total_seconds()
+        return age_seconds > global_constants.idempotency_marker_ttl_seconds
+
+
+class IdempotencyMarkerStore:
+    """
+    Idempotency markers of queued work, one blob per message type and key.
+
+    The key of a file is derived from its uri and its content version (e.g. the
+    SharePoint eTag), so the same version of a file is only enqueued once while a new
+    version gets a new key. Markers are created only if missing, so concurrent
+    producers can not both claim the same key, and every transition is conditional on
+    the etag last read.
+    """
+
+    def __init__(self, blob_storage_container_client, logger: Logger):
+        self.blob_storage_container_client = blob_storage_container_client
+        self.logger = logger
+
+    @staticmethod
+    def get_key(file_uri, version=None):
+        return hashlib.sha256(
+            f"{file_uri}\n{version or ''}".encode(global_constants.utf_8)
+        ).hexdigest()
+
+    def get_path(self, message_type, key):
+        return f"{global_constants.idempotency_marker_folder}/{message_type}/{key}.json"
+
+    def get_blob_client(self, message_type, key):
+        return self.blob_storage_container_client.get_blob_client(
+            self.get_path(message_type, key)
+        )
+
+    def read(self, message_type, key):
+        try:
+            blob_data = self.get_blob_client(message_type, key).download_blob()
+            return IdempotencyMarker.from_dict(
+                json.loads(blob_data.readall()), blob_data.properties.etag
+            )
+        except ResourceNotFoundError:
+            return None
+
+    def write(self, message_type, marker: IdempotencyMarker, previous_marker=None):
+        """
+        Write the marker if the stored one is still `previous_marker` (None if there was
+        none). Returns the written marker, or None if it was changed concurrently.
+        """
+        marker.updated_at = datetime.now(timezone.utc).isoformat()
+        marker_data = json.dumps(marker.to_dict()).encode(global_constants.utf_8)
+        blob_client = self.get_blob_client(message_type, marker.key)
+        try:
+            if previous_marker is not None:
+                upload_response = blob_client.upload_blob(
+                    marker_data,
+                    blob_type=global_constants.blob_types.block_blob,
+                    overwrite=True,
+                    etag=previous_marker.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            else:
+                upload_response = blob_client.upload_blob(
+                    marker_data,
+                    blob_type=global_constants.blob_types.block_blob,
+                    overwrite=False,
+                )
+        except (ResourceModifiedError, ResourceExistsError, ResourceNotFoundError):
+            return None
+
+        marker.etag = upload_response.get("etag")
+        return marker
+
+    def claim(self, message_type, key, owner, data=None, take_over=False):
+        """
+        Claim a key for `owner` before enqueuing its work. Returns False if another
+        run already holds a live claim on the key, unless `take_over` is set to
+        supersede that run while it is not processing yet.
+        """
+        marker = IdempotencyMarker(
+            key, owner, global_constants.idempotency_statuses.queued, data
+        )
+        if self.write(message_type, marker) is not None:
+            return True
+
+        previous_marker = self.read(message_type, key)
+        if previous_marker is None:
+            return self.write(message_type, marker) is not None
+        if (
+            (
+                take_over
+                and previous_marker.status
+                != global_constants.idempotency_statuses.processing
+            )
+            or previous_marker.owner == owner
+            or previous_marker.is_expired()
+        ):
+            return self.write(message_type, marker, previous_marker) is not None
+        return False
+
+    def start(self, message_type, key, owner):
+        """
+        Mark the work of `owner` as started. Returns None if it can proceed, else the
+        marker of the run holding the key, whose work the caller duplicates.
+        """
+        previous_marker = self.read(message_type, key)
+        if (
+            previous_marker is not None
+            and previous_marker.owner != owner
+            and not previous_marker.is_expired()
+        ):
+            return previous_marker
+
+        marker = IdempotencyMarker(
+            key,
+            owner,
+            global_constants.idempotency_statuses.processing,
+            previous_marker.data if previous_marker is not None else None,
+        )
+        if self.write(message_type, marker, previous_marker) is None:
+            # Claimed concurrently, the caller duplicates that run
+            return self.read(message_type, key)
+        return None
+
+    def finish(self, message_type, key, owner, succeeded=True):
+        """Record the outcome of the run of `owner`, a failed key can be claimed again"""
+        previous_marker = self.read(message_type, key)
+        if previous_marker is None or previous_marker.owner != owner:
+            return
+        previous_marker.status = (
+            global_constants.idempotency_statuses.finished
+            if succeeded
+            else global_constants.idempotency_statuses.failed
+        )
+        if self.write(message_type, previous_marker, previous_marker) is None:
+            self.logger.warning(
+                f"Idempotency-Marker : {message_type} : {key} changed concurrently, outcome of {owner} not recorded"
+            )
@@ -18,6 +18,30 @@ class MySQL:
             self.session.rollback()
             self.logger.exception(f"MYSQL-UTIL : Error: {e}")
 
+    # Add entries to the table in a single transaction, raises if it is rolled back
+    def add_entries(self, data_list):
+        if not data_list:
+            return
+        try:
+            self.session.add_all([self.table(**data) for data in data_list])
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            self.logger.exception(f"MYSQL-UTIL : Error: {e}")
+            raise
+
+    # Update entries by their "id" in a single transaction, raises if it is rolled back
+    def update_entries(self, update_data_list):
+        if not update_data_list:
+            return
+        try:
+            self.session.bulk_update_mappings(self.table, update_data_list)
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            self.logger.exception(f"MYSQL-UTIL : Error: {e}")
+            raise
+
     # Update an entry in the table
     def update_entry(self, record_id, update_data):
         try:
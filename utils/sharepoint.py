@@ -1,11 +1,22 @@
+import time
+import asyncio
+import httpx
+from typing import NamedTuple, Optional
 from global_constants import GlobalConstants
 from msgraph.generated.models.o_data_errors.o_data_error import ODataError
+from kiota_abstractions.api_error import APIError
 from utils.encoding import Encoding
 from msgraph.generated.shares.item.drive_item.drive_item_request_builder import (
     DriveItemRequestBuilder,
 )
 from kiota_abstractions.base_request_configuration import RequestConfiguration
-from msgraph.generated.shares.shares_request_builder import SharesRequestBuilder
+from msgraph.generated.drives.item.items.item.delta.delta_request_builder import (
+    DeltaRequestBuilder,
+)
+from msgraph.generated.drives.item.items.item.children.children_request_builder import (
+    ChildrenRequestBuilder,
+)
+from msgraph.generated.models.drive_item import DriveItem
 from msgraph import GraphServiceClient
 
 global_constants = GlobalConstants
@@ -13,10 +24,39 @@ global_constants = GlobalConstants
 memo = {}
 
 
+class DriveItemRecord(NamedTuple):
+    """The fields of a drive item a folder listing needs, selected with $select"""
+
+    id: str
+    drive_id: str
+    web_url: str
+    is_folder: bool
+    is_deleted: bool
+    e_tag: Optional[str]
+    size: Optional[int]
+    is_root: bool = False
+
+    @classmethod
+    def from_drive_item(cls, drive_item: DriveItem, is_folder):
+        parent_reference = getattr(drive_item, "parent_reference", None)
+        return cls(
+            id=drive_item.id,
+            drive_id=getattr(parent_reference, "drive_id", None),
+            web_url=drive_item.web_url,
+            is_folder=bool(is_folder(drive_item)),
+            is_deleted=getattr(drive_item, "deleted", None) is not None,
+            e_tag=getattr(drive_item, "e_tag", None),
+            size=getattr(drive_item, "size", None),
+            is_root=getattr(drive_item, "root", None) is not None,
+        )
+
+
 class SharePoint:
     def __init__(self, share_point_client: GraphServiceClient):
         self.share_point_client = share_point_client
         self.encoder = Encoding()
+        # Monotonic time until which Graph asked this client to back off
+        self.throttled_until = 0
 
     async def read_file_from_share_point(self, file_uri):
         encoded_url = self.encode_url(file_uri)
@@ -34,109 +74,281 @@ class SharePoint:
 
         return drive_item
 
-    async def get_all_files_from_folder(self, folder_uri):
-        file_locations = []
-        next_link = folder_uri
-
-        while next_link:
-            encoded_uri = self.encode_url(next_link)
-
-            # Get drive items by shared URL or drive URL
-            if next_link == folder_uri:
-                query_params = (
-                    DriveItemRequestBuilder.DriveItemRequestBuilderGetQueryParameters(
-                        expand=["children"]
-                    )
-                )
-                request_configuration = RequestConfiguration(
-                    query_parameters=query_params
-                )
-                result = await self.share_point_client.shares.by_shared_drive_item_id(
-                    encoded_uri
-                ).drive_item.get(request_configuration=request_configuration)
-            else:
-                query_params = (
-                    SharesRequestBuilder.SharesRequestBuilderGetQueryParameters(
-                        expand=["children"]
-                    )
-                )
-                request_configuration = RequestConfiguration(
-                    query_parameters=query_params
-                )
-                result = await self.share_point_client.shares.with_url(next_link).get(
-                    request_configuration=request_configuration
-                )
-
-            # Process the result
-            for child in result.children if next_link == folder_uri else result.value:
-                if getattr(child, "folder", None):
-                    nested_files = await self.get_files_from_folder(child.web_url)
-                    file_locations.extend(nested_files)
-                else:
-                    file_locations.append(child.web_url)
-
-            # Check if there are more pages to fetch
-            next_link = result.additional_data.get("children@odata.nextLink")
+    async def stream_file_from_share_point(
+        self, drive_item: DriveItem, chunk_size=global_constants.blob_upload_block_size
+    ):
+        """
+        Async iterator over the content of a file in chunks of up to `chunk_size`
+        bytes, read from the pre-authenticated download url of its drive item so the
+        file is never held in memory as a whole.
+        """
+        download_url = (drive_item.additional_data or {}).get(
+            global_constants.graph_download_url_key
+        )
+        if not download_url:
+            raise ValueError(f"No download url for drive item {drive_item.id}")
 
-        return file_locations
+        async with httpx.AsyncClient(
+            timeout=global_constants.sharepoint_download_timeout_seconds,
+            follow_redirects=True,
+        ) as http_client:
+            async with http_client.stream("GET", download_url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(chunk_size):
+                    yield chunk
 
     def is_drive_item_folder(self, item):
         return getattr(item, "folder", None) or (
             hasattr(item, "additional_data") and "folder" in item.additional_data
         )
 
-    async def fetch_drive_items(self, shared_url=None, page_link=None):
-        if shared_url:
-            encoded_uri = self.encode_url(shared_url)
-            query_params = (
-                DriveItemRequestBuilder.DriveItemRequestBuilderGetQueryParameters(
-                    expand=["children"]
+    def get_retry_after_seconds(self, error: APIError, attempt):
+        headers = {
+            key.lower(): value for key, value in (error.response_headers or {}).items()
+        }
+        retry_after = headers.get("retry-after")
+        if isinstance(retry_after, (list, tuple)):
+            retry_after = retry_after[0] if retry_after else None
+        try:
+            return max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            return global_constants.sharepoint_throttle_default_wait_seconds * 2**attempt
+
+    async def call_graph(self, request):
+        """
+        Await a Graph call, `request` returns a new coroutine for every attempt. A
+        throttled call waits for its Retry-After, and so do the other calls of this
+        client, so a crawl backs off as a whole instead of hammering the tenant.
+        """
+        attempt = 0
+        while True:
+            wait_seconds = self.throttled_until - time.monotonic()
+            if wait_seconds > 0:
+                await asyncio.sleep(wait_seconds)
+            try:
+                return await request()
+            except APIError as e:
+                if (
+                    e.response_status_code
+                    not in global_constants.graph_throttled_status_codes
+                    or attempt >= global_constants.sharepoint_throttle_max_retries
+                ):
+                    raise
+                self.throttled_until = max(
+                    self.throttled_until,
+                    time.monotonic() + self.get_retry_after_seconds(e, attempt),
                 )
+                attempt += 1
+
+    def get_drive_item_request_configuration(self, query_parameters_class, **kwargs):
+        """Request configuration selecting the DriveItemRecord fields only"""
+        return RequestConfiguration(
+            query_parameters=query_parameters_class(
+                select=list(global_constants.sharepoint_drive_item_fields), **kwargs
             )
-            request_configuration = RequestConfiguration(query_parameters=query_params)
-            result = await self.share_point_client.shares.by_shared_drive_item_id(
+        )
+
+    async def resolve_shared_drive_item(self, shared_url) -> "DriveItemRecord":
+        encoded_uri = self.encode_url(shared_url)
+        request_configuration = self.get_drive_item_request_configuration(
+            DriveItemRequestBuilder.DriveItemRequestBuilderGetQueryParameters
+        )
+        drive_item = await self.call_graph(
+            lambda: self.share_point_client.shares.by_shared_drive_item_id(
                 encoded_uri
             ).drive_item.get(request_configuration=request_configuration)
+        )
+        return DriveItemRecord.from_drive_item(drive_item, self.is_drive_item_folder)
 
-        if page_link:
-            query_params = SharesRequestBuilder.SharesRequestBuilderGetQueryParameters(
-                expand=["children"]
+    async def fetch_drive_items(
+        self,
+        shared_url=None,
+        page_link=None,
+        folder: "DriveItemRecord" = None,
+        page_size=global_constants.sharepoint_page_size,
+    ):
+        """
+        One page of the children of a folder, given by its shared url or its record,
+        or the page at `page_link`. Returns their records and the next page link.
+        """
+        if shared_url:
+            folder = await self.resolve_shared_drive_item(shared_url)
+
+        if folder is not None:
+            request_builder = (
+                self.share_point_client.drives.by_drive_id(folder.drive_id)
+                .items.by_drive_item_id(folder.id)
+                .children
+            )
+            request_configuration = self.get_drive_item_request_configuration(
+                ChildrenRequestBuilder.ChildrenRequestBuilderGetQueryParameters,
+                top=page_size,
             )
-            request_configuration = RequestConfiguration(query_parameters=query_params)
-            result = await self.share_point_client.shares.with_url(page_link).get(
-                request_configuration=request_configuration
+        else:
+            # Next links keep the $select and $top of the first page
+            request_builder = ChildrenRequestBuilder(
+                self.share_point_client.request_adapter, page_link
             )
+            request_configuration = None
 
-        # Check if there are more pages to fetch
-        next_page_link = result.additional_data.get("children@odata.nextLink")
+        result = await self.call_graph(
+            lambda: request_builder.get(request_configuration=request_configuration)
+        )
+        records = [
+            DriveItemRecord.from_drive_item(drive_item, self.is_drive_item_folder)
+            for drive_item in result.value or []
+        ]
+        return records, result.odata_next_link
 
-        result = result.children if shared_url else result.value
-        return result, next_page_link
+    async def crawl_drive_items(
+        self,
+        drive_items=(),
+        folder_uris=(),
+        concurrency=global_constants.sharepoint_crawl_concurrency,
+    ):
+        """
+        Async iterator over the DriveItemRecord of the files in `drive_items` and under
+        `folder_uris`, sub-folders included at any depth. Folders and their next pages
+        are listed breadth first by up to `concurrency` concurrent Graph calls, and every
+        file is yielded as soon as its page is listed, while the crawl goes on.
+        """
+        # (shared url, folder record, next page link) of the pages to list
+        pending_listings = asyncio.Queue()
+        discovered_files = asyncio.Queue()
+        # Put by the crawl once every listing is done, or with the error which ended it
+        crawl_end = object()
+
+        def add_drive_items(items):
+            for child in items:
+                if child.is_folder:
+                    pending_listings.put_nowait((None, child, None))
+                else:
+                    discovered_files.put_nowait(child)
 
-    async def get_files_from_folder_in_batch(
+        async def list_folders():
+            while True:
+                folder_uri, folder, page_link = await pending_listings.get()
+                try:
+                    items, next_page_link = await self.fetch_drive_items(
+                        shared_url=folder_uri, page_link=page_link, folder=folder
+                    )
+                    if next_page_link:
+                        pending_listings.put_nowait((None, None, next_page_link))
+                    add_drive_items(items)
+                except Exception as e:
+                    discovered_files.put_nowait((crawl_end, e))
+                finally:
+                    pending_listings.task_done()
+
+        async def end_crawl():
+            await pending_listings.join()
+            discovered_files.put_nowait((crawl_end, None))
+
+        for folder_uri in folder_uris:
+            pending_listings.put_nowait((folder_uri, None, None))
+        add_drive_items(drive_items)
+        tasks = [
+            asyncio.create_task(list_folders()) for _ in range(max(1, concurrency))
+        ]
+        tasks.append(asyncio.create_task(end_crawl()))
+        try:
+            while True:
+                file = await discovered_files.get()
+                if isinstance(file, tuple) and file[0] is crawl_end:
+                    if file[1] is not None:
+                        raise file[1]
+                    return
+                yield file
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def crawl_folder(
+        self, folder_uri, concurrency=global_constants.sharepoint_crawl_concurrency
+    ):
+        """Async iterator over the DriveItemRecord of every file under the folder"""
+        return self.crawl_drive_items(folder_uris=[folder_uri], concurrency=concurrency)
+
+    async def get_files_from_folder_page(
         self,
         root_folder_uri=None,
         page_link=None,
-        batch_size=10,
+        page_size=global_constants.sharepoint_page_size,
     ):
-        file_locations = []
-
-        # Fetch drive items from sharepoint
+        """
+        List one page of the folder. Returns an async iterator over the DriveItemRecord
+        of its files, including the ones of its sub-folders at any depth, and the link
+        of the next page.
+        """
         result, next_page_link = await self.fetch_drive_items(
-            root_folder_uri, page_link
+            root_folder_uri, page_link, page_size=page_size
         )
+        return self.crawl_drive_items(result), next_page_link
+
+    async def fetch_delta_items(
+        self,
+        folder_uri=None,
+        delta_link=None,
+        page_size=global_constants.sharepoint_page_size,
+    ):
+        """
+        One page of the drive items changed in the drive of a root folder since
+        `delta_link`, or of all its items if None. Returns their records, the next link
+        of the sync and, on its last page, the delta link to start the next sync from.
 
-        # Process the result
-        for child in result:
-            if self.is_drive_item_folder(child):
-                nested_files, next_link = await self.get_files_from_folder_in_batch(
-                    root_folder_uri=child.web_url, next_page_link=next_page_link
+        OneDrive for Business and SharePoint only support delta on the root folder of
+        a drive, see supports_delta_sync.
+        """
+        if delta_link:
+            # Next and delta links keep the $select and $top of the first page
+            request_builder = DeltaRequestBuilder(
+                self.share_point_client.request_adapter, delta_link
+            )
+            request_configuration = None
+        else:
+            folder = await self.resolve_shared_drive_item(folder_uri)
+            if not folder.is_root:
+                raise ValueError(
+                    f"Delta query is only supported on the root folder of a drive : {folder_uri}"
                 )
-                file_locations.extend(nested_files)
-            else:
-                file_locations.append(child.web_url)
+            request_builder = (
+                self.share_point_client.drives.by_drive_id(folder.drive_id)
+                .items.by_drive_item_id(folder.id)
+                .delta
+            )
+            request_configuration = self.get_drive_item_request_configuration(
+                DeltaRequestBuilder.DeltaRequestBuilderGetQueryParameters,
+                top=page_size,
+            )
 
-        return (file_locations, next_page_link)
+        result = await self.call_graph(
+            lambda: request_builder.get(request_configuration=request_configuration)
+        )
+        records = [
+            DriveItemRecord.from_drive_item(drive_item, self.is_drive_item_folder)
+            for drive_item in result.value or []
+        ]
+        return records, result.odata_next_link, result.odata_delta_link
+
+    async def supports_delta_sync(self, folder_uri):
+        """True if the folder is the root folder of its drive, the only one with delta"""
+        folder = await self.resolve_shared_drive_item(folder_uri)
+        return folder.is_root
+
+    async def get_changed_files_from_folder_page(self, folder_uri=None, delta_link=None):
+        """
+        List one page of the changes under the folder. Returns an async iterator over
+        the DriveItemRecord of its added or modified files, the next link of the sync
+        and, on its last page, the delta link of the next sync.
+        """
+        items, next_link, next_delta_link = await self.fetch_delta_items(
+            folder_uri, delta_link
+        )
+        # Delta lists every changed item of the tree, deleted items and folders are skipped
+        changed_files = [
+            item for item in items if not item.is_folder and not item.is_deleted
+        ]
+        return self.crawl_drive_items(changed_files), next_link, next_delta_link
 
     def encode_url(self, file_uri):
         base64_value = self.encoder.encode_data(file_uri)
@@ -0,0 +1,152 @@
+import json
+import itertools
+import logging
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from global_constants import GlobalConstants
+from utils.idempotency_marker import IdempotencyMarker, IdempotencyMarkerStore
+
+global_constants = GlobalConstants
+statuses = global_constants.idempotency_statuses
+message_type = "msds-artifact-upload"
+
+
+class FakeBlobClient:
+    """Conditional uploads of a blob held in a dict, as enforced by blob storage"""
+
+    etags = itertools.count()
+
+    def __init__(self, blobs, path):
+        self.blobs = blobs
+        self.path = path
+
+    def download_blob(self):
+        if self.path not in self.blobs:
+            raise ResourceNotFoundError("not found")
+        data, etag = self.blobs[self.path]
+        return SimpleNamespace(
+            readall=lambda: data, properties=SimpleNamespace(etag=etag)
+        )
+
+    def upload_blob(
+        self, data, blob_type=None, overwrite=False, etag=None, match_condition=None
+    ):
+        if etag is not None:
+            if self.path not in self.blobs:
+                raise ResourceNotFoundError("not found")
+            if self.blobs[self.path][1] != etag:
+                raise ResourceModifiedError("modified")
+        elif not overwrite and self.path in self.blobs:
+            raise ResourceExistsError("exists")
+        new_etag = f"etag-{next(self.etags)}"
+        self.blobs[self.path] = (data, new_etag)
+        return {"etag": new_etag}
+
+
+class FakeContainerClient:
+    def __init__(self):
+        self.blobs = {}
+
+    def get_blob_client(self, path):
+        return FakeBlobClient(self.blobs, path)
+
+
+@pytest.fixture
+def store():
+    return IdempotencyMarkerStore(FakeContainerClient(), logging.getLogger(__name__))
+
+
+def age_marker(store, key, seconds):
+    marker = store.read(message_type, key)
+    updated_at = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+    marker.updated_at = updated_at.isoformat()
+    # Written as is, write() would stamp the current time
+    blob_client = store.get_blob_client(message_type, key)
+    blob_client.blobs[blob_client.path] = (
+        json.dumps(marker.to_dict()).encode(),
+        marker.etag,
+    )
+
+
+def test_key_depends_on_uri_and_version():
+    key = IdempotencyMarkerStore.get_key("https://host/file.pdf", "etag-1")
+    assert key == IdempotencyMarkerStore.get_key("https://host/file.pdf", "etag-1")
+    assert key != IdempotencyMarkerStore.get_key("https://host/file.pdf", "etag-2")
+    assert key != IdempotencyMarkerStore.get_key("https://host/other.pdf", "etag-1")
+
+
+def test_claim_is_exclusive_while_live(store):
+    assert store.claim(message_type, "key", "run-1")
+    assert not store.claim(message_type, "key", "run-2")
+    # The owner can claim again, e.g. a retried scan
+    assert store.claim(message_type, "key", "run-1")
+    assert store.read(message_type, "key").status == statuses.queued
+
+
+def test_take_over_supersedes_a_live_claim(store):
+    assert store.claim(message_type, "key", "run-1")
+    assert store.claim(message_type, "key", "run-2", take_over=True)
+    assert store.read(message_type, "key").owner == "run-2"
+    # The superseded run is now a duplicate
+    assert store.start(message_type, "key", "run-1").owner == "run-2"
+
+
+def test_take_over_does_not_supersede_a_processing_run(store):
+    assert store.claim(message_type, "key", "run-1")
+    assert store.start(message_type, "key", "run-1") is None
+    assert not store.claim(message_type, "key", "run-2", take_over=True)
+    assert store.read(message_type, "key").owner == "run-1"
+
+
+def test_start_and_finish_record_the_outcome(store):
+    store.claim(message_type, "key", "run-1", data={"id": 7})
+    assert store.start(message_type, "key", "run-1") is None
+    marker = store.read(message_type, "key")
+    assert (marker.status, marker.data) == (statuses.processing, {"id": 7})
+
+    store.finish(message_type, "key", "run-1")
+    assert store.read(message_type, "key").status == statuses.finished
+    assert not store.claim(message_type, "key", "run-2")
+
+
+def test_finish_of_another_owner_is_ignored(store):
+    store.claim(message_type, "key", "run-1")
+    store.finish(message_type, "key", "run-2", succeeded=False)
+    assert store.read(message_type, "key").status == statuses.queued
+
+
+def test_failed_claim_can_be_taken_over(store):
+    store.claim(message_type, "key", "run-1")
+    store.finish(message_type, "key", "run-1", succeeded=False)
+    assert store.read(message_type, "key").is_expired()
+    assert store.claim(message_type, "key", "run-2")
+    assert store.start(message_type, "key", "run-2") is None
+
+
+def test_claim_expires_after_its_ttl(store, monkeypatch):
+    monkeypatch.setattr(global_constants, "idempotency_marker_ttl_seconds", 60)
+    store.claim(message_type, "key", "run-1")
+    age_marker(store, "key", 30)
+    assert not store.claim(message_type, "key", "run-2")
+
+    age_marker(store, "key", 90)
+    assert store.claim(message_type, "key", "run-2")
+
+
+@pytest.mark.parametrize(
+    "status, updated_at, expected",
+    [
+        (statuses.processing, None, True),
+        (statuses.failed, datetime.now(timezone.utc).isoformat(), True),
+        (statuses.finished, datetime.now(timezone.utc).isoformat(), False),
+    ],
+)
+def test_is_expired(status, updated_at, expected):
+    marker = IdempotencyMarker("key", "run-1", status, updated_at=updated_at)
+    assert marker.is_expired() is expected
@@ -0,0 +1,140 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from kiota_abstractions.api_error import APIError
+import utils.sharepoint as sharepoint_module
+from utils.sharepoint import SharePoint
+
+drive_reference = SimpleNamespace(drive_id="drive")
+
+
+def folder(item_id):
+    return SimpleNamespace(
+        id=item_id,
+        web_url=f"https://host/{item_id}",
+        folder=SimpleNamespace(child_count=1),
+        e_tag=None,
+        size=None,
+        deleted=None,
+        parent_reference=drive_reference,
+    )
+
+
+def file(item_id):
+    return SimpleNamespace(
+        id=item_id,
+        web_url=f"https://host/{item_id}",
+        folder=None,
+        e_tag=f"etag-{item_id}",
+        size=10,
+        deleted=None,
+        parent_reference=drive_reference,
+    )
+
+
+class FakeGraphClient:
+    """
+    Graph client serving the children of a folder tree, one page per folder and
+    `next_pages` for the folders listed on several pages.
+    """
+
+    def __init__(self, tree, next_pages=None, throttled_calls=()):
+        self.tree = tree
+        self.next_pages = next_pages or {}
+        self.throttled_calls = set(throttled_calls)
+        self.calls = 0
+        self.live_calls = 0
+        self.peak_live_calls = 0
+        self.request_adapter = None
+        self.shares = SimpleNamespace(by_shared_drive_item_id=self.get_shared_item)
+        self.drives = SimpleNamespace(
+            by_drive_id=lambda drive_id: SimpleNamespace(
+                items=SimpleNamespace(by_drive_item_id=self.get_drive_item)
+            )
+        )
+
+    def get_shared_item(self, encoded_url):
+        async def get(request_configuration=None):
+            return folder("root")
+
+        return SimpleNamespace(drive_item=SimpleNamespace(get=get))
+
+    def get_drive_item(self, item_id):
+        async def get(request_configuration=None):
+            return await self.respond(
+                self.tree[item_id], self.next_pages.get(item_id)
+            )
+
+        return SimpleNamespace(children=SimpleNamespace(get=get))
+
+    async def respond(self, value, next_link):
+        self.calls += 1
+        if self.calls in self.throttled_calls:
+            raise APIError("throttled", 429, {"Retry-After": "0.01"})
+        self.live_calls += 1
+        self.peak_live_calls = max(self.peak_live_calls, self.live_calls)
+        await asyncio.sleep(0.01)
+        self.live_calls -= 1
+        return SimpleNamespace(value=value, odata_next_link=next_link)
+
+
+tree = {
+    "root": [folder("a"), folder("b"), file("r1")],
+    "a": [folder("a1"), file("a/x")],
+    "a1": [file("a1/y"), file("a1/z")],
+    "b": [file("b/w")],
+}
+
+
+def crawl(sharepoint, concurrency):
+    async def collect():
+        return [item async for item in sharepoint.crawl_folder("root", concurrency)]
+
+    return asyncio.run(collect())
+
+
+def test_crawl_yields_every_file_of_the_tree():
+    client = FakeGraphClient(tree)
+    files = crawl(SharePoint(client), concurrency=2)
+
+    assert sorted(item.id for item in files) == [
+        "a/x",
+        "a1/y",
+        "a1/z",
+        "b/w",
+        "r1",
+    ]
+    assert all(not item.is_folder and item.drive_id == "drive" for item in files)
+    assert files[0].e_tag == f"etag-{files[0].id}"
+    assert client.peak_live_calls <= 2
+
+
+def test_crawl_follows_next_pages(monkeypatch):
+    class NextPageRequestBuilder(sharepoint_module.ChildrenRequestBuilder):
+        def __init__(self, request_adapter, url):
+            self.url = url
+
+        async def get(self, request_configuration=None):
+            return await client.respond([file("b/page-2")], None)
+
+    monkeypatch.setattr(
+        sharepoint_module, "ChildrenRequestBuilder", NextPageRequestBuilder
+    )
+    client = FakeGraphClient(tree, next_pages={"b": "https://graph/b?page=2"})
+    files = crawl(SharePoint(client), concurrency=4)
+
+    assert "b/page-2" in {item.id for item in files}
+    assert len(files) == 6
+
+
+def test_throttled_listing_is_retried():
+    client = FakeGraphClient(tree, throttled_calls={2})
+    files = crawl(SharePoint(client), concurrency=2)
+    assert len(files) == 5
+
+
+def test_listing_error_ends_the_crawl():
+    broken_tree = dict(tree)
+    del broken_tree["a1"]
+    with pytest.raises(KeyError):
+        crawl(SharePoint(FakeGraphClient(broken_tree)), concurrency=2)
@@ -1,7 +1,14 @@
+import asyncio
+import functools
 import threading
 
 
 class ThreadingTool:
+    # Event loop of the process running the coroutines of every thread
+    _event_loop = None
+    _event_loop_thread = None
+    _event_loop_lock = threading.Lock()
+
     @staticmethod
     def create_and_start_threads(target, args=(), num_threads=1, daemon=True):
         """
@@ -26,3 +33,55 @@ class ThreadingTool:
     @staticmethod
     def get_thread_id():
         return threading.current_thread().ident
+
+    @classmethod
+    def get_event_loop(cls) -> asyncio.AbstractEventLoop:
+        """
+        Event loop of the process, running forever on a background thread. Clients
+        bound to a loop (e.g. the Graph client) are only ever used on this one.
+        """
+        with cls._event_loop_lock:
+            if cls._event_loop is None:
+                event_loop = asyncio.new_event_loop()
+                cls._event_loop_thread = threading.Thread(
+                    target=event_loop.run_forever, name="asyncio-event-loop", daemon=True
+                )
+                cls._event_loop_thread.start()
+                cls._event_loop = event_loop
+            return cls._event_loop
+
+    @classmethod
+    def run_coroutine(cls, coroutine, timeout=None):
+        """
+        Run a coroutine on the event loop of the process and wait for its result. Safe
+        to call from any number of threads, their coroutines run concurrently.
+        """
+        event_loop = cls.get_event_loop()
+        if threading.current_thread() is cls._event_loop_thread:
+            coroutine.close()
+            raise RuntimeError("run_coroutine can not wait on the event loop thread")
+        return asyncio.run_coroutine_threadsafe(coroutine, event_loop).result(timeout)
+
+    @classmethod
+    def iterate_async(cls, async_iterator):
+        """
+        Iterate an async iterator from a synchronous thread, one item at a time, each
+        item being awaited on the event loop of the process.
+        """
+        try:
+            while True:
+                try:
+                    yield cls.run_coroutine(anext(async_iterator))
+                except StopAsyncIteration:
+                    return
+        finally:
+            aclose = getattr(async_iterator, "aclose", None)
+            if aclose is not None:
+                cls.run_coroutine(aclose())
+
+    @staticmethod
+    async def run_blocking(function, *args, **kwargs):
+        """Run a blocking call on the executor of the running event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(function, *args, **kwargs)
+        )
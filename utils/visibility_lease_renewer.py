@@ -0,0 +1,201 @@
+import time
+import logging
+import threading
+from logging import Logger
+from datetime import datetime, timezone
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.queue import QueueMessage
+from global_constants import GlobalConstants
+
+global_constants = GlobalConstants
+
+
+class VisibilityLease:
+    """An in-flight queue message kept invisible by the lease renewer"""
+
+    def __init__(self, queue_item: QueueMessage, azure_queue):
+        self.queue_item = queue_item
+        self.azure_queue = azure_queue
+        self.registered_at = time.monotonic()
+        self.next_renewal_at = self.get_next_renewal_at()
+        self.active = True
+        # Made visible again by abandon_all, its worker must not delete it anymore
+        self.abandoned = False
+        # Held while the pop receipt of the message is being replaced
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_seconds_until_renewal(queue_item: QueueMessage):
+        """Seconds until the visibility of the message has to be extended"""
+        next_visible_on = getattr(queue_item, "next_visible_on", None)
+        if next_visible_on is None:
+            return 0
+        if next_visible_on.tzinfo is None:
+            next_visible_on = next_visible_on.replace(tzinfo=timezone.utc)
+        remaining_seconds = (
+            next_visible_on - datetime.now(timezone.utc)
+        ).total_seconds()
+        return remaining_seconds - global_constants.queue_lease_renew_ahead_seconds
+
+    def get_next_renewal_at(self):
+        """Monotonic time at which the visibility of the message has to be extended"""
+        return time.monotonic() + self.get_seconds_until_renewal(self.queue_item)
+
+
+class VisibilityLeaseRenewer:
+    """
+    Background thread extending the visibility timeout of every in-flight message.
+
+    Workers register a message when they start it and unregister it before deleting
+    or abandoning it. The renewer extends the visibility of each registered message
+    `queue_lease_renew_ahead_seconds` before it expires and stores the new pop receipt
+    on the message itself, so the worker always deletes it with the current receipt.
+    A message is not renewed past `queue_max_lease_seconds`, so a stuck worker does not
+    hold it forever.
+    """
+
+    _leases = set()
+    _condition = threading.Condition()
+    _thread = None
+    _logger = None
+
+    @classmethod
+    def register(cls, queue_item: QueueMessage, azure_queue, logger: Logger = None):
+        lease = VisibilityLease(queue_item, azure_queue)
+        with cls._condition:
+            if logger is not None:
+                cls._logger = logger
+            cls._leases.add(lease)
+            if cls._thread is None:
+                cls._thread = threading.Thread(
+                    target=cls.run, name="visibility-lease-renewer", daemon=True
+                )
+                cls._thread.start()
+            cls._condition.notify_all()
+        return lease
+
+    @classmethod
+    def unregister(cls, lease: VisibilityLease) -> QueueMessage:
+        """
+        Stop renewing the message, returns it with its current pop receipt, or None if
+        it was abandoned meanwhile and may already be handled by another consumer
+        """
+        with cls._condition:
+            cls._leases.discard(lease)
+        # Wait for a renewal in progress so the returned pop receipt is the latest
+        with lease.lock:
+            lease.active = False
+            if lease.abandoned:
+                return None
+        return lease.queue_item
+
+    @classmethod
+    def abandon_all(cls):
+        """
+        Make every registered message visible again right away, for messages whose
+        processing is interrupted. Returns the number of messages released.
+        """
+        with cls._condition:
+            leases = list(cls._leases)
+            cls._leases.clear()
+
+        released_count = 0
+        for lease in leases:
+            with lease.lock:
+                if not lease.active:
+                    continue
+                lease.active = False
+                lease.abandoned = True
+                queue_item = lease.queue_item
+                try:
+                    lease.azure_queue.update_queue_message(
+                        message_id=queue_item.id,
+                        pop_receipt=queue_item.pop_receipt,
+                        visibility_timeout=0,
+                    )
+                    released_count += 1
+                except Exception as e:
+                    cls.log(
+                        logging.WARNING,
+                        f"Releasing message {queue_item.id} failed :{str(e)}",
+                    )
+        return released_count
+
+    @classmethod
+    def get_lease_count(cls):
+        with cls._condition:
+            return len(cls._leases)
+
+    @classmethod
+    def log(cls, level, message):
+        if cls._logger is not None:
+            cls._logger.log(level, f"Visibility-Lease-Renewer :: {message}")
+
+    @classmethod
+    def renew(cls, lease: VisibilityLease):
+        with lease.lock:
+            if not lease.active:
+                return
+            queue_item = lease.queue_item
+            if (
+                time.monotonic() - lease.registered_at
+                > global_constants.queue_max_lease_seconds
+            ):
+                cls.log(
+                    logging.WARNING,
+                    f"Message {queue_item.id} held for more than {global_constants.queue_max_lease_seconds} seconds, lease no longer renewed",
+                )
+                lease.active = False
+                return
+            try:
+                updated_queue_item = lease.azure_queue.update_queue_message(
+                    message_id=queue_item.id,
+                    pop_receipt=queue_item.pop_receipt,
+                    visibility_timeout=global_constants.queue_visiblity_time,
+                )
+            except ResourceNotFoundError:
+                # Deleted, or its lease was lost and another consumer received it
+                cls.log(
+                    logging.WARNING,
+                    f"Message {queue_item.id} lost, lease no longer renewed",
+                )
+                lease.active = False
+                return
+            except Exception as e:
+                cls.log(
+                    logging.WARNING,
+                    f"Renewing message {queue_item.id} failed :{str(e)}",
+                )
+                lease.next_renewal_at = (
+                    time.monotonic() + global_constants.queue_lease_retry_seconds
+                )
+                return
+
+            queue_item.pop_receipt = updated_queue_item.pop_receipt
+            queue_item.next_visible_on = updated_queue_item.next_visible_on
+            lease.next_renewal_at = lease.get_next_renewal_at()
+
+    @classmethod
+    def run(cls):
+        while True:
+            with cls._condition:
+                cls._leases = {lease for lease in cls._leases if lease.active}
+                now = time.monotonic()
+                due_leases = [
+                    lease for lease in cls._leases if lease.next_renewal_at <= now
+                ]
+                if not due_leases:
+                    next_renewal_at = min(
+                        (lease.next_renewal_at for lease in cls._leases), default=None
+                    )
+                    # Wait for the next due renewal or a new registration
+                    cls._condition.wait(
+                        None if next_renewal_at is None else next_renewal_at - now
+                    )
+                    continue
+
+            for lease in due_leases:
+                try:
+                    cls.renew(lease)
+                except Exception as e:
+                    cls.log(logging.ERROR, f"Error :{str(e)}")
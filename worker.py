@@ -0,0 +1,104 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import signal
+import argparse
+import multiprocessing
+from global_constants import GlobalConstants
+from utils.logger import Logging
+from processors.queue import QueueProcessor
+from processors.async_queue import AsyncQueueProcessor
+
+global_constants = GlobalConstants
+
+
+def run_queue_worker(threads_per_pool=None):
+    """Run one queue worker process until it is drained by SIGTERM or SIGINT"""
+    logger = Logging().get_logger()
+    queue_processor = QueueProcessor(logger=logger)
+    threads = queue_processor.start(threads_per_pool=threads_per_pool)
+    queue_processor.install_drain_signal_handler((signal.SIGTERM, signal.SIGINT))
+
+    # Worker threads only return once the processor is drained
+    for thread in threads:
+        thread.join()
+
+
+def run_async_queue_worker(concurrency=None):
+    """Run one asyncio queue worker process until it is drained by SIGTERM or SIGINT"""
+    logger = Logging().get_logger()
+    async_queue_processor = AsyncQueueProcessor(
+        logger=logger,
+        concurrency=concurrency or global_constants.queue_async_concurrency,
+    )
+    async_queue_processor.install_drain_signal_handler((signal.SIGTERM, signal.SIGINT))
+    async_queue_processor.run()
+
+
+def run_worker(runtime, concurrency=None):
+    if runtime == "asyncio":
+        run_async_queue_worker(concurrency)
+    else:
+        run_queue_worker(concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the queue workers independently of the web processes"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=global_constants.queue_worker_processes,
+        help="Number of worker processes (QueueWorkerProcesses)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help=(
+            "Worker threads of each message type pool, defaults to QueueWorkerPoolThreads. "
+            "With the asyncio runtime, messages in flight (QueueAsyncConcurrency)"
+        ),
+    )
+    parser.add_argument(
+        "--runtime",
+        choices=["threads", "asyncio"],
+        default=global_constants.queue_worker_runtime,
+        help="Worker pools of threads, or a single event loop (QueueWorkerRuntime)",
+    )
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.runtime, args.threads)
+        return
+
+    # Forking a process with running threads can deadlock, so spawn the workers
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(args.runtime, args.threads),
+            name=f"queue-worker-{index}",
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # Every worker drains on its own, the parent only forwards the signal and waits
+    def forward_signal(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()